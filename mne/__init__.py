@@ -17,6 +17,7 @@ from .event import (read_events, write_events, find_events, merge_events,
 from .forward import (read_forward_solution, apply_forward, apply_forward_raw,
                       do_forward_solution, average_forward_solutions,
                       write_forward_solution, make_forward_solution,
+                      make_forward_solution_positions,
                       convert_forward_solution, make_field_map)
 from .source_estimate import (read_source_estimate,
                               SourceEstimate, VolSourceEstimate, morph_data,
@@ -28,6 +29,7 @@ from .source_estimate import (read_source_estimate,
                               spatio_temporal_src_connectivity,
                               spatio_temporal_tris_connectivity,
                               spatio_temporal_dist_connectivity,
+                              SpatioTemporalConnectivity,
                               save_stc_as_volume, extract_label_time_course)
 from .surface import (read_bem_surfaces, read_surface, write_bem_surface,
                       write_surface, decimate_surface, read_morph_map,
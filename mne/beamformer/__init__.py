@@ -1,5 +1,8 @@
 """Beamformers for source localization
 """
 
-from ._lcmv import lcmv, lcmv_epochs, lcmv_raw, tf_lcmv
-from ._dics import dics, dics_epochs, dics_source_power, tf_dics
+from ._lcmv import lcmv, lcmv_epochs, lcmv_raw, tf_lcmv, make_lcmv
+from ._dics import dics, dics_epochs, dics_source_power, tf_dics, make_dics
+from ._beamformer import (Beamformer, apply_beamformer,
+                          apply_beamformer_epochs, apply_beamformer_raw,
+                          read_beamformer, write_beamformer)
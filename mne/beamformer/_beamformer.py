@@ -0,0 +1,282 @@
+"""Spatial filters of beamformers, computed once and applied many times
+"""
+
+# Authors: Alexandre Gramfort <gramfort@nmr.mgh.harvard.edu>
+#          Roman Goj <roman.goj@gmail.com>
+#
+# License: BSD (3-clause)
+
+import numpy as np
+
+from ..minimum_norm.inverse import combine_xyz
+from ..source_estimate import _make_stc
+from ..utils import logger, verbose
+
+# version of the file format written by write_beamformer
+_beamformer_format_version = 1
+
+
+class Beamformer(object):
+    """Spatial filter of a LCMV or DICS beamformer
+
+    Use make_lcmv or make_dics to compute the filter and apply_beamformer,
+    apply_beamformer_epochs or apply_beamformer_raw to apply it to data.
+
+    Parameters
+    ----------
+    kind : 'LCMV' | 'DICS'
+        The type of beamformer.
+    weights : array, shape=(n_sources * n_orient, n_channels)
+        The spatial filters. The SSP projection and the whitening of the
+        data are included in the filters.
+    ch_names : list of str
+        The names of the channels the filters apply to.
+    vertno : list of array of int
+        The vertex numbers of the sources.
+    is_free_ori : bool
+        If True, the activity of the three orientations of each source is
+        combined by taking the norm.
+    noise_norm : array, shape=(n_sources,) | None
+        Noise normalization applied after combining the orientations.
+    pick_ori : None | 'normal' | 'max-power'
+        The source orientation picked when computing the filters.
+    subject : str | None
+        The subject name.
+    """
+    def __init__(self, kind, weights, ch_names, vertno, is_free_ori,
+                 noise_norm=None, pick_ori=None, subject=None):
+        self.kind = kind
+        self.weights = weights
+        self.ch_names = list(ch_names)
+        self.vertno = [np.asarray(v) for v in vertno]
+        self.is_free_ori = is_free_ori
+        self.noise_norm = noise_norm
+        self.pick_ori = pick_ori
+        self.subject = subject
+
+    def __repr__(self):
+        s = 'n_sources : %d' % sum(len(v) for v in self.vertno)
+        s += ', n_channels : %d' % len(self.ch_names)
+        s += ', pick_ori : %s' % self.pick_ori
+        return '<Beamformer  |  %s, %s>' % (self.kind, s)
+
+    def save(self, fname):
+        """Save the spatial filter to disk
+
+        Parameters
+        ----------
+        fname : str
+            The name of the file. It should end with .npz.
+        """
+        write_beamformer(fname, self)
+
+    def _apply(self, M, allow_kernel=True):
+        """Apply the filter to channel data of shape (n_channels, n_times)"""
+        W = self.weights
+        linear = (not self.is_free_ori and self.pick_ori != 'max-power'
+                  and not np.iscomplexobj(W))
+        if linear and allow_kernel and M.shape[0] < W.shape[0]:
+            # Linear inverse: delay the computation
+            return (W, M)
+
+        sol = np.dot(W, M)
+        if self.is_free_ori:
+            logger.info('combining the current components...')
+            sol = combine_xyz(sol)
+            if self.noise_norm is not None:
+                sol /= self.noise_norm[:, None]
+        elif not linear:
+            # XXX : STC cannot contain (yet?) complex values
+            sol = np.abs(sol)
+        return sol
+
+
+def write_beamformer(fname, filters):
+    """Write a beamformer spatial filter to disk
+
+    Parameters
+    ----------
+    fname : str
+        The name of the file. It should end with .npz.
+    filters : instance of Beamformer
+        The spatial filter.
+
+    Notes
+    -----
+    The filters are saved in a NumPy .npz file. This format is not stable
+    yet and may change in future versions; the files contain a format
+    version number so that they can be converted.
+    """
+    arrays = dict(format_version=_beamformer_format_version,
+                  kind=filters.kind, weights=filters.weights,
+                  ch_names=np.array(filters.ch_names),
+                  is_free_ori=filters.is_free_ori,
+                  n_vertno=len(filters.vertno),
+                  pick_ori=filters.pick_ori or '',
+                  subject=filters.subject or '')
+    for ii, v in enumerate(filters.vertno):
+        arrays['vertno_%d' % ii] = v
+    if filters.noise_norm is not None:
+        arrays['noise_norm'] = filters.noise_norm
+    np.savez(fname, **arrays)
+
+
+def read_beamformer(fname):
+    """Read a beamformer spatial filter from disk
+
+    Parameters
+    ----------
+    fname : str
+        The name of the file, written by write_beamformer or
+        Beamformer.save.
+
+    Returns
+    -------
+    filters : instance of Beamformer
+        The spatial filter.
+    """
+    fid = np.load(fname)
+    try:
+        version = (int(fid['format_version'])
+                   if 'format_version' in fid.files else 1)
+        if version > _beamformer_format_version:
+            raise ValueError('%s was written in format version %d, which is '
+                             'not supported by this version of MNE (%d)'
+                             % (fname, version, _beamformer_format_version))
+        vertno = [fid['vertno_%d' % ii] for ii in range(int(fid['n_vertno']))]
+        noise_norm = fid['noise_norm'] if 'noise_norm' in fid.files else None
+        filters = Beamformer(str(fid['kind']), fid['weights'],
+                             [str(c) for c in fid['ch_names']], vertno,
+                             bool(fid['is_free_ori']), noise_norm,
+                             str(fid['pick_ori']) or None,
+                             str(fid['subject']) or None)
+    finally:
+        fid.close()
+    return filters
+
+
+def _pick_filter_channels(filters, info):
+    """Find the indices of the channels of a spatial filter in info"""
+    missing = [c for c in filters.ch_names if c not in info['ch_names']]
+    if len(missing) > 0:
+        raise ValueError('The data do not contain the channels used by the '
+                         'spatial filter: %s' % missing)
+    return np.array([info['ch_names'].index(c) for c in filters.ch_names])
+
+
+def _apply_beamformer(filters, data, info, tmin):
+    """Apply a spatial filter to the channel data of each array of data"""
+    picks = _pick_filter_channels(filters, info)
+    tstep = 1.0 / info['sfreq']
+    for i, M in enumerate(data):
+        logger.info("Processing epoch : %d" % (i + 1))
+        sol = filters._apply(M[picks])
+        yield _make_stc(sol, vertices=filters.vertno, tmin=tmin, tstep=tstep,
+                        subject=filters.subject)
+    logger.info('[done]')
+
+
+@verbose
+def apply_beamformer(evoked, filters, verbose=None):
+    """Apply a beamformer spatial filter to evoked data
+
+    Parameters
+    ----------
+    evoked : Evoked
+        Evoked data to invert.
+    filters : instance of Beamformer
+        The spatial filter, computed by make_lcmv or make_dics.
+    verbose : bool, str, int, or None
+        If not None, override default verbose level (see mne.verbose).
+
+    Returns
+    -------
+    stc : SourceEstimate | VolSourceEstimate
+        Source time courses.
+    """
+    picks = _pick_filter_channels(filters, evoked.info)
+    sol = filters._apply(evoked.data[picks])
+    return _make_stc(sol, vertices=filters.vertno, tmin=evoked.times[0],
+                     tstep=1.0 / evoked.info['sfreq'], subject=filters.subject)
+
+
+@verbose
+def apply_beamformer_epochs(epochs, filters, return_generator=False,
+                            verbose=None):
+    """Apply a beamformer spatial filter to single trial data
+
+    The epochs are read one at a time, so the epochs do not need to be
+    preloaded.
+
+    Parameters
+    ----------
+    epochs : Epochs
+        Single trial epochs.
+    filters : instance of Beamformer
+        The spatial filter, computed by make_lcmv or make_dics.
+    return_generator : bool
+        Return a generator object instead of a list. This allows iterating
+        over the stcs without having to keep them all in memory.
+    verbose : bool, str, int, or None
+        If not None, override default verbose level (see mne.verbose).
+
+    Returns
+    -------
+    stc: list | generator of (SourceEstimate | VolSourceEstimate)
+        The source estimates for all epochs.
+    """
+    stcs = _apply_beamformer(filters, epochs, epochs.info, epochs.times[0])
+    if not return_generator:
+        stcs = [s for s in stcs]
+    return stcs
+
+
+@verbose
+def apply_beamformer_raw(raw, filters, start=None, stop=None,
+                         buffer_size=None, verbose=None):
+    """Apply a beamformer spatial filter to raw data
+
+    Parameters
+    ----------
+    raw : mne.fiff.Raw
+        Raw data to invert.
+    filters : instance of Beamformer
+        The spatial filter, computed by make_lcmv or make_dics.
+    start : int
+        Index of first time sample (index not time is seconds).
+    stop : int
+        Index of first time sample not to include (index not time is seconds).
+    buffer_size : int | None
+        If not None, the raw data are read and filtered in blocks of
+        buffer_size samples, which saves memory for long recordings.
+    verbose : bool, str, int, or None
+        If not None, override default verbose level (see mne.verbose).
+
+    Returns
+    -------
+    stc : SourceEstimate | VolSourceEstimate
+        Source time courses.
+    """
+    picks = _pick_filter_channels(filters, raw.info)
+    start = 0 if start is None else start
+    stop = raw.n_times if stop is None else min(stop, raw.n_times)
+    if start < 0 or start >= stop:
+        raise ValueError('start (%d) must be non-negative and smaller than '
+                         'stop (%d)' % (start, stop))
+    if buffer_size is None:
+        data, times = raw[picks, start:stop]
+        tmin = times[0]
+        sol = filters._apply(data)
+    else:
+        sol = list()
+        for block_start in range(start, stop, buffer_size):
+            block_stop = min(block_start + buffer_size, stop)
+            logger.info('Processing samples %d to %d'
+                        % (block_start, block_stop))
+            data, times = raw[picks, block_start:block_stop]
+            if block_start == start:
+                tmin = times[0]
+            sol.append(filters._apply(data, allow_kernel=False))
+        sol = np.concatenate(sol, axis=1)
+    return _make_stc(sol, vertices=filters.vertno, tmin=tmin,
+                     tstep=1.0 / raw.info['sfreq'], subject=filters.subject)
@@ -6,7 +6,6 @@
 # License: BSD (3-clause)
 
 import warnings
-from copy import deepcopy
 
 import numpy as np
 from scipy import linalg
@@ -14,31 +13,28 @@ from scipy import linalg
 from ..utils import logger, verbose
 from ..fiff.pick import pick_types
 from ..forward import _subject_from_forward
-from ..minimum_norm.inverse import combine_xyz
 from ..source_estimate import SourceEstimate
-from ..time_frequency import CrossSpectralDensity, compute_epochs_csd
-from ._lcmv import _prepare_beamformer_input
-from ..externals import six
+from ..time_frequency import CrossSpectralDensity
+from ..time_frequency.csd import _compute_csd_windows, _time_window_slice
+from ._lcmv import (_prepare_beamformer_input, _unit_gain_filters,
+                    _parallel_source_power, _tf_windows, _tf_average_windows)
+from ._beamformer import (Beamformer, apply_beamformer,
+                          apply_beamformer_epochs)
 
 
 @verbose
-def _apply_dics(data, info, tmin, forward, noise_csd, data_csd, reg,
-                label=None, picks=None, pick_ori=None, verbose=None):
-    """Dynamic Imaging of Coherent Sources (DICS).
+def make_dics(info, forward, noise_csd, data_csd, reg=0.01, label=None,
+              picks=None, pick_ori=None, verbose=None):
+    """Compute the spatial filter of a DICS beamformer
 
-    Calculate the DICS spatial filter based on a given cross-spectral
-    density object and return estimates of source activity based on given data.
+    The filter can be applied many times, e.g. to evoked data or epochs with
+    apply_beamformer and apply_beamformer_epochs, and it can be saved to
+    disk.
 
     Parameters
     ----------
-    data : array or list / iterable
-        Sensor space data. If data.ndim == 2 a single observation is assumed
-        and a single stc is returned. If data.ndim == 3 or if data is
-        a list / iterable, a list of stc's is returned.
     info : dict
-        Measurement info.
-    tmin : float
-        Time of first sample.
+        Measurement info, e.g. epochs.info.
     forward : dict
         Forward operator.
     noise_csd : instance of CrossSpectralDensity
@@ -60,11 +56,16 @@ def _apply_dics(data, info, tmin, forward, noise_csd, data_csd, reg,
 
     Returns
     -------
-    stc : SourceEstimate (or list of SourceEstimate)
-        Source time courses.
-    """
+    filters : instance of Beamformer
+        The spatial filter.
 
-    is_free_ori, picks, _, proj, vertno, G =\
+    Notes
+    -----
+    The original reference is:
+    Gross et al. Dynamic imaging of coherent sources: Studying neural
+    interactions in the human brain. PNAS (2001) vol. 98 (2) pp. 694-699
+    """
+    is_free_ori, picks, ch_names, proj, vertno, G =\
         _prepare_beamformer_input(info, forward, label, picks, pick_ori)
 
     Cm = data_csd.data
@@ -76,68 +77,29 @@ def _apply_dics(data, info, tmin, forward, noise_csd, data_csd, reg,
     # Compute spatial filters
     W = np.dot(G.T, Cm_inv)
     n_orient = 3 if is_free_ori else 1
-    n_sources = G.shape[1] // n_orient
 
-    for k in range(n_sources):
-        Wk = W[n_orient * k: n_orient * k + n_orient]
-        Gk = G[:, n_orient * k: n_orient * k + n_orient]
-        Ck = np.dot(Wk, Gk)
-
-        # TODO: max-power is not implemented yet, however DICS does employ
-        # orientation picking when one eigen value is much larger than the
-        # other
-
-        if is_free_ori:
-            # Free source orientation
-            Wk[:] = np.dot(linalg.pinv(Ck, 0.1), Wk)
-        else:
-            # Fixed source orientation
-            Wk /= Ck
+    # TODO: max-power is not implemented yet, however DICS does employ
+    # orientation picking when one eigen value is much larger than the
+    # other
+    W = _unit_gain_filters(W, G, n_orient)
 
-        # Noise normalization
-        noise_norm = np.dot(np.dot(Wk.conj(), noise_csd.data), Wk.T)
-        noise_norm = np.abs(noise_norm).trace()
-        Wk /= np.sqrt(noise_norm)
+    # Noise normalization
+    noise_norm = _abs_quadratic_forms(W, noise_csd.data)
+    noise_norm = noise_norm.reshape(-1, n_orient).sum(axis=1)
+    W /= np.repeat(np.sqrt(noise_norm), n_orient)[:, np.newaxis]
 
     # Pick source orientation normal to cortical surface
     if pick_ori == 'normal':
         W = W[2::3]
         is_free_ori = False
 
-    if isinstance(data, np.ndarray) and data.ndim == 2:
-        data = [data]
-        return_single = True
-    else:
-        return_single = False
+    # Include SSPs in the filters
+    if info['projs']:
+        W = np.dot(W, proj)
 
     subject = _subject_from_forward(forward)
-    for i, M in enumerate(data):
-        if len(M) != len(picks):
-            raise ValueError('data and picks must have the same length')
-
-        if not return_single:
-            logger.info("Processing epoch : %d" % (i + 1))
-
-        # Apply SSPs
-        if info['projs']:
-            M = np.dot(proj, M)
-
-        # project to source space using beamformer weights
-        if is_free_ori:
-            sol = np.dot(W, M)
-            logger.info('combining the current components...')
-            sol = combine_xyz(sol)
-        else:
-            # Linear inverse: do not delay compuation due to non-linear abs
-            sol = np.dot(W, M)
-
-        tstep = 1.0 / info['sfreq']
-        if np.iscomplexobj(sol):
-            sol = np.abs(sol)  # XXX : STC cannot contain (yet?) complex values
-        yield SourceEstimate(sol, vertices=vertno, tmin=tmin, tstep=tstep,
-                             subject=subject)
-
-    logger.info('[done]')
+    return Beamformer('DICS', W, ch_names, vertno, is_free_ori,
+                      pick_ori=pick_ori, subject=subject)
 
 
 @verbose
@@ -186,13 +148,9 @@ def dics(evoked, forward, noise_csd, data_csd, reg=0.01, label=None,
     Gross et al. Dynamic imaging of coherent sources: Studying neural
     interactions in the human brain. PNAS (2001) vol. 98 (2) pp. 694-699
     """
-    info = evoked.info
-    data = evoked.data
-    tmin = evoked.times[0]
-
-    stc = _apply_dics(data, info, tmin, forward, noise_csd, data_csd, reg=reg,
-                      label=label, pick_ori=pick_ori)
-    return six.advance_iterator(stc)
+    filters = make_dics(evoked.info, forward, noise_csd, data_csd, reg=reg,
+                        label=label, pick_ori=pick_ori)
+    return apply_beamformer(evoked, filters)
 
 
 @verbose
@@ -245,21 +203,10 @@ def dics_epochs(epochs, forward, noise_csd, data_csd, reg=0.01, label=None,
     interactions in the human brain. PNAS (2001) vol. 98 (2) pp. 694-699
     """
 
-    info = epochs.info
-    tmin = epochs.times[0]
-
-    # use only the good data channels
-    picks = pick_types(info, meg=True, eeg=True, ref_meg=False,
-                       exclude='bads')
-    data = epochs.get_data()[:, picks, :]
-
-    stcs = _apply_dics(data, info, tmin, forward, noise_csd, data_csd, reg=reg,
-                       label=label, pick_ori=pick_ori)
-
-    if not return_generator:
-        stcs = list(stcs)
-
-    return stcs
+    filters = make_dics(epochs.info, forward, noise_csd, data_csd, reg=reg,
+                        label=label, pick_ori=pick_ori)
+    return apply_beamformer_epochs(epochs, filters,
+                                   return_generator=return_generator)
 
 
 @verbose
@@ -353,70 +300,93 @@ def dics_source_power(info, forward, noise_csds, data_csds, reg=0.01,
         _prepare_beamformer_input(info, forward, label, picks=None,
                                   pick_ori=pick_ori)
 
+    logger.info('Computing DICS source power...')
+    source_power = _dics_source_power(G, is_free_ori, pick_ori,
+                                      [c.data for c in data_csds],
+                                      [c.data for c in noise_csds], reg)
+    logger.info('[done]')
+
+    subject = _subject_from_forward(forward)
+    return SourceEstimate(source_power, vertices=vertno, tmin=fmin / 1000.,
+                          tstep=fstep / 1000., subject=subject)
+
+
+def _abs_quadratic_forms(W, C):
+    """Compute the absolute values of the diagonal of W.conj() C W.T"""
+    return np.abs(np.sum(np.dot(W.conj(), C) * W, axis=1))
+
+
+def _dics_source_power(G, is_free_ori, pick_ori, data_csds, noise_csds, reg):
+    """Compute DICS source power for stacked CSD matrices
+
+    Parameters
+    ----------
+    G : array, shape=(n_channels, n_sources * n_orient)
+        The gain matrix.
+    is_free_ori : bool
+        Whether the forward operator has free orientation.
+    pick_ori : None | 'normal'
+        See dics_source_power.
+    data_csds : array, shape=(n_csds, n_channels, n_channels)
+        The data CSD matrices.
+    noise_csds : array, shape=(n_csds, n_channels, n_channels)
+        The noise CSD matrices used for normalization.
+    reg : float
+        The regularization for the cross-spectral density.
+
+    Returns
+    -------
+    source_power : array, shape=(n_sources, n_csds)
+        The source power normalized by noise power.
+    """
     n_orient = 3 if is_free_ori else 1
     n_sources = G.shape[1] // n_orient
-    source_power = np.zeros((n_sources, len(data_csds)))
     n_csds = len(data_csds)
+    source_power = np.zeros((n_sources, n_csds))
 
-    logger.info('Computing DICS source power...')
-    for i, (data_csd, noise_csd) in enumerate(zip(data_csds, noise_csds)):
+    for i, (Cm, noise_csd) in enumerate(zip(data_csds, noise_csds)):
         if n_csds > 1:
             logger.info('    computing DICS spatial filter %d out of %d' %
                         (i + 1, n_csds))
 
-        Cm = data_csd.data
-
         # Calculating regularized inverse, equivalent to an inverse operation
         # after the following regularization:
         # Cm += reg * np.trace(Cm) / len(Cm) * np.eye(len(Cm))
         Cm_inv = linalg.pinv(Cm, reg)
 
         # Compute spatial filters
-        W = np.dot(G.T, Cm_inv)
-        for k in range(n_sources):
-            Wk = W[n_orient * k: n_orient * k + n_orient]
-            Gk = G[:, n_orient * k: n_orient * k + n_orient]
-            Ck = np.dot(Wk, Gk)
-
-            if is_free_ori:
-                # Free source orientation
-                Wk[:] = np.dot(linalg.pinv(Ck, 0.1), Wk)
-            else:
-                # Fixed source orientation
-                Wk /= Ck
-
-            # Noise normalization
-            noise_norm = np.dot(np.dot(Wk.conj(), noise_csd.data), Wk.T)
-            noise_norm = np.abs(noise_norm).trace()
-
-            # Calculating source power
-            sp_temp = np.dot(np.dot(Wk.conj(), data_csd.data), Wk.T)
-            sp_temp /= max(noise_norm, 1e-40)  # Avoid division by 0
-
-            if pick_ori == 'normal':
-                source_power[k, i] = np.abs(sp_temp)[2, 2]
-            else:
-                source_power[k, i] = np.abs(sp_temp).trace()
+        W = _unit_gain_filters(np.dot(G.T, Cm_inv), G, n_orient)
 
-    logger.info('[done]')
+        # Noise normalization
+        noise_norm = _abs_quadratic_forms(W, noise_csd)
+        noise_norm = noise_norm.reshape(-1, n_orient).sum(axis=1)
 
-    subject = _subject_from_forward(forward)
-    return SourceEstimate(source_power, vertices=vertno, tmin=fmin / 1000.,
-                          tstep=fstep / 1000., subject=subject)
+        # Calculating source power
+        sp_temp = _abs_quadratic_forms(W, Cm).reshape(-1, n_orient)
+        if pick_ori == 'normal':
+            sp_temp = sp_temp[:, 2]
+        else:
+            sp_temp = sp_temp.sum(axis=1)
+        # Avoid division by 0
+        source_power[:, i] = sp_temp / np.maximum(noise_norm, 1e-40)
+
+    return source_power
 
 
 @verbose
 def tf_dics(epochs, forward, noise_csds, tmin, tmax, tstep, win_lengths,
             freq_bins, subtract_evoked=False, mode='fourier', n_ffts=None,
             mt_bandwidths=None, mt_adaptive=False, mt_low_bias=True, reg=0.01,
-            label=None, pick_ori=None, verbose=None):
+            label=None, pick_ori=None, n_jobs=1, verbose=None):
     """5D time-frequency beamforming based on DICS.
 
     Calculate source power in time-frequency windows using a spatial filter
     based on the Dynamic Imaging of Coherent Sources (DICS) beamforming
     approach. For each time window and frequency bin combination cross-spectral
     density (CSD) is computed and used to create a beamformer spatial filter
-    with noise CSD used for normalization.
+    with noise CSD used for normalization. The CSDs of all frequency bins with
+    the same window length, number of FFT samples and multitaper bandwidth
+    are computed in a single pass over the epochs.
 
     NOTE : This implementation has not been heavily tested so please
     report any issues or suggestions.
@@ -462,6 +432,9 @@ def tf_dics(epochs, forward, noise_csds, tmin, tmax, tstep, win_lengths,
     pick_ori : None | 'normal'
         If 'normal', rather than pooling the orientations by taking the norm,
         only the radial component is kept.
+    n_jobs : int
+        Number of jobs to run in parallel. The source power of the time
+        windows and frequency bins is computed in parallel.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
@@ -512,77 +485,87 @@ def tf_dics(epochs, forward, noise_csds, tmin, tmax, tstep, win_lengths,
     if subtract_evoked:
         epochs.subtract_evoked()
 
-    sol_final = []
-    for freq_bin, win_length, noise_csd, n_fft, mt_bandwidth in\
-            zip(freq_bins, win_lengths, noise_csds, n_ffts, mt_bandwidths):
-        n_overlap = int((win_length * 1e3) // (tstep * 1e3))
-
-        # Scale noise CSD to allow data and noise CSDs to have different length
-        noise_csd = deepcopy(noise_csd)
-        noise_csd.data /= noise_csd.n_fft
-
-        sol_single = []
-        sol_overlap = []
-        for i_time in range(n_time_steps):
-            win_tmin = tmin + i_time * tstep
-            win_tmax = win_tmin + win_length
-
-            # If in the last step the last time point was not covered in
-            # previous steps and will not be covered now, a solution needs to
-            # be calculated for an additional time window
-            if i_time == n_time_steps - 1 and win_tmax - tstep < tmax and\
-               win_tmax >= tmax + (epochs.times[-1] - epochs.times[-2]):
-                warnings.warn('Adding a time window to cover last time points')
-                win_tmin = tmax - win_length
-                win_tmax = tmax
-
-            if win_tmax < tmax + (epochs.times[-1] - epochs.times[-2]):
+    is_free_ori, _, _, _, vertno, G =\
+        _prepare_beamformer_input(epochs.info, forward, label, picks=None,
+                                  pick_ori=pick_ori)
+    picks = pick_types(epochs.info, meg=True, eeg=True, eog=False,
+                       ref_meg=False, exclude='bads')
+
+    # Scale noise CSD to allow data and noise CSDs to have different length
+    noise_csds_freqs = [noise_csd.frequencies for noise_csd in noise_csds]
+    noise_csds = [noise_csd.data / noise_csd.n_fft for noise_csd in noise_csds]
+
+    # The frequency bins with the same time windows and spectrum estimation
+    # parameters share the tapered spectra, the CSDs of all bins of a group
+    # are computed in one pass over the epochs
+    group_keys, groups = list(), dict()
+    for i_freq, key in enumerate(zip(win_lengths, n_ffts, mt_bandwidths)):
+        if key not in groups:
+            group_keys.append(key)
+            groups[key] = list()
+        groups[key].append(i_freq)
+
+    # source power for each frequency bin and computed time window
+    sol_single = [None] * len(freq_bins)
+    for key in group_keys:
+        win_length, n_fft, mt_bandwidth = key
+        bins = groups[key]
+        windows = _tf_windows(epochs.times, tmin, tmax, tstep, win_length,
+                              n_time_steps)
+        for win_tmin, win_tmax in windows:
+            for i_freq in bins:
                 logger.info('Computing time-frequency DICS beamformer for '
                             'time window %d to %d ms, in frequency range '
                             '%d to %d Hz' % (win_tmin * 1e3, win_tmax * 1e3,
-                                             freq_bin[0], freq_bin[1]))
-
-                # Calculating data CSD in current time window
-                data_csd = compute_epochs_csd(epochs, mode=mode,
-                                              fmin=freq_bin[0],
-                                              fmax=freq_bin[1], fsum=True,
-                                              tmin=win_tmin, tmax=win_tmax,
-                                              n_fft=n_fft,
-                                              mt_bandwidth=mt_bandwidth,
-                                              mt_low_bias=mt_low_bias)
-
-                # Scale data CSD to allow data and noise CSDs to have different
-                # length
-                data_csd.data /= data_csd.n_fft
-
-                stc = dics_source_power(epochs.info, forward, noise_csd,
-                                        data_csd, reg=reg, label=label,
-                                        pick_ori=pick_ori)
-                sol_single.append(stc.data[:, 0])
-
-            # Average over all time windows that contain the current time
-            # point, which is the current time window along with
-            # n_overlap - 1 previous ones
-            if i_time - n_overlap < 0:
-                curr_sol = np.mean(sol_single[0:i_time + 1], axis=0)
-            else:
-                curr_sol = np.mean(sol_single[i_time - n_overlap + 1:
-                                              i_time + 1], axis=0)
-
-            # The final result for the current time point in the current
-            # frequency bin
-            sol_overlap.append(curr_sol)
-
-        # Gathering solutions for all time points for current frequency bin
-        sol_final.append(sol_overlap)
-
+                                             freq_bins[i_freq][0],
+                                             freq_bins[i_freq][1]))
+
+        # Calculating data CSDs in all time windows
+        tslices = [_time_window_slice(epochs.times, win_tmin, win_tmax)
+                   for win_tmin, win_tmax in windows]
+        data_csds, frequencies, _ = _compute_csd_windows(epochs, picks,
+            tslices, [freq_bins[i_freq] for i_freq in bins], mode=mode,
+            n_fft=n_fft, mt_bandwidth=mt_bandwidth, mt_low_bias=mt_low_bias)
+
+        for tslice, data_csd, freqs in zip(tslices, data_csds, frequencies):
+            for i_freq, this_freqs in zip(bins, freqs):
+                noise_freqs = noise_csds_freqs[i_freq]
+                if (len(this_freqs) != len(noise_freqs) or
+                        not np.allclose(this_freqs, noise_freqs)):
+                    raise ValueError('Data and noise CSDs should be '
+                                     'calculated at identical frequencies')
+            # Scale data CSD to allow data and noise CSDs to have different
+            # length
+            this_n_fft = (len(epochs.times[tslice]) if n_fft is None
+                          else n_fft)
+            data_csd /= this_n_fft
+
+        # The source power of all time windows and frequency bins of the
+        # group is computed in parallel
+        data_csds = np.concatenate(data_csds)
+        group_noise_csds = np.array([noise_csds[i_freq] for i_freq in bins])
+        group_noise_csds = np.tile(group_noise_csds, (len(windows), 1, 1))
+        source_power = _parallel_source_power(_dics_source_power, G,
+                                              is_free_ori, pick_ori,
+                                              [data_csds, group_noise_csds],
+                                              reg, n_jobs)
+        source_power = source_power.reshape(-1, len(windows), len(bins))
+        for ii, i_freq in enumerate(bins):
+            sol_single[i_freq] = list(source_power[:, :, ii].T)
+
+    sol_final = [_tf_average_windows(this_sol_single, win_length, tstep,
+                                     n_time_steps)
+                 for win_length, this_sol_single in zip(win_lengths,
+                                                        sol_single)]
     sol_final = np.array(sol_final)
 
     # Creating stc objects containing all time points for each frequency bin
+    subject = _subject_from_forward(forward)
     stcs = []
     for i_freq, _ in enumerate(freq_bins):
-        stc = SourceEstimate(sol_final[i_freq, :, :].T, vertices=stc.vertno,
-                             tmin=tmin, tstep=tstep, subject=stc.subject)
+        stc = SourceEstimate(sol_final[i_freq, :, :].T, vertices=vertno,
+                             tmin=tmin, tstep=tstep, subject=subject)
         stcs.append(stc)
 
     return stcs
+
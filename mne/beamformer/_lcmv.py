@@ -15,30 +15,32 @@ from ..fiff.constants import FIFF
 from ..fiff.proj import make_projector
 from ..fiff.pick import pick_types, pick_channels_forward, pick_channels_cov
 from ..forward import _subject_from_forward
-from ..minimum_norm.inverse import _get_vertno, combine_xyz
-from ..cov import compute_whitener, compute_covariance
-from ..source_estimate import _make_stc, SourceEstimate
+from ..minimum_norm.inverse import _get_vertno
+from ..cov import compute_whitener, _check_n_samples
+from ..source_estimate import SourceEstimate
 from ..source_space import label_src_vertno_sel
+from ..time_frequency.csd import _time_window_slice
 from ..utils import logger, verbose
+from ..fixes import stacked_eigh, stacked_svd
+from ..parallel import parallel_func
 from .. import Epochs
-from ..externals import six
+from ._beamformer import (Beamformer, apply_beamformer,
+                          apply_beamformer_epochs, apply_beamformer_raw)
 
 
 @verbose
-def _apply_lcmv(data, info, tmin, forward, noise_cov, data_cov, reg,
-                label=None, picks=None, pick_ori=None, verbose=None):
-    """ LCMV beamformer for evoked data, single epochs, and raw data
+def make_lcmv(info, forward, noise_cov, data_cov, reg=0.01, label=None,
+              picks=None, pick_ori=None, verbose=None):
+    """Compute the spatial filter of a LCMV beamformer
+
+    The filter can be applied many times, e.g. to evoked data, epochs or
+    raw data with apply_beamformer, apply_beamformer_epochs and
+    apply_beamformer_raw, and it can be saved to disk.
 
     Parameters
     ----------
-    data : array or list / iterable
-        Sensor space data. If data.ndim == 2 a single observation is assumed
-        and a single stc is returned. If data.ndim == 3 or if data is
-        a list / iterable, a list of stc's is returned.
     info : dict
-        Measurement info.
-    tmin : float
-        Time of first sample.
+        Measurement info, e.g. epochs.info.
     forward : dict
         Forward operator.
     noise_cov : Covariance
@@ -61,10 +63,21 @@ def _apply_lcmv(data, info, tmin, forward, noise_cov, data_cov, reg,
 
     Returns
     -------
-    stc : SourceEstimate | VolSourceEstimate (or list of thereof)
-        Source time courses.
-    """
+    filters : instance of Beamformer
+        The spatial filter.
+
+    Notes
+    -----
+    The original reference is:
+    Van Veen et al. Localization of brain electrical activity via linearly
+    constrained minimum variance spatial filtering.
+    Biomedical Engineering (1997) vol. 44 (9) pp. 867--880
 
+    The reference for finding the max-power orientation is:
+    Sekihara et al. Asymptotic SNR of scalar and vector minimum-variance
+    beamformers for neuromagnetic source reconstruction.
+    Biomedical Engineering (2004) vol. 51 (10) pp. 1726--34
+    """
     is_free_ori, picks, ch_names, proj, vertno, G =\
         _prepare_beamformer_input(info, forward, label, picks, pick_ori)
 
@@ -89,42 +102,29 @@ def _apply_lcmv(data, info, tmin, forward, noise_cov, data_cov, reg,
     # Compute spatial filters
     W = np.dot(G.T, Cm_inv)
     n_orient = 3 if is_free_ori else 1
-    n_sources = G.shape[1] // n_orient
-    for k in range(n_sources):
-        Wk = W[n_orient * k: n_orient * k + n_orient]
-        Gk = G[:, n_orient * k: n_orient * k + n_orient]
-        Ck = np.dot(Wk, Gk)
-
-        # Find source orientation maximizing output source power
-        if pick_ori == 'max-power':
-            eig_vals, eig_vecs = linalg.eigh(Ck)
-
-            # Choosing the eigenvector associated with the middle eigenvalue.
-            # The middle and not the minimal eigenvalue is used because MEG is
-            # insensitive to one (radial) of the three dipole orientations and
-            # therefore the smallest eigenvalue reflects mostly noise.
-            for i in range(3):
-                if i != eig_vals.argmax() and i != eig_vals.argmin():
-                    idx_middle = i
-
-            # TODO: The eigenvector associated with the smallest eigenvalue
-            # should probably be used when using combined EEG and MEG data
-            max_ori = eig_vecs[:, idx_middle]
-
-            Wk[:] = np.dot(max_ori, Wk)
-            Ck = np.dot(max_ori, np.dot(Ck, max_ori))
-            is_free_ori = False
 
-        if is_free_ori:
-            # Free source orientation
-            Wk[:] = np.dot(linalg.pinv(Ck, 0.1), Wk)
-        else:
-            # Fixed source orientation
-            Wk /= Ck
-
-    # Pick source orientation maximizing output source power
+    # Find source orientation maximizing output source power
     if pick_ori == 'max-power':
-        W = W[0::3]
+        # filters and gains of the 3 orientations of each source
+        Wk = W.reshape(-1, 3, W.shape[1])
+        Ck = _stacked_dot(Wk, G.T.reshape(Wk.shape))
+        eig_vals, eig_vecs = stacked_eigh(Ck)
+
+        # Choosing the eigenvector associated with the middle eigenvalue
+        # (eigh returns the eigenvalues in ascending order). The middle and
+        # not the minimal eigenvalue is used because MEG is insensitive to
+        # one (radial) of the three dipole orientations and therefore the
+        # smallest eigenvalue reflects mostly noise.
+        # TODO: The eigenvector associated with the smallest eigenvalue
+        # should probably be used when using combined EEG and MEG data
+        max_ori = eig_vecs[:, :, 1]
+
+        W = np.einsum('ki,kij->kj', max_ori, Wk)
+        Ck = np.einsum('ki,kij,kj->k', max_ori, Ck, max_ori)
+        W /= Ck[:, np.newaxis]
+        is_free_ori = False
+    else:
+        W = _unit_gain_filters(W, G, n_orient)
 
     # Preparing noise normalization
     noise_norm = np.sum(W ** 2, axis=1)
@@ -141,53 +141,55 @@ def _apply_lcmv(data, info, tmin, forward, noise_cov, data_cov, reg,
     if not is_free_ori:
         W /= noise_norm[:, None]
 
-    if isinstance(data, np.ndarray) and data.ndim == 2:
-        data = [data]
-        return_single = True
-    else:
-        return_single = False
+    # Include SSPs and whitening of the data in the filters
+    if info['projs']:
+        whitener = np.dot(whitener, proj)
+    W = np.dot(W, whitener)
+    if not is_free_ori:
+        noise_norm = None
 
     subject = _subject_from_forward(forward)
-    for i, M in enumerate(data):
-        if len(M) != len(picks):
-            raise ValueError('data and picks must have the same length')
+    return Beamformer('LCMV', W, ch_names, vertno, is_free_ori, noise_norm,
+                      pick_ori, subject)
 
-        if not return_single:
-            logger.info("Processing epoch : %d" % (i + 1))
 
-        # SSP and whitening
-        if info['projs']:
-            M = np.dot(proj, M)
-        M = np.dot(whitener, M)
+def _stacked_dot(a, b):
+    """Compute np.dot(a[k], b[k].T) for all matrices of two stacks"""
+    return np.einsum('kij,klj->kil', a, b)
 
-        # project to source space using beamformer weights
 
-        if is_free_ori:
-            sol = np.dot(W, M)
-            logger.info('combining the current components...')
-            sol = combine_xyz(sol)
-            sol /= noise_norm[:, None]
-        else:
-            # Linear inverse: do computation here or delayed
-            if M.shape[0] < W.shape[0] and pick_ori != 'max-power':
-                sol = (W, M)
-            else:
-                sol = np.dot(W, M)
-            if pick_ori == 'max-power':
-                sol = np.abs(sol)
-
-        tstep = 1.0 / info['sfreq']
-        yield _make_stc(sol, vertices=vertno, tmin=tmin, tstep=tstep,
-                        subject=subject)
+def _stacked_pinv(a, cond):
+    """Compute linalg.pinv(a[k], cond) for all matrices of a stack"""
+    u, s, vh = stacked_svd(a)
+    s_inv = np.zeros_like(s)
+    mask = s > cond * s.max(axis=-1)[:, np.newaxis]
+    s_inv[mask] = 1. / s[mask]
+    return np.einsum('kji,kj,klj->kil', vh.conj(), s_inv, u.conj())
 
-    logger.info('[done]')
+
+def _unit_gain_filters(W, G, n_orient):
+    """Normalize the spatial filters of all sources to unit gain
+
+    For each source k, the filter Wk (n_orient x n_channels) is replaced by
+    pinv(Wk Gk, 0.1) Wk for free orientations and by Wk / (Wk Gk) for fixed
+    orientations. All sources are processed at once.
+    """
+    Wk = W.reshape(-1, n_orient, W.shape[1])
+    Ck = _stacked_dot(Wk, G.T.reshape(Wk.shape))
+    if n_orient > 1:
+        # Free source orientation
+        Wk = np.einsum('kij,kjl->kil', _stacked_pinv(Ck, 0.1), Wk)
+    else:
+        # Fixed source orientation
+        Wk = Wk / Ck
+    return Wk.reshape(W.shape)
 
 
 def _prepare_beamformer_input(info, forward, label, picks, pick_ori):
     """Input preparation common for all beamformer functions.
 
     Check input values, prepare channel list and gain matrix. For documentation
-    of parameters, please refer to _apply_lcmv.
+    of parameters, please refer to make_lcmv.
     """
 
     is_free_ori = forward['source_ori'] == FIFF.FIFFV_MNE_FREE_ORI
@@ -286,14 +288,9 @@ def lcmv(evoked, forward, noise_cov, data_cov, reg=0.01, label=None,
     Biomedical Engineering (2004) vol. 51 (10) pp. 1726--34
     """
 
-    info = evoked.info
-    data = evoked.data
-    tmin = evoked.times[0]
-
-    stc = _apply_lcmv(data, info, tmin, forward, noise_cov, data_cov, reg,
-                      label, pick_ori=pick_ori)
-
-    return six.advance_iterator(stc)
+    filters = make_lcmv(evoked.info, forward, noise_cov, data_cov, reg=reg,
+                        label=label, pick_ori=pick_ori)
+    return apply_beamformer(evoked, filters)
 
 
 @verbose
@@ -349,21 +346,10 @@ def lcmv_epochs(epochs, forward, noise_cov, data_cov, reg=0.01, label=None,
     Biomedical Engineering (2004) vol. 51 (10) pp. 1726--34
     """
 
-    info = epochs.info
-    tmin = epochs.times[0]
-
-    # use only the good data channels
-    picks = pick_types(info, meg=True, eeg=True, ref_meg=False,
-                       exclude='bads')
-    data = epochs.get_data()[:, picks, :]
-
-    stcs = _apply_lcmv(data, info, tmin, forward, noise_cov, data_cov, reg,
-                       label, pick_ori=pick_ori)
-
-    if not return_generator:
-        stcs = [s for s in stcs]
-
-    return stcs
+    filters = make_lcmv(epochs.info, forward, noise_cov, data_cov, reg=reg,
+                        label=label, pick_ori=pick_ori)
+    return apply_beamformer_epochs(epochs, filters,
+                                   return_generator=return_generator)
 
 
 @verbose
@@ -423,19 +409,9 @@ def lcmv_raw(raw, forward, noise_cov, data_cov, reg=0.01, label=None,
     Biomedical Engineering (2004) vol. 51 (10) pp. 1726--34
     """
 
-    info = raw.info
-
-    if picks is None:
-        picks = pick_types(info, meg=True, eeg=True, ref_meg=False,
-                           exclude='bads')
-
-    data, times = raw[picks, start:stop]
-    tmin = times[0]
-
-    stc = _apply_lcmv(data, info, tmin, forward, noise_cov, data_cov, reg,
-                      label, picks, pick_ori)
-
-    return six.advance_iterator(stc)
+    filters = make_lcmv(raw.info, forward, noise_cov, data_cov, reg=reg,
+                        label=label, picks=picks, pick_ori=pick_ori)
+    return apply_beamformer_raw(raw, filters, start=start, stop=stop)
 
 
 @verbose
@@ -504,46 +480,122 @@ def _lcmv_source_power(info, forward, noise_cov, data_cov, reg=0.01,
         Cm = np.dot(proj, np.dot(Cm, proj.T))
     Cm = np.dot(whitener, np.dot(Cm, whitener.T))
 
-    # Calculating regularized inverse, equivalent to an inverse operation after
-    # the following regularization:
-    # Cm += reg * np.trace(Cm) / len(Cm) * np.eye(len(Cm))
-    Cm_inv = linalg.pinv(Cm, reg)
+    source_power = _lcmv_source_power_covs(G, is_free_ori, pick_ori,
+                                           Cm[np.newaxis], reg)
 
-    # Compute spatial filters
-    W = np.dot(G.T, Cm_inv)
+    logger.info('[done]')
+
+    subject = _subject_from_forward(forward)
+    return SourceEstimate(source_power, vertices=vertno, tmin=1,
+                          tstep=1, subject=subject)
+
+
+def _lcmv_source_power_covs(G, is_free_ori, pick_ori, data_covs, reg):
+    """Compute LCMV source power for stacked data covariance matrices
+
+    Parameters
+    ----------
+    G : array, shape=(n_channels, n_sources * n_orient)
+        The whitened gain matrix.
+    is_free_ori : bool
+        Whether the forward operator has free orientation.
+    pick_ori : None | 'normal'
+        See _lcmv_source_power.
+    data_covs : array, shape=(n_covs, n_channels, n_channels)
+        The whitened data covariance matrices.
+    reg : float
+        The regularization for the whitened data covariance.
+
+    Returns
+    -------
+    source_power : array, shape=(n_sources, n_covs)
+        The source power normalized by noise power.
+    """
     n_orient = 3 if is_free_ori else 1
-    n_sources = G.shape[1] // n_orient
-    source_power = np.zeros((n_sources, 1))
-    for k in range(n_sources):
-        Wk = W[n_orient * k: n_orient * k + n_orient]
-        Gk = G[:, n_orient * k: n_orient * k + n_orient]
-        Ck = np.dot(Wk, Gk)
+    source_power = np.zeros((G.shape[1] // n_orient, len(data_covs)))
+    for i, Cm in enumerate(data_covs):
+        # Calculating regularized inverse, equivalent to an inverse operation
+        # after the following regularization:
+        # Cm += reg * np.trace(Cm) / len(Cm) * np.eye(len(Cm))
+        Cm_inv = linalg.pinv(Cm, reg)
 
-        if is_free_ori:
-            # Free source orientation
-            Wk[:] = np.dot(linalg.pinv(Ck, 0.1), Wk)
-        else:
-            # Fixed source orientation
-            Wk /= Ck
+        # Compute spatial filters
+        W = _unit_gain_filters(np.dot(G.T, Cm_inv), G, n_orient)
 
         # Noise normalization
-        noise_norm = np.dot(Wk, Wk.T)
-        noise_norm = noise_norm.trace()
-
-        # Calculating source power
-        sp_temp = np.dot(np.dot(Wk, Cm), Wk.T)
-        sp_temp /= max(noise_norm, 1e-40)  # Avoid division by 0
+        noise_norm = np.sum(W ** 2, axis=1).reshape(-1, n_orient).sum(axis=1)
 
+        # Calculating source power, i.e. the diagonal elements of Wk Cm Wk.T
+        sp_temp = np.sum(np.dot(W, Cm) * W, axis=1).reshape(-1, n_orient)
         if pick_ori == 'normal':
-            source_power[k, 0] = sp_temp[2, 2]
+            sp_temp = sp_temp[:, 2]
         else:
-            source_power[k, 0] = sp_temp.trace()
+            sp_temp = sp_temp.sum(axis=1)
+        # Avoid division by 0
+        source_power[:, i] = sp_temp / np.maximum(noise_norm, 1e-40)
 
-    logger.info('[done]')
+    return source_power
 
-    subject = _subject_from_forward(forward)
-    return SourceEstimate(source_power, vertices=vertno, tmin=1,
-                          tstep=1, subject=subject)
+
+def _parallel_source_power(func, G, is_free_ori, pick_ori, mats, reg,
+                           n_jobs):
+    """Run a source power function in parallel over stacks of matrices
+
+    mats is a list of arrays of shape (n_mats, n_channels, n_channels), e.g.
+    the data and noise CSDs. The stacks are split in n_jobs chunks, each job
+    computing the source power for one chunk with
+    func(G, is_free_ori, pick_ori, *(chunks + [reg])).
+    """
+    parallel, p_fun, n_jobs = parallel_func(func, n_jobs)
+    n_mats = len(mats[0])
+    splits = np.array_split(np.arange(n_mats), max(min(n_jobs, n_mats), 1))
+    source_power = parallel(p_fun(G, is_free_ori, pick_ori,
+                                  *([m[idx] for m in mats] + [reg]))
+                            for idx in splits)
+    return np.concatenate(source_power, axis=1)
+
+
+def _tf_windows(times, tmin, tmax, tstep, win_length, n_time_steps):
+    """Get the time windows for which the tf beamformers compute source power
+    """
+    windows = list()
+    for i_time in range(n_time_steps):
+        win_tmin = tmin + i_time * tstep
+        win_tmax = win_tmin + win_length
+
+        # If in the last step the last time point was not covered in
+        # previous steps and will not be covered now, a solution needs to
+        # be calculated for an additional time window
+        if i_time == n_time_steps - 1 and win_tmax - tstep < tmax and\
+           win_tmax >= tmax + (times[-1] - times[-2]):
+            warnings.warn('Adding a time window to cover last time points')
+            win_tmin = tmax - win_length
+            win_tmax = tmax
+
+        if win_tmax < tmax + (times[-1] - times[-2]):
+            windows.append((win_tmin, win_tmax))
+    return windows
+
+
+def _tf_average_windows(sol_single, win_length, tstep, n_time_steps):
+    """Average the source power of the windows overlapping each time step"""
+    n_overlap = int((win_length * 1e3) // (tstep * 1e3))
+
+    sol_overlap = []
+    for i_time in range(n_time_steps):
+        # Average over all time windows that contain the current time
+        # point, which is the current time window along with
+        # n_overlap - 1 previous ones
+        if i_time - n_overlap < 0:
+            curr_sol = np.mean(sol_single[0:i_time + 1], axis=0)
+        else:
+            curr_sol = np.mean(sol_single[i_time - n_overlap + 1:
+                                          i_time + 1], axis=0)
+
+        # The final result for the current time point in the current
+        # frequency bin
+        sol_overlap.append(curr_sol)
+    return sol_overlap
 
 
 @verbose
@@ -593,7 +645,9 @@ def tf_lcmv(epochs, forward, noise_covs, tmin, tmax, tstep, win_lengths,
         only the radial component is kept.
     n_jobs : int | str
         Number of jobs to run in parallel. Can be 'cuda' if scikits.cuda
-        is installed properly and CUDA is initialized.
+        is installed properly and CUDA is initialized, in which case it is
+        only used for band-pass filtering. The source power of the time
+        windows of each frequency bin is computed in parallel.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
@@ -638,11 +692,12 @@ def tf_lcmv(epochs, forward, noise_covs, tmin, tmax, tstep, win_lengths,
     # Multiplying by 1e3 to avoid numerical issues, e.g. 0.3 // 0.05 == 5
     n_time_steps = int(((tmax - tmin) * 1e3) // (tstep * 1e3))
 
+    # The source power of all time windows of a band is computed in parallel
+    n_jobs_power = 1 if n_jobs == 'cuda' else n_jobs
+
     sol_final = []
     for (l_freq, h_freq), win_length, noise_cov in \
             zip(freq_bins, win_lengths, noise_covs):
-        n_overlap = int((win_length * 1e3) // (tstep * 1e3))
-
         raw_band = raw.copy()
         raw_band.filter(l_freq, h_freq, picks=raw_picks, method='iir',
                         n_jobs=n_jobs)
@@ -654,60 +709,53 @@ def tf_lcmv(epochs, forward, noise_covs, tmin, tmax, tstep, win_lengths,
         if subtract_evoked:
             epochs_band.subtract_evoked()
 
-        sol_single = []
-        sol_overlap = []
-        for i_time in range(n_time_steps):
-            win_tmin = tmin + i_time * tstep
-            win_tmax = win_tmin + win_length
-
-            # If in the last step the last time point was not covered in
-            # previous steps and will not be covered now, a solution needs to
-            # be calculated for an additional time window
-            if i_time == n_time_steps - 1 and win_tmax - tstep < tmax and\
-               win_tmax >= tmax + (epochs.times[-1] - epochs.times[-2]):
-                warnings.warn('Adding a time window to cover last time points')
-                win_tmin = tmax - win_length
-                win_tmax = tmax
-
-            if win_tmax < tmax + (epochs.times[-1] - epochs.times[-2]):
-                logger.info('Computing time-frequency LCMV beamformer for '
-                            'time window %d to %d ms, in frequency range '
-                            '%d to %d Hz' % (win_tmin * 1e3, win_tmax * 1e3,
-                                             l_freq, h_freq))
-
-                # Calculating data covariance from filtered epochs in current
-                # time window
-                data_cov = compute_covariance(epochs_band, tmin=win_tmin,
-                                              tmax=win_tmax)
-
-                stc = _lcmv_source_power(epochs_band.info, forward, noise_cov,
-                                         data_cov, reg=reg, label=label,
-                                         pick_ori=pick_ori, verbose=verbose)
-                sol_single.append(stc.data[:, 0])
-
-            # Average over all time windows that contain the current time
-            # point, which is the current time window along with
-            # n_overlap - 1 previous ones
-            if i_time - n_overlap < 0:
-                curr_sol = np.mean(sol_single[0:i_time + 1], axis=0)
-            else:
-                curr_sol = np.mean(sol_single[i_time - n_overlap + 1:
-                                              i_time + 1], axis=0)
-
-            # The final result for the current time point in the current
-            # frequency bin
-            sol_overlap.append(curr_sol)
+        is_free_ori, picks, _, proj, vertno, G =\
+            _prepare_beamformer_input(epochs_band.info, forward, label, None,
+                                      pick_ori)
+
+        # Whiten the leadfield, the SSPs and the whitening are applied to the
+        # data covariances
+        whitener, _ = compute_whitener(noise_cov, epochs_band.info, picks)
+        G = np.dot(whitener, G)
+        if epochs_band.info['projs']:
+            whitener = np.dot(whitener, proj)
+
+        # The band-pass filtered epochs are read once and the covariances of
+        # all time windows are computed from them
+        data = epochs_band.get_data()[:, picks]
+        del epochs_band
+        windows = _tf_windows(epochs.times, tmin, tmax, tstep, win_length,
+                              n_time_steps)
+        data_covs = np.empty((len(windows), len(picks), len(picks)))
+        for i_win, (win_tmin, win_tmax) in enumerate(windows):
+            logger.info('Computing time-frequency LCMV beamformer for '
+                        'time window %d to %d ms, in frequency range '
+                        '%d to %d Hz' % (win_tmin * 1e3, win_tmax * 1e3,
+                                         l_freq, h_freq))
+            tslice = _time_window_slice(epochs.times, win_tmin, win_tmax)
+            X = data[:, :, tslice].transpose(1, 0, 2)
+            X = X.reshape(len(picks), -1)
+            _check_n_samples(X.shape[1], len(picks))
+            Cm = np.dot(X, X.T) / X.shape[1]
+            data_covs[i_win] = np.dot(whitener, np.dot(Cm, whitener.T))
+        del data
+
+        source_power = _parallel_source_power(_lcmv_source_power_covs, G,
+                                              is_free_ori, pick_ori,
+                                              [data_covs], reg, n_jobs_power)
 
         # Gathering solutions for all time points for current frequency bin
-        sol_final.append(sol_overlap)
+        sol_final.append(_tf_average_windows(list(source_power.T), win_length,
+                                             tstep, n_time_steps))
 
     sol_final = np.array(sol_final)
 
     # Creating stc objects containing all time points for each frequency bin
+    subject = _subject_from_forward(forward)
     stcs = []
     for i_freq, _ in enumerate(freq_bins):
-        stc = SourceEstimate(sol_final[i_freq, :, :].T, vertices=stc.vertno,
-                             tmin=tmin, tstep=tstep, subject=stc.subject)
+        stc = SourceEstimate(sol_final[i_freq, :, :].T, vertices=vertno,
+                             tmin=tmin, tstep=tstep, subject=subject)
         stcs.append(stc)
 
     return stcs
@@ -0,0 +1,103 @@
+import os.path as op
+
+from nose.tools import assert_true, assert_raises, assert_equal
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+import mne
+from mne.beamformer import (make_lcmv, make_dics, lcmv, lcmv_epochs,
+                            lcmv_raw, dics_epochs, apply_beamformer,
+                            apply_beamformer_epochs, apply_beamformer_raw,
+                            read_beamformer, write_beamformer)
+from mne.time_frequency import compute_epochs_csd
+from mne.utils import _TempDir
+from mne.beamformer.tests.test_dics import _fake_data
+
+tempdir = _TempDir()
+
+
+def test_lcmv_filter():
+    """Test computing the LCMV filter once and applying it many times
+    """
+    raw, epochs, forward = _fake_data()
+    noise_cov = mne.compute_covariance(epochs, tmax=0.)
+    data_cov = mne.compute_covariance(epochs)
+    evoked = epochs.average()
+
+    for pick_ori in [None, 'normal', 'max-power']:
+        filters = make_lcmv(epochs.info, forward, noise_cov, data_cov,
+                            reg=0.05, pick_ori=pick_ori)
+        assert_true(repr(filters).startswith('<Beamformer  |  LCMV'))
+
+        # the filter gives the same results as the one-shot functions
+        stc = apply_beamformer(evoked, filters)
+        stc_lcmv = lcmv(evoked, forward, noise_cov, data_cov, reg=0.05,
+                        pick_ori=pick_ori)
+        assert_array_almost_equal(stc.data, stc_lcmv.data)
+        assert_equal(stc.tmin, stc_lcmv.tmin)
+
+        stcs = apply_beamformer_epochs(epochs, filters, return_generator=True)
+        stcs_lcmv = lcmv_epochs(epochs, forward, noise_cov, data_cov,
+                                reg=0.05, pick_ori=pick_ori)
+        for stc, stc_lcmv in zip(stcs, stcs_lcmv):
+            assert_array_almost_equal(stc.data, stc_lcmv.data)
+
+        stc_raw = lcmv_raw(raw, forward, noise_cov, data_cov, reg=0.05,
+                           start=100, stop=1000, pick_ori=pick_ori)
+        for buffer_size in [None, 128, 1000]:
+            stc = apply_beamformer_raw(raw, filters, start=100, stop=1000,
+                                       buffer_size=buffer_size)
+            assert_array_almost_equal(stc.data, stc_raw.data)
+            assert_equal(stc.tmin, stc_raw.tmin)
+        assert_raises(ValueError, apply_beamformer_raw, raw, filters,
+                      start=1000, stop=100, buffer_size=128)
+        assert_raises(ValueError, apply_beamformer_raw, raw, filters,
+                      start=raw.n_times)
+
+        # saving and reading the filter
+        fname = op.join(tempdir, 'test-lcmv.npz')
+        filters.save(fname)
+        filters_read = read_beamformer(fname)
+        assert_array_equal(filters_read.weights, filters.weights)
+        assert_equal(filters_read.ch_names, filters.ch_names)
+        assert_equal(filters_read.pick_ori, pick_ori)
+        assert_equal(filters_read.subject, None)
+        assert_array_almost_equal(apply_beamformer(evoked, filters).data,
+                                  apply_beamformer(evoked, filters_read).data)
+
+    # files of newer format versions are not read
+    arrays = dict(np.load(fname))
+    arrays['format_version'] = 1000
+    np.savez(fname, **arrays)
+    assert_raises(ValueError, read_beamformer, fname)
+
+    # the channels of the filter must be present in the data
+    evoked.info['ch_names'] = ['foo'] + evoked.info['ch_names'][1:]
+    assert_raises(ValueError, apply_beamformer, evoked, filters)
+
+
+def test_dics_filter():
+    """Test computing the DICS filter once and applying it many times
+    """
+    _, epochs, forward = _fake_data()
+    data_csd = compute_epochs_csd(epochs, fmin=8, fmax=20)
+    noise_csd = compute_epochs_csd(epochs, fmin=8, fmax=20, tmax=0.)
+
+    for pick_ori in [None, 'normal']:
+        filters = make_dics(epochs.info, forward, noise_csd, data_csd,
+                            reg=0.05, pick_ori=pick_ori)
+        stcs = apply_beamformer_epochs(epochs, filters)
+        stcs_dics = dics_epochs(epochs, forward, noise_csd, data_csd,
+                                reg=0.05, pick_ori=pick_ori)
+        assert_equal(len(stcs), len(stcs_dics))
+        for stc, stc_dics in zip(stcs, stcs_dics):
+            assert_array_almost_equal(stc.data, stc_dics.data)
+
+        fname = op.join(tempdir, 'test-dics.npz')
+        write_beamformer(fname, filters)
+        filters_read = read_beamformer(fname)
+        assert_true(np.iscomplexobj(filters_read.weights))
+        assert_equal(filters_read.kind, 'DICS')
+        assert_array_equal(filters_read.weights, filters.weights)
+        for v, v_read in zip(filters.vertno, filters_read.vertno):
+            assert_array_equal(v, v_read)
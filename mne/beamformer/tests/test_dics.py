@@ -296,3 +296,79 @@ def test_tf_dics():
                    label=label)
 
     assert_array_almost_equal(stcs[0].data, np.zeros_like(stcs[0].data))
+
+
+def _fake_forward(info, n_sources, rng):
+    """Make a forward operator with a random free orientation gain matrix"""
+    from mne.fiff.constants import FIFF
+    ch_names = info['ch_names']
+    vertno = [np.arange(n_sources // 2), np.arange(n_sources - n_sources // 2)]
+    G = rng.randn(len(ch_names), 3 * n_sources)
+    src = [dict(type='surf', vertno=v) for v in vertno]
+    return dict(source_ori=FIFF.FIFFV_MNE_FREE_ORI, surf_ori=True, src=src,
+                sol=dict(data=G, row_names=ch_names, nrow=len(ch_names),
+                         ncol=3 * n_sources),
+                _orig_sol=G, sol_grad=None, nchan=len(ch_names),
+                info=dict(ch_names=ch_names, chs=info['chs'],
+                          nchan=len(ch_names), bads=[]))
+
+
+def _fake_data(preload=False):
+    """Make synthetic raw data, epochs and a forward operator"""
+    from mne.fiff.array import RawArray, create_info
+    rng = np.random.RandomState(0)
+    n_channels, sfreq = 8, 200.
+    info = create_info(['EEG %03d' % ii for ii in range(n_channels)], sfreq,
+                       ['eeg'] * n_channels)
+    raw = RawArray(rng.randn(n_channels, 6000), info)
+    events = np.c_[np.arange(200, 5600, 300), np.zeros(18, int),
+                   np.ones(18, int)]
+    epochs = mne.Epochs(raw, events, 1, -0.4, 0.4, baseline=(None, 0),
+                        preload=preload)
+    forward = _fake_forward(epochs.info, 10, rng)
+    return raw, epochs, forward
+
+
+def test_tf_dics_csd_windows():
+    """Test that tf_dics matches CSDs computed for each window and bin
+    """
+    _, epochs, forward = _fake_data(preload=True)
+
+    tmin, tmax, tstep = -0.4, 0.4, 0.2
+    freq_bins = [(8, 22), (28, 42), (8, 22)]
+    win_lengths = [0.2, 0.2, 0.4]
+    n_fft = 64
+    noise_csds = [compute_epochs_csd(epochs, mode='fourier', fmin=fmin,
+                                     fmax=fmax, tmin=tmin,
+                                     tmax=tmin + win_length, n_fft=n_fft)
+                  for (fmin, fmax), win_length in zip(freq_bins, win_lengths)]
+    stcs = tf_dics(epochs, forward, noise_csds, tmin, tmax, tstep,
+                   win_lengths, freq_bins, n_ffts=[n_fft] * 3, reg=0.01)
+    assert_true(len(stcs) == 3)
+    assert_true(stcs[0].shape == (10, 4))
+    stcs_par = tf_dics(epochs, forward, noise_csds, tmin, tmax, tstep,
+                       win_lengths, freq_bins, n_ffts=[n_fft] * 3, reg=0.01,
+                       n_jobs=2)
+    for stc, stc_par in zip(stcs, stcs_par):
+        assert_array_almost_equal(stc.data, stc_par.data)
+
+    # the windows have the length of the time step: no averaging
+    for i_freq in range(2):
+        fmin, fmax = freq_bins[i_freq]
+        for i_time in range(4):
+            win_tmin = tmin + i_time * tstep
+            data_csd = compute_epochs_csd(epochs, mode='fourier', fmin=fmin,
+                                          fmax=fmax, tmin=win_tmin,
+                                          tmax=win_tmin + tstep, n_fft=n_fft)
+            noise_csd = cp.deepcopy(noise_csds[i_freq])
+            data_csd.data /= data_csd.n_fft
+            noise_csd.data /= noise_csd.n_fft
+            stc = dics_source_power(epochs.info, forward, noise_csd, data_csd,
+                                    reg=0.01)
+            assert_array_almost_equal(stcs[i_freq].data[:, i_time],
+                                      stc.data[:, 0])
+
+    # noise CSDs computed at other frequencies are detected
+    assert_raises(ValueError, tf_dics, epochs, forward,
+                  noise_csds[1:] + noise_csds[:1], tmin, tmax, tstep,
+                  win_lengths, freq_bins, n_ffts=[n_fft] * 3)
@@ -2,6 +2,7 @@ import os.path as op
 
 from nose.tools import assert_true, assert_raises
 import numpy as np
+from scipy import linalg
 from numpy.testing import assert_array_almost_equal, assert_array_equal
 import warnings
 
@@ -9,9 +10,11 @@ import mne
 from mne import compute_covariance
 from mne.datasets import sample
 from mne.beamformer import lcmv, lcmv_epochs, lcmv_raw, tf_lcmv
-from mne.beamformer._lcmv import _lcmv_source_power
+from mne.beamformer._lcmv import (_lcmv_source_power, _stacked_pinv,
+                                  _unit_gain_filters)
 from mne.source_estimate import SourceEstimate, VolSourceEstimate
 from mne.externals.six import advance_iterator
+from mne.beamformer.tests.test_dics import _fake_data
 
 
 data_path = sample.data_path(download=False)
@@ -369,3 +372,58 @@ def test_tf_lcmv():
                        label=label)
 
     assert_array_almost_equal(stcs[0].data, np.zeros_like(stcs[0].data))
+
+
+def test_unit_gain_filters():
+    """Test batched computation of unit gain beamformer filters
+    """
+    rng = np.random.RandomState(0)
+    n_channels, n_sources = 12, 6
+    a = rng.randn(n_sources, 3, 3) + 1j * rng.randn(n_sources, 3, 3)
+    a[0, 2] = a[0, 1]  # rank deficient
+    pinv = _stacked_pinv(a, 0.1)
+    for k in range(n_sources):
+        assert_array_almost_equal(pinv[k], linalg.pinv(a[k], 0.1))
+
+    for n_orient in [1, 3]:
+        G = rng.randn(n_channels, n_orient * n_sources)
+        W = G.T + 0.1 * rng.randn(n_orient * n_sources, n_channels)
+        W_unit = _unit_gain_filters(W, G, n_orient)
+        for k in range(n_sources):
+            sl = slice(n_orient * k, n_orient * k + n_orient)
+            Wk = np.dot(linalg.pinv(np.dot(W[sl], G[:, sl]), 0.1), W[sl])
+            assert_array_almost_equal(W_unit[sl], Wk)
+            # the filters pass the activity of their source with unit gain
+            assert_array_almost_equal(np.dot(W_unit[sl], G[:, sl]),
+                                      np.eye(n_orient))
+
+
+def test_tf_lcmv_windows():
+    """Test tf_lcmv on synthetic data, in parallel over time windows
+    """
+    raw, epochs, forward = _fake_data()
+    noise_covs = [compute_covariance(epochs, tmax=0.)] * 2
+
+    tmin, tmax, tstep = -0.3, 0.3, 0.1
+    freq_bins = [(8, 12), (15, 25)]
+    stcs = tf_lcmv(epochs, forward, noise_covs, tmin, tmax, tstep,
+                   [0.1, 0.2], freq_bins, reg=0.05)
+    assert_true(len(stcs) == 2)
+    assert_true(stcs[0].shape == (10, 6))
+    stcs_par = tf_lcmv(epochs, forward, noise_covs, tmin, tmax, tstep,
+                       [0.1, 0.2], freq_bins, reg=0.05, n_jobs=2)
+    for stc, stc_par in zip(stcs, stcs_par):
+        assert_array_almost_equal(stc.data, stc_par.data)
+
+    # the windows of the first bin have the length of the time step
+    raw_band = raw.copy()
+    raw_band.filter(8, 12, method='iir')
+    epochs_band = mne.Epochs(raw_band, epochs.events, 1, -0.4, 0.4,
+                             baseline=(None, 0), preload=True)
+    for i_time in [0, 3]:
+        win_tmin = tmin + i_time * tstep
+        data_cov = compute_covariance(epochs_band, tmin=win_tmin,
+                                      tmax=win_tmin + tstep)
+        stc = _lcmv_source_power(epochs_band.info, forward, noise_covs[0],
+                                 data_cov, reg=0.05)
+        assert_array_almost_equal(stcs[0].data[:, i_time], stc.data[:, 0])
@@ -1,9 +1,6 @@
 # Authors: Martin Luessi <mluessi@nmr.mgh.harvard.edu>
 #
 # License: BSD (3-clause)
-from ..externals.six.moves import zip
-import copy
-
 import numpy as np
 
 from ..utils import logger, verbose
@@ -32,7 +29,8 @@ def phase_slope_index(data, indices=None, sfreq=2 * np.pi,
     a negative value means the opposite.
 
     The PSI is computed from the coherency (see spectral_connectivity), details
-    can be found in [1].
+    can be found in [1]. To compute the PSI together with other measures in
+    a single pass over the data, use spectral_connectivity with method='psi'.
 
     References
     ----------
@@ -114,50 +112,14 @@ def phase_slope_index(data, indices=None, sfreq=2 * np.pi,
         Otherwise None is returned.
     """
     logger.info('Estimating phase slope index (PSI)')
-    # estimate the coherency
-    cohy, freqs_, times, n_epochs, n_tapers = spectral_connectivity(data,
-        method='cohy', indices=indices, sfreq=sfreq, mode=mode, fmin=fmin,
-        fmax=fmax, fskip=0, faverage=False, tmin=tmin, tmax=tmax,
+    # the PSI is computed for each band from the coherency
+    psi, freqs, times, n_epochs, n_tapers = spectral_connectivity(data,
+        method='psi', indices=indices, sfreq=sfreq, mode=mode, fmin=fmin,
+        fmax=fmax, fskip=0, faverage=True, tmin=tmin, tmax=tmax,
         mt_bandwidth=mt_bandwidth, mt_adaptive=mt_adaptive,
         mt_low_bias=mt_low_bias, cwt_frequencies=cwt_frequencies,
         cwt_n_cycles=cwt_n_cycles, block_size=block_size, n_jobs=n_jobs,
         verbose=verbose)
-
-    logger.info('Computing PSI from estimated Coherency')
-    # compute PSI in the requested bands
-    if fmin is None:
-        fmin = -np.inf  # set it to -inf, so we can adjust it later
-
-    bands = list(zip(np.asarray((fmin,)).ravel(), np.asarray((fmax,)).ravel()))
-    n_bands = len(bands)
-
-    freq_dim = -2 if mode == 'cwt_morlet' else -1
-
-    # allocate space for output
-    out_shape = list(cohy.shape)
-    out_shape[freq_dim] = n_bands
-    psi = np.zeros(out_shape, dtype=np.float)
-
-    # allocate accumulator
-    acc_shape = copy.copy(out_shape)
-    acc_shape.pop(freq_dim)
-    acc = np.empty(acc_shape, dtype=np.complex128)
-
-    freqs = list()
-    idx_fi = [slice(None)] * cohy.ndim
-    idx_fj = [slice(None)] * cohy.ndim
-    for band_idx, band in enumerate(bands):
-        freq_idx = np.where((freqs_ > band[0]) & (freqs_ < band[1]))[0]
-        freqs.append(freqs_[freq_idx])
-
-        acc.fill(0.)
-        for fi, fj in zip(freq_idx, freq_idx[1:]):
-            idx_fi[freq_dim] = fi
-            idx_fj[freq_dim] = fj
-            acc += np.conj(cohy[idx_fi]) * cohy[idx_fj]
-
-        idx_fi[freq_dim] = band_idx
-        psi[idx_fi] = np.imag(acc)
     logger.info('[PSI Estimation Done]')
 
     return psi, freqs, times, n_epochs, n_tapers
@@ -5,20 +5,24 @@
 from ..externals.six import string_types
 from warnings import warn
 from inspect import getargspec, getmembers
+import mmap
+import os
+import tempfile
+from types import GeneratorType
 
 import numpy as np
 from scipy.fftpack import fftfreq
 
 from .utils import check_indices
 from ..fixes import tril_indices, partial
-from ..parallel import parallel_func
+from ..parallel import parallel_func, _prefetch_generator
 from ..source_estimate import _BaseSourceEstimate
 from .. import Epochs
 from ..time_frequency.multitaper import (dpss_windows, _mt_spectra,
                                          _psd_from_mt, _csd_from_mt,
                                          _psd_from_mt_adaptive)
-from ..time_frequency.tfr import morlet, cwt
-from ..utils import logger, verbose
+from ..time_frequency.tfr import morlet, cwt, _check_complex_dtype
+from ..utils import logger, verbose, get_config
 
 ########################################################################
 # Various connectivity estimators
@@ -65,16 +69,29 @@ class _EpochMeanConEstBase(_AbstractConEstBase):
 
 
 class _CohEstBase(_EpochMeanConEstBase):
-    """Base Estimator for Coherence, Coherency, Imag. Coherence"""
+    """Base Estimator for Coherence, Coherency, Imag. Coherence, PSI"""
     def __init__(self, n_cons, n_freqs, n_times):
         super(_CohEstBase, self).__init__(n_cons, n_freqs, n_times)
 
         # allocate space for accumulation of CSD
         self._acc = np.zeros(self.csd_shape, dtype=np.complex128)
+        # if True, the CSD is accumulated by another estimator
+        self._acc_shared = False
+
+    def share_acc(self, other):
+        """Use the CSD accumulated by another estimator"""
+        self._acc = other._acc
+        self._acc_shared = True
 
     def accumulate(self, con_idx, csd_xy):
         """Accumulate CSD for some connections"""
-        self._acc[con_idx] += csd_xy
+        if not self._acc_shared:
+            self._acc[con_idx] += csd_xy
+
+    def combine(self, other):
+        """Include con. accumated for some epochs in this estimate"""
+        if not self._acc_shared:
+            self._acc += other._acc
 
 
 class _CohEst(_CohEstBase):
@@ -114,6 +131,23 @@ class _ImCohEst(_CohEstBase):
         self.con_scores[con_idx] = np.imag(csd_mean) / np.sqrt(psd_xx * psd_yy)
 
 
+class _PSIEst(_CohEstBase):
+    """Phase Slope Index Estimator
+
+    The con. scores are the coherency, the PSI for each band is obtained
+    using _psi_from_cohy.
+    """
+    name = 'PSI'
+
+    def compute_con(self, con_idx, n_epochs, psd_xx, psd_yy):
+        """Compute final con. score for some connections"""
+        if self.con_scores is None:
+            self.con_scores = np.zeros(self.csd_shape,
+                                       dtype=np.complex128)
+        csd_mean = self._acc[con_idx] / n_epochs
+        self.con_scores[con_idx] = csd_mean / np.sqrt(psd_xx * psd_yy)
+
+
 class _PLVEst(_EpochMeanConEstBase):
     """PLV Estimator"""
     name = 'PLV'
@@ -286,12 +320,55 @@ class _PPCEst(_EpochMeanConEstBase):
         self.con_scores[con_idx] = np.real(con)
 
 
+def _make_con_methods(con_method_types, n_cons, n_freqs, n_times):
+    """Create the con. estimators, the coherency based ones share the CSD"""
+    con_methods = [mtype(n_cons, n_freqs, n_times)
+                   for mtype in con_method_types]
+    coh_methods = [m for m in con_methods if isinstance(m, _CohEstBase)]
+    for method in coh_methods[1:]:
+        method.share_acc(coh_methods[0])
+    return con_methods
+
+
+def _psi_from_cohy(cohy, freq_idx_bands):
+    """Compute the PSI for frequency bands from the coherency
+
+    Parameters
+    ----------
+    cohy : array, shape=(n_cons, n_freqs) or (n_cons, n_freqs, n_times)
+        The coherency.
+    freq_idx_bands : list of array
+        The frequency indices of each band.
+
+    Returns
+    -------
+    psi : array, shape=(n_cons, n_bands) or (n_cons, n_bands, n_times)
+        The phase slope index.
+    """
+    # pairs of neighboring frequencies and the band they belong to
+    idx_fi = np.concatenate([fidx[:-1] for fidx in freq_idx_bands])
+    idx_fj = np.concatenate([fidx[1:] for fidx in freq_idx_bands])
+    pair_band = np.concatenate([np.repeat(band_idx, len(fidx[1:]))
+                                for band_idx, fidx in
+                                enumerate(freq_idx_bands)])
+    band_sum = np.zeros((len(idx_fi), len(freq_idx_bands)))
+    band_sum[np.arange(len(idx_fi)), pair_band.astype(np.int)] = 1.
+
+    # Im(sum(conj(C(f)) * C(f + df))) = sum(Im(conj(C(f)) * C(f + df)))
+    slope = np.imag(np.conj(cohy[:, idx_fi]) * cohy[:, idx_fj])
+    psi = np.tensordot(slope, band_sum, axes=([1], [0]))
+    if psi.ndim == 3:
+        psi = np.swapaxes(psi, 1, 2)  # (n_cons, n_bands, n_times)
+    return psi
+
+
 ###############################################################################
 def _epoch_spectral_connectivity(data, sig_idx, tmin_idx, tmax_idx, sfreq,
                                  mode, window_fun, eigvals, wavelets, freq_mask,
                                  mt_adaptive, idx_map, block_size, psd,
                                  accumulate_psd, con_method_types, con_methods,
-                                 n_signals, n_times, accumulate_inplace=True):
+                                 n_signals, n_times, accumulate_inplace=True,
+                                 dtype=np.complex128):
     """Connectivity estimation for one epoch see spectral_connectivity"""
 
     n_cons = len(idx_map[0])
@@ -305,8 +382,8 @@ def _epoch_spectral_connectivity(data, sig_idx, tmin_idx, tmax_idx, sfreq,
 
     if not accumulate_inplace:
         # instantiate methods only for this epoch (used in parallel mode)
-        con_methods = [mtype(n_cons, n_freqs, n_times_spectrum)
-                       for mtype in con_method_types]
+        con_methods = _make_con_methods(con_method_types, n_cons, n_freqs,
+                                        n_times_spectrum)
 
     if len(sig_idx) == n_signals:
         # we use all signals: use a slice for faster indexing
@@ -327,14 +404,14 @@ def _epoch_spectral_connectivity(data, sig_idx, tmin_idx, tmax_idx, sfreq,
                 this_sig_idx = sig_idx
             if isinstance(this_data, _BaseSourceEstimate):
                 _mt_spectra_partial = partial(_mt_spectra, dpss=window_fun,
-                                              sfreq=sfreq)
+                                              sfreq=sfreq, dtype=dtype)
                 this_x_mt = this_data.transform_data(_mt_spectra_partial,
                                         idx=this_sig_idx, tmin_idx=tmin_idx,
                                         tmax_idx=tmax_idx)
             else:
                 this_x_mt, _ = _mt_spectra(this_data[this_sig_idx,
                                                      tmin_idx:tmax_idx],
-                                           window_fun, sfreq)
+                                           window_fun, sfreq, dtype=dtype)
 
             if mt_adaptive:
                 # compute PSD and adaptive weights
@@ -381,13 +458,14 @@ def _epoch_spectral_connectivity(data, sig_idx, tmin_idx, tmax_idx, sfreq,
                 this_sig_idx = sig_idx
             if isinstance(this_data, _BaseSourceEstimate):
                 cwt_partial = partial(cwt, Ws=wavelets, use_fft=True,
-                                      mode='same')
+                                      mode='same', dtype=dtype)
                 this_x_cwt = this_data.transform_data(cwt_partial,
                                 idx=this_sig_idx, tmin_idx=tmin_idx,
                                 tmax_idx=tmax_idx)
             else:
                 this_x_cwt = cwt(this_data[this_sig_idx, tmin_idx:tmax_idx],
-                                 wavelets, use_fft=True, mode='same')
+                                 wavelets, use_fft=True, mode='same',
+                                 dtype=dtype)
 
             if accumulate_psd:
                 this_psd.append(np.abs(this_x_cwt) ** 2)
@@ -417,7 +495,16 @@ def _epoch_spectral_connectivity(data, sig_idx, tmin_idx, tmax_idx, sfreq,
         method.start_epoch()
 
     # accumulate connectivity scores
-    if mode in ['multitaper', 'fourier']:
+    if mode in ['multitaper', 'fourier'] and 8 * n_cons >= len(x_mt) ** 2:
+        # many connections: compute the CSD of all connections from the full
+        # CSD matrix of each frequency and share it among the methods
+        csd_all = _csd_matrix_from_mt(x_mt, weights, idx_map)
+        for i in range(0, n_cons, block_size):
+            con_idx = slice(i, i + block_size)
+            for method in con_methods:
+                method.accumulate(con_idx, csd_all[con_idx])
+        del csd_all
+    elif mode in ['multitaper', 'fourier']:
         for i in range(0, n_cons, block_size):
             con_idx = slice(i, i + block_size)
             if mt_adaptive:
@@ -445,6 +532,87 @@ def _epoch_spectral_connectivity(data, sig_idx, tmin_idx, tmax_idx, sfreq,
     return con_methods, psd
 
 
+def _epochs_spectral_connectivity(fname, data_dtype, shape, offset, start,
+                                  stop, sig_idx, tmin_idx, tmax_idx, sfreq,
+                                  mode, window_fun, eigvals, wavelets,
+                                  freq_mask, mt_adaptive, idx_map, block_size,
+                                  accumulate_psd, con_method_types,
+                                  n_signals, n_times, dtype=np.complex128):
+    """Connectivity estimation for a range of epochs in a memmapped array
+
+    The estimators and the PSD are accumulated over all epochs of the range
+    so only a single state has to be returned.
+    """
+    data = np.memmap(fname, dtype=data_dtype, mode='r', shape=shape,
+                     offset=offset)
+
+    n_cons = len(idx_map[0])
+    if wavelets is not None:
+        n_times_spectrum = n_times
+        n_freqs = len(wavelets)
+        psd_shape = (len(sig_idx), n_freqs, n_times_spectrum)
+    else:
+        n_times_spectrum = 0
+        n_freqs = np.sum(freq_mask)
+        psd_shape = (len(sig_idx), n_freqs)
+    con_methods = _make_con_methods(con_method_types, n_cons, n_freqs,
+                                    n_times_spectrum)
+    psd = np.zeros(psd_shape) if accumulate_psd else None
+
+    for epoch_idx in range(start, stop):
+        _epoch_spectral_connectivity((data[epoch_idx],), sig_idx, tmin_idx,
+            tmax_idx, sfreq, mode, window_fun, eigvals, wavelets, freq_mask,
+            mt_adaptive, idx_map, block_size, psd, accumulate_psd,
+            con_method_types, con_methods, n_signals, n_times,
+            accumulate_inplace=True, dtype=dtype)
+
+    return con_methods, psd
+
+
+def _get_memmap_params(data):
+    """Get the file of a memmapped epochs array, write a file if needed
+
+    Returns the file name, offset and whether a temporary file was created.
+    """
+    if (isinstance(data, np.memmap) and isinstance(data.base, mmap.mmap)
+            and data.flags.c_contiguous):
+        return data.filename, data.offset, False
+    fd, fname = tempfile.mkstemp(suffix='.dat',
+                                 dir=get_config('MNE_CACHE_DIR', None))
+    os.close(fd)
+    data_mmap = np.memmap(fname, dtype=data.dtype, mode='w+',
+                          shape=data.shape)
+    data_mmap[:] = data
+    data_mmap.flush()
+    del data_mmap
+    return fname, 0, True
+
+
+def _csd_matrix_from_mt(x_mt, weights, idx_map):
+    """Compute the CSD of connections using the full CSD matrices
+
+    The CSD matrix of all signals is computed for one frequency at a time
+    with a single matrix product. Equivalent to _csd_from_mt for the
+    connections in idx_map.
+    """
+    n_signals, _, n_freqs = x_mt.shape
+    x_w = np.asarray(weights, dtype=np.finfo(x_mt.dtype).dtype) * x_mt
+    # (n_freqs, n_signals, n_tapers) for matrix products
+    x_w = np.ascontiguousarray(np.rollaxis(x_w, 2))
+
+    csd = np.empty((len(idx_map[0]), n_freqs), dtype=x_w.dtype)
+    for f, this_x_w in enumerate(x_w):
+        csd[:, f] = np.dot(this_x_w,
+                           this_x_w.conj().T)[idx_map[0], idx_map[1]]
+
+    norm = np.sqrt(np.sum(np.abs(weights) ** 2, axis=-2))
+    if norm.shape[0] == 1:
+        csd *= 2 / norm ** 2
+    else:
+        csd *= 2 / (norm[idx_map[0]] * norm[idx_map[1]])
+    return csd
+
+
 def _get_n_epochs(epochs, n):
     """Generator that returns lists with at most n epochs"""
     epochs_out = []
@@ -505,8 +673,9 @@ def _get_and_verify_data_sizes(data, n_signals=None, n_times=None, times=None):
 
 # map names to estimator types
 _CON_METHOD_MAP = {'coh': _CohEst, 'cohy': _CohyEst, 'imcoh': _ImCohEst,
-                   'plv': _PLVEst, 'ppc': _PPCEst, 'pli': _PLIEst,
-                   'pli2_unbiased': _PLIUnbiasedEst, 'wpli': _WPLIEst,
+                   'psi': _PSIEst, 'plv': _PLVEst, 'ppc': _PPCEst,
+                   'pli': _PLIEst, 'pli2_unbiased': _PLIUnbiasedEst,
+                   'wpli': _WPLIEst,
                    'wpli2_debiased': _WPLIDebiasedEst}
 
 
@@ -517,7 +686,7 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
                           mt_bandwidth=None, mt_adaptive=False,
                           mt_low_bias=True, cwt_frequencies=None,
                           cwt_n_cycles=7, block_size=1000, n_jobs=1,
-                          verbose=None):
+                          dtype=np.complex128, verbose=None):
     """Compute various frequency-domain and time-frequency domain connectivity
     measures.
 
@@ -571,6 +740,17 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
         C = ----------------------
             sqrt(E[Sxx] * E[Syy])
 
+    'psi' : Phase Slope Index (PSI) [6] given by
+
+        PSI = Im(sum_f(conj(C(f)) * C(f + df)))
+
+            where C is the coherency and the sum runs over neighboring
+            frequency points of a band. The PSI is computed for each band,
+            i.e., the scores always have one entry per band (see faverage).
+            A positive value means that the first signal is ahead of the
+            second. The CSD is shared with 'coh', 'cohy' and 'imcoh', so
+            computing them together is cheap.
+
     'plv' : Phase-Locking Value (PLV) [2] given by
 
         PLV = |E[Sxy/|Sxy|]|
@@ -615,6 +795,10 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
         physiological data in the presence of volume-conduction, noise and
         sample-size bias" NeuroImage, vol. 55, no. 4, pp. 1548-1565, Apr. 2011.
 
+    [6] Nolte et al. "Robustly Estimating the Flow Direction of Information in
+        Complex Physical Systems", Physical Review Letters, vol. 100, no. 23,
+        pp. 1-4, Jun. 2008.
+
     Parameters
     ----------
     data : array, shape=(n_epochs, n_signals, n_times)
@@ -625,7 +809,9 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
         possible to combine multiple signals by providing a list of tuples,
         e.g., data = [(arr_0, stc_0), (arr_1, stc_1), (arr_2, stc_2)],
         corresponds to 3 epochs, and arr_* could be an array with the same
-        number of time points as stc_*.
+        number of time points as stc_*. Generators are consumed in a
+        background thread, i.e., the next epochs are produced while the
+        connectivity for the current epochs is computed.
     method : string | list of string
         Connectivity measure(s) to compute.
     indices : tuple of arrays | None
@@ -673,7 +859,17 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
         How many connections to compute at once (higher numbers are faster
         but require more memory).
     n_jobs : int
-        How many epochs to process in parallel.
+        How many epochs to process in parallel. If data is an array
+        of shape (n_epochs, n_signals, n_times), each job processes a range
+        of epochs from a memory-mapped copy of the data (the array itself if
+        it is memory-mapped, e.g., loaded with np.load(fname, mmap_mode='r'))
+        and returns a single accumulated state. The copy is stored in
+        MNE_CACHE_DIR if it is set.
+    dtype : np.complex128 | np.complex64
+        The dtype of the spectra of each epoch. With np.complex64 the
+        tapered spectra / wavelet transforms are computed in single
+        precision, which halves their memory use. The estimates are always
+        accumulated in double precision.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
@@ -697,7 +893,16 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
         The number of DPSS tapers used. Only defined in 'multitaper' mode.
         Otherwise None is returned.
     """
-    if n_jobs > 1:
+    dtype, _ = _check_complex_dtype(dtype)
+
+    # epochs arrays are processed in ranges of epochs from a memmapped file
+    use_memmap = (n_jobs != 1 and isinstance(data, np.ndarray)
+                  and data.ndim == 3)
+    if use_memmap:
+        parallel, my_epochs_spectral_connectivity, n_jobs = \
+                parallel_func(_epochs_spectral_connectivity, n_jobs,
+                              verbose=verbose)
+    elif n_jobs > 1:
         parallel, my_epoch_spectral_connectivity, _ = \
                 parallel_func(_epoch_spectral_connectivity, n_jobs,
                               verbose=verbose)
@@ -751,11 +956,21 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
         times_in = data.times  # input times for Epochs input type
         sfreq = data.info['sfreq']
 
+    if isinstance(data, GeneratorType):
+        # produce the next epochs (e.g., reading, applying an inverse and
+        # extracting label time courses) while the current ones are processed
+        data = _prefetch_generator(data, n_buffer=2 * max(n_jobs, 1))
+
     # loop over data; it could be a generator that returns
     # (n_signals x n_times) arrays or SourceEstimates
     epoch_idx = 0
     logger.info('Connectivity computation...')
-    for epoch_block in _get_n_epochs(data, n_jobs):
+    if use_memmap:
+        # the first epoch is only used to initialize everything
+        epoch_blocks = [[(data[0],)]]
+    else:
+        epoch_blocks = _get_n_epochs(data, n_jobs)
+    for epoch_block in epoch_blocks:
 
         if epoch_idx == 0:
             # initialize everything
@@ -946,8 +1161,8 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
                 psd = None
 
             # create instances of the connectivity estimators
-            con_methods = [mtype(n_cons, n_freqs, n_times_spectrum)
-                           for mtype in con_method_types]
+            con_methods = _make_con_methods(con_method_types, n_cons,
+                                            n_freqs, n_times_spectrum)
 
             sep = ', '
             metrics_str = sep.join([method.name for method in con_methods])
@@ -959,7 +1174,33 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
             _get_and_verify_data_sizes(this_epoch, n_signals, n_times_in,
                                        times_in)
 
-        if n_jobs == 1:
+        if use_memmap:
+            # each job accumulates a range of epochs
+            n_epochs = len(data)
+            logger.info('    computing connectivity for epochs 1..%d'
+                        % n_epochs)
+            fname, offset, is_temp = _get_memmap_params(data)
+            try:
+                bounds = np.linspace(0, n_epochs, min(n_jobs, n_epochs) + 1)
+                bounds = bounds.astype(np.int)
+                out = parallel(my_epochs_spectral_connectivity(fname,
+                        data.dtype, data.shape, offset, start, stop, sig_idx,
+                        tmin_idx, tmax_idx, sfreq, mode, window_fun, eigvals,
+                        wavelets, freq_mask, mt_adaptive, idx_map, block_size,
+                        accumulate_psd, con_method_types, n_signals, n_times,
+                        dtype) for start, stop in zip(bounds[:-1], bounds[1:]))
+            finally:
+                if is_temp:
+                    os.remove(fname)
+
+            for this_out in out:
+                for method, parallel_method in zip(con_methods, this_out[0]):
+                    method.combine(parallel_method)
+                if accumulate_psd:
+                    psd += this_out[1]
+
+            epoch_idx += n_epochs
+        elif n_jobs == 1:
             # no parallel processing
             for this_epoch in epoch_block:
                 logger.info('    computing connectivity for epoch %d'
@@ -970,7 +1211,7 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
                     tmax_idx, sfreq, mode, window_fun, eigvals, wavelets,
                     freq_mask, mt_adaptive, idx_map, block_size, psd,
                     accumulate_psd, con_method_types, con_methods,
-                    n_signals, n_times, accumulate_inplace=True)
+                    n_signals, n_times, accumulate_inplace=True, dtype=dtype)
                 epoch_idx += 1
         else:
             # process epochs in parallel
@@ -981,7 +1222,8 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
                     tmin_idx, tmax_idx, sfreq, mode, window_fun, eigvals,
                     wavelets, freq_mask, mt_adaptive, idx_map, block_size, psd,
                     accumulate_psd, con_method_types, None, n_signals, n_times,
-                    accumulate_inplace=False) for this_epoch in epoch_block)
+                    accumulate_inplace=False, dtype=dtype)
+                    for this_epoch in epoch_block)
 
             # do the accumulation
             for this_out in out:
@@ -1017,7 +1259,10 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
         if this_con.shape[0] != n_cons:
             raise ValueError('First dimension of connectivity scores must be '
                              'the same as the number of connections')
-        if faverage:
+        if isinstance(method, _PSIEst):
+            # the PSI is always computed for the frequency bands
+            this_con = _psi_from_cohy(this_con, freq_idx_bands)
+        elif faverage:
             if this_con.shape[1] != n_freqs:
                 raise ValueError('2nd dimension of connectivity scores must '
                                  'be the same as the number of frequencies')
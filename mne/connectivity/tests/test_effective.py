@@ -2,7 +2,7 @@ import numpy as np
 from numpy.testing import assert_array_almost_equal
 from nose.tools import assert_true
 
-from mne.connectivity import phase_slope_index
+from mne.connectivity import phase_slope_index, spectral_connectivity
 
 
 def test_psi():
@@ -38,3 +38,27 @@ def test_psi():
 
     assert_true(np.all(psi_cwt > 0))
     assert_true(psi_cwt.shape[-1] == n_times)
+
+    # PSI together with other measures in a single pass
+    fmin, fmax = (5., 12.), (11., 20.)
+    psi, freqs, _, _, _ = phase_slope_index(data, mode='fourier',
+        sfreq=sfreq, fmin=fmin, fmax=fmax)
+    for n_jobs in [1, 2]:
+        (coh, cohy, pli, psi_2), freqs_2, _, _, _ = spectral_connectivity(
+            data, method=['coh', 'cohy', 'pli', 'psi'], mode='fourier',
+            sfreq=sfreq, fmin=fmin, fmax=fmax, n_jobs=n_jobs)
+        assert_true(psi_2.shape == (n_signals, n_signals, 2))
+        assert_array_almost_equal(psi, psi_2)
+        coh_2 = spectral_connectivity(data, method='coh', mode='fourier',
+            sfreq=sfreq, fmin=fmin, fmax=fmax)[0]
+        assert_array_almost_equal(coh, coh_2)
+        assert_array_almost_equal(coh, np.abs(cohy))
+
+        # reference: loop over neighboring frequencies of each band
+        for band_idx, (fl, fu) in enumerate(zip(fmin, fmax)):
+            freq_idx = np.where((freqs_2 >= fl) & (freqs_2 <= fu))[0]
+            assert_array_almost_equal(freqs[band_idx], freqs_2[freq_idx])
+            acc = np.zeros(cohy.shape[:2], dtype=np.complex128)
+            for fi, fj in zip(freq_idx, freq_idx[1:]):
+                acc += np.conj(cohy[:, :, fi]) * cohy[:, :, fj]
+            assert_array_almost_equal(psi[:, :, band_idx], np.imag(acc))
@@ -1,13 +1,22 @@
+import os.path as op
+import threading
+import time
+
 import numpy as np
 from numpy.testing import assert_array_almost_equal
-from nose.tools import assert_true, assert_raises
+from nose.tools import assert_true, assert_raises, assert_equal
 
 from mne.fixes import tril_indices
 from mne.connectivity import spectral_connectivity
-from mne.connectivity.spectral import _CohEst
+from mne.connectivity.spectral import _CohEst, _csd_matrix_from_mt
+from mne.parallel import _prefetch_generator
+from mne.time_frequency.multitaper import _csd_from_mt
 
 from mne import SourceEstimate
 from mne.filter import band_pass_filter
+from mne.utils import _TempDir
+
+tempdir = _TempDir()
 
 
 def _stc_gen(data, sfreq, tmin, combo=False):
@@ -192,3 +201,103 @@ def test_spectral_connectivity():
                     freq_idx = np.searchsorted(freqs2, freqs3[i])
                     con2_avg = np.mean(con2[:, freq_idx], axis=1)
                     assert_array_almost_equal(con2_avg, con3[:, i])
+
+
+def test_spectral_connectivity_dense_sparse():
+    """Test CSD matrix and pairwise connectivity accumulation"""
+    rng = np.random.RandomState(0)
+    x_mt = rng.randn(6, 4, 10) + 1j * rng.randn(6, 4, 10)
+    idx_map = tril_indices(6, -1)
+    for weights in [np.array([1.])[:, None, None],
+                    rng.rand(1, 4, 1), rng.rand(6, 4, 10)]:
+        if weights.shape[0] == 1:
+            csd = _csd_from_mt(x_mt[idx_map[0]], x_mt[idx_map[1]],
+                               weights, weights)
+        else:
+            csd = _csd_from_mt(x_mt[idx_map[0]], x_mt[idx_map[1]],
+                               weights[idx_map[0]], weights[idx_map[1]])
+        assert_array_almost_equal(_csd_matrix_from_mt(x_mt, weights,
+                                                      idx_map), csd)
+
+    # all-to-all uses the CSD matrices, a single seed the pairwise CSD
+    data = rng.randn(4, 20, 200)
+    seed_indices = (np.zeros(19, dtype=np.int), np.arange(1, 20))
+    for mode, adaptive in [('multitaper', False), ('multitaper', True),
+                           ('fourier', False)]:
+        kwargs = dict(method=['coh', 'pli', 'wpli2_debiased'], sfreq=100.,
+                      mode=mode, mt_adaptive=adaptive, fmin=10., fmax=40.)
+        con, _, _, _, _ = spectral_connectivity(data, **kwargs)
+        con_seed, _, _, _, _ = spectral_connectivity(data,
+                                                     indices=seed_indices,
+                                                     **kwargs)
+        for c, c_seed in zip(con, con_seed):
+            assert_array_almost_equal(c[1:, 0], c_seed)
+
+
+def test_spectral_connectivity_memmap():
+    """Test parallel connectivity on ranges of memmapped epochs"""
+    rng = np.random.RandomState(0)
+    data = rng.randn(7, 5, 200)
+    fname = op.join(tempdir, 'epochs.npy')
+    np.save(fname, data)
+    data_mmap = np.load(fname, mmap_mode='r')
+    for mode in ['multitaper', 'cwt_morlet']:
+        kwargs = dict(method=['coh', 'plv', 'wpli'], sfreq=100., mode=mode,
+                      fmin=10., fmax=40., cwt_frequencies=np.array([20., 30.]))
+        con, freqs, times, n, _ = spectral_connectivity(data, **kwargs)
+        for this_data in [data, data_mmap]:
+            con2, freqs2, times2, n2, _ = \
+                spectral_connectivity(this_data, n_jobs=2, **kwargs)
+            assert_true(n2 == n)
+            assert_array_almost_equal(freqs, freqs2)
+            for c, c2 in zip(con, con2):
+                assert_array_almost_equal(c, c2)
+
+
+def test_spectral_connectivity_generator():
+    """Test connectivity on prefetched generators"""
+    rng = np.random.RandomState(0)
+    data = rng.randn(6, 4, 200)
+    n_threads = threading.active_count()
+    kwargs = dict(method=['coh', 'pli'], sfreq=100., fmin=10., fmax=40.)
+    con, _, _, n, _ = spectral_connectivity(list(data), **kwargs)
+    con2, _, _, n2, _ = spectral_connectivity((d for d in data), **kwargs)
+    assert_true(n2 == n)
+    for c, c2 in zip(con, con2):
+        assert_array_almost_equal(c, c2)
+
+    # errors in the generator are raised in the calling thread
+    def _bad_gen():
+        yield data[0]
+        raise RuntimeError('bad epoch')
+
+    assert_raises(RuntimeError, spectral_connectivity, _bad_gen(), **kwargs)
+
+    # the producer thread stops when the items are not consumed anymore
+    gen = _prefetch_generator((d for d in data), n_buffer=1)
+    next(gen)
+    gen.close()
+    time.sleep(0.5)
+    assert_equal(threading.active_count(), n_threads)
+
+    # other exceptions of the generator are passed on, too
+    def _interrupted_gen():
+        yield data[0]
+        raise KeyboardInterrupt
+
+    gen = _prefetch_generator(_interrupted_gen())
+    next(gen)
+    assert_raises(KeyboardInterrupt, next, gen)
+
+
+def test_spectral_connectivity_dtype():
+    """Test connectivity with single precision spectra"""
+    rng = np.random.RandomState(0)
+    data = rng.randn(5, 4, 200)
+    for mode in ['multitaper', 'fourier', 'cwt_morlet']:
+        kwargs = dict(method=['coh', 'wpli'], sfreq=100., mode=mode,
+                      fmin=10., fmax=40., cwt_frequencies=np.array([20., 30.]))
+        con = spectral_connectivity(data, **kwargs)[0]
+        con_32 = spectral_connectivity(data, dtype=np.complex64, **kwargs)[0]
+        for c, c_32 in zip(con, con_32):
+            assert_array_almost_equal(c, c_32, decimal=4)
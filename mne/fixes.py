@@ -526,6 +526,27 @@ else:
     matrix_rank = _matrix_rank
 
 
+def _stacked_eigh(a):
+    """Replacing np.linalg.eigh on stacks of matrices for numpy < 1.8"""
+    out = [np.linalg.eigh(this_a) for this_a in a]
+    return (np.array([o[0] for o in out]).reshape(a.shape[:-1]),
+            np.array([o[1] for o in out]).reshape(a.shape))
+
+
+def _stacked_svd(a):
+    """Replacing np.linalg.svd on stacks of matrices for numpy < 1.8"""
+    out = [np.linalg.svd(this_a) for this_a in a]
+    return tuple(np.array([o[ii] for o in out]) for ii in range(3))
+
+
+if LooseVersion(np.__version__) < LooseVersion('1.8'):
+    stacked_eigh = _stacked_eigh
+    stacked_svd = _stacked_svd
+else:
+    stacked_eigh = np.linalg.eigh
+    stacked_svd = np.linalg.svd
+
+
 def _reconstruct_partial(func, args, kwargs):
     """Helper to pickle partial functions"""
     return partial(func, *args, **(kwargs or {}))
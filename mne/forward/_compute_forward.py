@@ -5,6 +5,11 @@
 #
 # License: BSD (3-clause)
 
+import os
+import os.path as op
+import errno
+import hashlib
+import tempfile
 import numpy as np
 from copy import deepcopy
 
@@ -12,7 +17,7 @@ from ..surface import (fast_cross_3d, _find_nearest_tri_pt, _get_tri_supp_geom,
                        _triangle_coords)
 from ..fiff.constants import FIFF
 from ..transforms import apply_trans
-from ..utils import logger
+from ..utils import logger, get_config
 from ..parallel import parallel_func
 from ..fiff.compensator import get_current_comp, make_compensator
 from ..fiff.pick import pick_types
@@ -98,6 +103,68 @@ def _do_lin_field_coeff(rr, t, tn, ta, rmags, cosmags, ws, counts, func):
     return coeff
 
 
+def _hash_arrays(arrays):
+    """Get a SHA-1 hex digest of the shapes, types and values of arrays"""
+    sha = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        sha.update(str((a.dtype.str, a.shape)).encode('ascii'))
+        sha.update(a)
+    return sha.hexdigest()
+
+
+def _bem_sensors_cache_fname(kind, bem, surfs, arrays):
+    """Get the file used to store the BEM solution at a set of sensors
+
+    The name is a hash of the BEM solution, of the surfaces used and of the
+    sensor definitions. Returns None if the solutions are not cached.
+    """
+    cache_dir = get_config('MNE_CACHE_DIR')
+    if cache_dir is None or get_config('MNE_CACHE_BEM_SENSORS',
+                                       'false').lower() != 'true':
+        return None
+    arrays = [bem['solution'], bem['head_mri_t']['trans']] + arrays
+    for surf in surfs:
+        arrays += [surf['rr'], surf['tris']]
+    return op.join(cache_dir, 'bem_sensors',
+                   '%s_%s.npy' % (kind, _hash_arrays(arrays)))
+
+
+def _read_bem_sensors_cache(fname):
+    """Read a cached BEM solution at a set of sensors if there is one"""
+    if fname is None or not op.isfile(fname):
+        return None
+    logger.info('    Reading the solution from %s' % fname)
+    try:
+        return np.load(fname)
+    except (IOError, ValueError, EOFError):
+        logger.info('    Could not read %s, computing the solution' % fname)
+        return None
+
+
+def _write_bem_sensors_cache(fname, sol):
+    """Store the BEM solution at a set of sensors
+
+    The cache may be shared by concurrent jobs, so the solution is written
+    to a temporary file which is then renamed.
+    """
+    if fname is None:
+        return
+    cache_dir = op.dirname(fname)
+    try:
+        os.makedirs(cache_dir)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    fd, tmp_fname = tempfile.mkstemp(suffix='.npy', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as fid:
+            np.save(fid, sol)
+        os.rename(tmp_fname, fname)
+    except OSError:  # e.g. written by another job on Windows
+        os.remove(tmp_fname)
+
+
 def _bem_specify_coils(bem, coils, coord_frame, n_jobs):
     """Set up for computing the solution at a set of coils"""
     # Compute the weighting factors to obtain the magnetic field
@@ -116,6 +183,15 @@ def _bem_specify_coils(bem, coils, coord_frame, n_jobs):
     counts = np.array([len(coil['rmag']) for coil in coils])
     ws = np.concatenate([coil['w'] for coil in coils])
 
+    # The coefficients only depend on the coils (in MRI coordinates) and
+    # the BEM, so they can be reused across runs and sessions
+    fname = _bem_sensors_cache_fname('coils', bem, bem['surfs'],
+                                     [rmags, cosmags, ws, counts,
+                                      bem['field_mult']])
+    sol = _read_bem_sensors_cache(fname)
+    if sol is not None:
+        return sol
+
     lens = np.cumsum(np.r_[0, [len(s['rr']) for s in bem['surfs']]])
     coeff = np.empty((len(counts), lens[-1]))
     for o1, o2, surf, mult in zip(lens[:-1], lens[1:],
@@ -124,14 +200,22 @@ def _bem_specify_coils(bem, coils, coord_frame, n_jobs):
                                            ws, counts, func, n_jobs)
     # put through the bem
     sol = np.dot(coeff, bem['solution'])
+    _write_bem_sensors_cache(fname, sol)
     return sol
 
 
 def _bem_specify_els(bem, els):
     """Set up for computing the solution at a set of electrodes"""
+    scalp = bem['surfs'][0]
+    fname = _bem_sensors_cache_fname('els', bem, [scalp],
+                                     [a for el in els
+                                      for a in (el['rmag'], el['w'])])
+    sol = _read_bem_sensors_cache(fname)
+    if sol is not None:
+        return sol
+
     sol = np.zeros((len(els), bem['solution'].shape[1]))
     # Go through all coils
-    scalp = bem['surfs'][0]
     scalp['geom'] = _get_tri_supp_geom(scalp['tris'], scalp['rr'])
     inds = np.arange(len(scalp['tris']))
 
@@ -148,6 +232,7 @@ def _bem_specify_els(bem, els):
             w = elw * np.array([(1.0 - x - y), x, y])
             amt = np.dot(w, bem['solution'][tri])
             sol[k] += amt
+    _write_bem_sensors_cache(fname, sol)
     return sol
 
 
@@ -235,57 +320,75 @@ def _bem_pot_or_field(rr, mri_rr, mri_Q, mults, coils, solution, srr,
     # we can do this one in-place because it's not used elsewhere
     solution *= mults
 
-    # Both MEG and EEG have the inifinite-medium potentials
-    # This could be just vectorized, but eats too much memory, so instead we
-    # reduce memory by chunking within _do_inf_pots and parallelize, too:
-    parallel, p_fun, _ = parallel_func(_do_inf_pots, n_jobs)
+    # Only MEG gets the primary current distribution, for which the
+    # integration points of all coils are processed at once
+    if coil_type == 'meg':
+        rmags = np.concatenate([coil['rmag'] for coil in coils])
+        cosmags = np.concatenate([coil['cosmag'] for coil in coils])
+        ws = np.concatenate([coil['w'] for coil in coils])
+        counts = np.array([len(coil['rmag']) for coil in coils])
+        coil_data = (rmags, cosmags, ws, np.r_[0, np.cumsum(counts)[:-1]])
+    else:
+        coil_data = None
+
+    # The sources are split across jobs, and each job processes its sources
+    # in chunks to bound the size of the temporary arrays
+    parallel, p_fun, n_jobs = parallel_func(_do_pot_or_field, n_jobs)
     nas = np.array_split
-    B = np.sum(parallel(p_fun(mri_rr, sr.copy(), mri_Q, sol.copy())
-                        for sr, sol in zip(nas(srr, n_jobs),
-                                           nas(solution.T, n_jobs))), axis=0)
-    # The copy()s above should make it so the whole objects don't need to be
-    # pickled...
-
-    # Only MEG gets the primary current distribution
+    n_chunks = max(min(len(rr), n_jobs), 1)
+    B = np.concatenate(parallel(p_fun(r, mri_r, mri_Q, srr, solution.T,
+                                      coil_data)
+                                for r, mri_r in zip(nas(rr, n_chunks),
+                                                    nas(mri_rr, n_chunks))))
     if coil_type == 'meg':
-        # Primary current contribution (can be calc. in coil/dipole coords)
-        parallel, p_fun, _ = parallel_func(_do_prim_curr, n_jobs)
-        pcc = np.concatenate(parallel(p_fun(rr, c)
-                                      for c in nas(coils, n_jobs)), axis=1)
-        B += pcc
         B *= 1e-7  # MAG_FACTOR from C code
     return B
 
 
-def _do_prim_curr(rr, coils):
-    """Calculate primary currents in a set of coils"""
-    out = np.empty((len(rr) * 3, len(coils)))
-    for ci, c in enumerate(coils):
-        out[:, ci] = np.sum(c['w'] * _bem_inf_fields(rr, c['rmag'],
-                                                     c['cosmag']), 2).ravel()
-    return out
+# Maximum number of elements of the temporary arrays of a chunk of sources
+_max_chunk_size = 2 ** 21
 
 
-def _do_inf_pots(rr, srr, mri_Q, sol):
-    """Calculate infinite potentials using chunks"""
+def _source_chunks(n_sources, n_points):
+    """Split sources in chunks evaluated at n_points points at once"""
+    n_per = max(_max_chunk_size // (3 * n_points), 1)
+    bounds = np.r_[np.arange(0, n_sources, n_per), n_sources]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def _do_pot_or_field(rr, mri_rr, mri_Q, srr, solution, coil_data):
+    """Calculate the fields or potentials of a set of sources"""
     # The following code is equivalent to this, but saves memory
     #v0s = _bem_inf_pots(rr, srr, mri_Q)  # n_rr x 3 x n_surf_rr
     #v0s.shape = (len(rr) * 3, v0s.shape[2])
     #B = np.dot(v0s, sol)
-
-    # We chunk the source rr's in order to save memory
-    bounds = np.r_[np.arange(0, len(rr), 1000), len(rr)]
-    B = np.empty((len(rr) * 3, sol.shape[1]))
-    for bi in range(len(bounds) - 1):
-        v0s = _bem_inf_pots(rr[bounds[bi]:bounds[bi + 1]], srr, mri_Q)
+    B = np.empty((len(rr) * 3, solution.shape[1]))
+    for start, stop in _source_chunks(len(rr), len(srr)):
+        # Infinite-medium potentials on the BEM surfaces
+        v0s = _bem_inf_pots(mri_rr[start:stop], srr, mri_Q)
         v0s.shape = (v0s.shape[0] * 3, v0s.shape[2])
-        B[3 * bounds[bi]:3 * bounds[bi + 1]] = np.dot(v0s, sol)
+        B[3 * start:3 * stop] = np.dot(v0s, solution)
+
+    if coil_data is not None:
+        # Primary current contribution (can be calc. in coil/dipole coords)
+        rmags, cosmags, ws, offsets = coil_data
+        for start, stop in _source_chunks(len(rr), len(rmags)):
+            fields = _bem_inf_fields(rr[start:stop], rmags, cosmags)
+            fields *= ws
+            fields = np.add.reduceat(fields, offsets, axis=2)
+            B[3 * start:3 * stop] += fields.reshape(-1, len(offsets))
     return B
 
 
 def _compute_forwards(src, bem, coils_list, cfs, ccoils_list, ccfs,
-                      infos, coil_types, n_jobs):
-    """Compute the MEG and EEG forward solutions"""
+                      infos, coil_types, n_jobs, n_positions=1):
+    """Compute the MEG and EEG forward solutions
+
+    The MEG coils (and compensation coils) can be the concatenation of the
+    coils at n_positions head positions. The source dependent computations
+    are then shared by all positions, and the columns of the MEG solution
+    are those of each position in turn.
+    """
     if bem['bem_method'] != 'linear collocation':
         raise RuntimeError('only linear collocation supported')
 
@@ -338,12 +441,17 @@ def _compute_forwards(src, bem, coils_list, cfs, ccoils_list, ccfs,
                                          ccoils, csolution, srr, n_jobs,
                                          coil_type)
                 # Combine solutions so we can do the compensation
-                both = np.zeros((work.shape[0], B.shape[1] + work.shape[1]))
-                picks = pick_types(info, meg=True, ref_meg=False)
-                both[:, picks] = B
-                picks = pick_types(info, meg=False, ref_meg=True)
-                both[:, picks] = work
-                B = np.dot(both, compensator.T)
+                meg_picks = pick_types(info, meg=True, ref_meg=False)
+                ref_picks = pick_types(info, meg=False, ref_meg=True)
+                Bs_comp = list()
+                for this_B, this_work in zip(np.split(B, n_positions, 1),
+                                             np.split(work, n_positions, 1)):
+                    both = np.zeros((this_work.shape[0], this_B.shape[1] +
+                                     this_work.shape[1]))
+                    both[:, meg_picks] = this_B
+                    both[:, ref_picks] = this_work
+                    Bs_comp.append(np.dot(both, compensator.T))
+                B = np.concatenate(Bs_comp, axis=1)
             Bs.append(B)
 
     return Bs
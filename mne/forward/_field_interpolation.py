@@ -11,6 +11,7 @@ from ..surface import get_head_surf, get_meg_helmet_surf
 from ..fiff.proj import _has_eeg_average_ref_proj, make_projector
 from ..transforms import transform_surface_to, read_trans
 from ._make_forward import _create_coils
+from ._compute_forward import _hash_arrays
 from ._lead_dots import (_do_self_dots, _do_surface_dots, _get_legen_table,
                          _get_legen_lut_fast, _get_legen_lut_accurate)
 from ..parallel import check_n_jobs
@@ -37,6 +38,33 @@ def _ad_hoc_noise(coils, ch_type='meg'):
     return cov
 
 
+# cache of the dot products of the field mapping, the keys are hashes of the
+# sensor and surface geometries, the order of the keys in _dots_cache_order
+# is the order of use
+_dots_cache = dict()
+_dots_cache_order = list()
+_dots_cache_max_bytes = 2 ** 28
+
+
+def _clear_dots_cache():
+    """Empty the cache of field mapping dot products"""
+    _dots_cache.clear()
+    del _dots_cache_order[:]
+
+
+def _store_dots(key, self_dots, surface_dots):
+    """Add dot products to the cache and drop the least recently used"""
+    if key in _dots_cache:
+        _dots_cache_order.remove(key)
+    _dots_cache[key] = (self_dots, surface_dots)
+    _dots_cache_order.append(key)
+    n_bytes = sum(sum(d.nbytes for d in _dots_cache[k])
+                  for k in _dots_cache_order)
+    while n_bytes > _dots_cache_max_bytes and len(_dots_cache_order) > 1:
+        old_key = _dots_cache_order.pop(0)
+        n_bytes -= sum(d.nbytes for d in _dots_cache.pop(old_key))
+
+
 def _compute_mapping_matrix(fmd, info):
     """Do the hairy computations"""
     logger.info('preparing the mapping matrix...')
@@ -119,6 +147,12 @@ def _make_surface_mapping(info, surf, ch_type='meg', trans=None, mode='fast',
     mapping : array
         A n_vertices x n_sensors array that remaps the MEG or EEG data,
         as `new_data = np.dot(mapping, data)`.
+
+    Notes
+    -----
+    The dot products of the lead fields, which depend only on the sensor
+    positions and on the surface, are cached in memory and reused by
+    later calls with the same geometry.
     """
     if not all([key in surf for key in ['rr', 'nn']]):
         raise KeyError('surf must have both "rr" and "nn"')
@@ -180,15 +214,29 @@ def _make_surface_mapping(info, surf, ch_type='meg', trans=None, mode='fast',
         # Use 100 coefficients with linear interpolation
         lut, n_fact = _get_legen_table(ch_type, False, 100)
         lut_fun = partial(_get_legen_lut_accurate, lut=lut)
-    logger.info('Computing dot products for %i %s...' % (len(coils), type_str))
-    self_dots = _do_self_dots(int_rad, False, coils, my_origin, ch_type,
-                              lut_fun, n_fact, n_jobs)
-    sel = np.arange(len(surf['rr']))  # eventually we should do sub-selection
-    logger.info('Computing dot products for %i surface locations...'
-                % len(sel))
-    surface_dots = _do_surface_dots(int_rad, False, coils, surf, sel,
-                                    my_origin, ch_type, lut_fun, n_fact,
-                                    n_jobs)
+    # The dot products only depend on the geometry, so they are reused for
+    # the same sensors (in head coordinates) and surface
+    key = (ch_type, mode, _hash_arrays([a for coil in coils for a in
+                                        (coil['rmag'], coil['cosmag'],
+                                         coil['w'])] +
+                                       [surf['rr'], surf['nn']]))
+    if key in _dots_cache:
+        logger.info('Using the cached dot products...')
+        self_dots, surface_dots = _dots_cache[key]
+        _store_dots(key, self_dots, surface_dots)
+    else:
+        logger.info('Computing dot products for %i %s...'
+                    % (len(coils), type_str))
+        self_dots = _do_self_dots(int_rad, False, coils, my_origin, ch_type,
+                                  lut_fun, n_fact, n_jobs)
+        # eventually we should do sub-selection
+        sel = np.arange(len(surf['rr']))
+        logger.info('Computing dot products for %i surface locations...'
+                    % len(sel))
+        surface_dots = _do_surface_dots(int_rad, False, coils, surf, sel,
+                                        my_origin, ch_type, lut_fun, n_fact,
+                                        n_jobs)
+        _store_dots(key, self_dots, surface_dots)
 
     #
     # Step 4. Return the result
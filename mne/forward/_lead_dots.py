@@ -123,7 +123,8 @@ def _get_legen_lut_accurate(x, lut):
     idx = np.floor(mm).astype(int)
     w2 = mm - idx
     w2.shape += tuple([1] * (lut.ndim - w2.ndim))  # expand to correct size
-    vals = (1 - w2) * lut[idx] + w2 * lut[idx + 1]
+    vals = (1 - w2) * lut[idx]
+    vals += w2 * lut[idx + 1]
     return vals
 
 
@@ -212,6 +213,7 @@ def _fast_sphere_dot_r0(r, rr1, rr2, lr1, lr2, cosmags1, cosmags2,
         result = eeg_const * sums / lr1lr2
     # new we add them all up with weights
     if w1 is None:  # operating on surface, treat independently
+        # w2 can also be a (n_rr2, n_coils) matrix summing several coils
         #result = np.sum(w2[np.newaxis, :] * result, axis=1)
         result = np.dot(result, w2)
     else:
@@ -220,37 +222,72 @@ def _fast_sphere_dot_r0(r, rr1, rr2, lr1, lr2, cosmags1, cosmags2,
     return result
 
 
+# Maximum number of elements of the Legendre coefficients evaluated at once
+_max_block_size = 2 ** 18
+
+
+def _dot_blocks(n_rows, n_cols, n_fact):
+    """Split rows in blocks bounding the size of the temporary arrays"""
+    n_per = max(_max_block_size // (n_cols * n_fact.size), 1)
+    return [slice(start, start + n_per) for start in range(0, n_rows, n_per)]
+
+
+def _concatenate_coils(coils, r0):
+    """Concatenate the integration points of all coils
+
+    The points are returned as directions and distances from the expansion
+    center r0, together with a (n_points, n_coils) matrix of weights that
+    sums the integration points of each coil.
+    """
+    rmags = np.concatenate([coil['rmag'] for coil in coils])
+    rmags = rmags - r0[np.newaxis, :]
+    rlens = np.sqrt(np.sum(rmags * rmags, axis=1))
+    rmags /= rlens[:, np.newaxis]
+    cosmags = np.concatenate([coil['cosmag'] for coil in coils])
+    counts = [len(coil['rmag']) for coil in coils]
+    ws = np.zeros((len(rmags), len(coils)))
+    ws[np.arange(len(rmags)), np.repeat(np.arange(len(coils)), counts)] = \
+        np.concatenate([coil['w'] for coil in coils])
+    return rmags, rlens, cosmags, ws
+
+
 def _do_self_dots(intrad, volume, coils, r0, ch_type, lut, n_fact, n_jobs):
     """Perform the lead field dot product integrations"""
     if ch_type == 'eeg':
         intrad *= 0.7
     # convert to normalized distances from expansion center
-    rmags = [coil['rmag'] - r0[np.newaxis, :] for coil in coils]
-    rlens = [np.sqrt(np.sum(r * r, axis=1)) for r in rmags]
-    rmags = [r / rl[:, np.newaxis] for r, rl in zip(rmags, rlens)]
-    cosmags = [coil['cosmag'] for coil in coils]
-    ws = [coil['w'] for coil in coils]
-    parallel, p_fun, _ = parallel_func(_do_self_dots_subset, n_jobs)
+    rmags, rlens, cosmags, ws = _concatenate_coils(coils, r0)
+    bounds = np.r_[0, np.cumsum([len(coil['rmag']) for coil in coils])]
+    parallel, p_fun, n_jobs = parallel_func(_do_self_dots_subset, n_jobs)
+    # interleave the coils so that the jobs get similar amounts of work
     prods = parallel(p_fun(intrad, rmags, rlens, cosmags,
-                           ws, volume, lut, n_fact, ch_type, idx)
-                     for idx in np.array_split(np.arange(len(rmags)), n_jobs))
+                           ws, bounds, volume, lut, n_fact, ch_type, idx)
+                     for idx in [np.arange(ii, len(coils), n_jobs)
+                                 for ii in range(n_jobs)])
     products = np.sum(prods, axis=0)
+    # only the lower triangle is computed
+    products = np.tril(products) + np.tril(products, -1).T
     return products
 
 
-def _do_self_dots_subset(intrad, rmags, rlens, cosmags, ws, volume, lut,
-                         n_fact, ch_type, idx):
+def _do_self_dots_subset(intrad, rmags, rlens, cosmags, ws, bounds, volume,
+                         lut, n_fact, ch_type, idx):
     """Helper for parallelization"""
-    products = np.zeros((len(rmags), len(rmags)))
-    for ci1 in idx:
-        for ci2 in range(0, ci1 + 1):
-            res = _fast_sphere_dot_r0(intrad, rmags[ci1], rmags[ci2],
-                                      rlens[ci1], rlens[ci2],
-                                      cosmags[ci1], cosmags[ci2],
-                                      ws[ci1], ws[ci2], volume, lut,
-                                      n_fact, ch_type)
-            products[ci1, ci2] = res
-            products[ci2, ci1] = res
+    # Each block of coils is done against the coils up to the last one of
+    # the block at once
+    n_max = np.max(np.diff(bounds)) if len(bounds) > 1 else 1
+    products = np.zeros((ws.shape[1], ws.shape[1]))
+    for blk in _dot_blocks(len(idx), n_max * len(rmags), n_fact):
+        ci1 = idx[blk]
+        rows = np.concatenate([np.arange(bounds[c], bounds[c + 1])
+                               for c in ci1])
+        n_cols = bounds[ci1[-1] + 1]
+        res = _fast_sphere_dot_r0(intrad, rmags[rows], rmags[:n_cols],
+                                  rlens[rows], rlens[:n_cols],
+                                  cosmags[rows], cosmags[:n_cols], None,
+                                  ws[:n_cols, :ci1[-1] + 1], volume, lut,
+                                  n_fact, ch_type)
+        products[ci1, :ci1[-1] + 1] = np.dot(ws[rows][:, ci1].T, res)
     return products
 
 
@@ -259,11 +296,7 @@ def _do_surface_dots(intrad, volume, coils, surf, sel, r0, ch_type,
     """Compute the map construction products"""
     virt_ref = False
     # convert to normalized distances from expansion center
-    rmags = [coil['rmag'] - r0[np.newaxis, :] for coil in coils]
-    rlens = [np.sqrt(np.sum(r * r, axis=1)) for r in rmags]
-    rmags = [r / rl[:, np.newaxis] for r, rl in zip(rmags, rlens)]
-    cosmags = [coil['cosmag'] for coil in coils]
-    ws = [coil['w'] for coil in coils]
+    rmags, rlens, cosmags, ws = _concatenate_coils(coils, r0)
     rref = None
     refl = None
     if ch_type == 'eeg':
@@ -278,12 +311,12 @@ def _do_surface_dots(intrad, volume, coils, surf, sel, r0, ch_type,
     rsurf /= lsurf[:, np.newaxis]
     this_nn = surf['nn'][sel]
 
-    parallel, p_fun, _ = parallel_func(_do_surface_dots_subset, n_jobs)
+    parallel, p_fun, n_jobs = parallel_func(_do_surface_dots_subset, n_jobs)
     prods = parallel(p_fun(intrad, rsurf, rmags, rref, refl, lsurf, rlens,
                            this_nn, cosmags, ws, volume, lut, n_fact, ch_type,
                            idx)
-                     for idx in np.array_split(np.arange(len(rmags)), n_jobs))
-    products = np.sum(prods, axis=0)
+                     for idx in np.array_split(np.arange(len(rsurf)), n_jobs))
+    products = np.concatenate(prods)
     return products
 
 
@@ -291,19 +324,18 @@ def _do_surface_dots_subset(intrad, rsurf, rmags, rref, refl, lsurf, rlens,
                             this_nn, cosmags, ws, volume, lut, n_fact, ch_type,
                             idx):
     """Helper for parallelization"""
-    products = np.zeros((len(rsurf), len(rmags)))
-    for ci in idx:
-        res = _fast_sphere_dot_r0(intrad, rsurf, rmags[ci],
-                                  lsurf, rlens[ci],
-                                  this_nn, cosmags[ci],
-                                  None, ws[ci], volume, lut,
-                                  n_fact, ch_type)
-        if rref is not None:
-            vres = _fast_sphere_dot_r0(intrad, rref, rmags[ci],
-                                       refl, rlens[ci],
-                                       None, ws[ci], volume,
-                                       lut, n_fact, ch_type)
-            products[:, ci] = res - vres
-        else:
-            products[:, ci] = res
+    # Each block of surface points is done for all coils at once
+    products = np.empty((len(idx), ws.shape[1]))
+    for blk in _dot_blocks(len(idx), len(rmags), n_fact):
+        sel = idx[blk]
+        products[blk] = _fast_sphere_dot_r0(intrad, rsurf[sel], rmags,
+                                            lsurf[sel], rlens,
+                                            this_nn[sel], cosmags,
+                                            None, ws, volume, lut,
+                                            n_fact, ch_type)
+    if rref is not None:
+        vres = _fast_sphere_dot_r0(intrad, rref, rmags, refl, rlens,
+                                   None, cosmags, None, ws, volume,
+                                   lut, n_fact, ch_type)
+        products -= vres
     return products
@@ -218,6 +218,13 @@ def make_forward_solution(info, mri, src, bem, fname=None, meg=True, eeg=True,
     (e.g., `--grad`, `--fixed`) are not implemented here. For those,
     consider using the C command line tools or the Python wrapper
     `do_forward_solution`.
+
+    If the MNE_CACHE_BEM_SENSORS config value is 'true' and MNE_CACHE_DIR
+    is set, the BEM solutions at the MEG coils and EEG electrodes are
+    stored in a "bem_sensors" subdirectory of MNE_CACHE_DIR. They are
+    reused whenever the same BEM and sensor positions (including the
+    device to head and head to MRI transforms) are used again, e.g. for
+    several runs of the same session.
     """
     # Currently not (sup)ported:
     # 1. EEG Sphere model (not used much)
@@ -225,6 +232,159 @@ def make_forward_solution(info, mri, src, bem, fname=None, meg=True, eeg=True,
     # 3. --fixed option (can be computed post-hoc)
     # 4. --mricoord option (probably not necessary)
 
+    (info, mri_head_t, src, bem, megchs, compchs, eegchs, meg_info,
+     megnames, eegnames, templates, coord_frame) = \
+        _prepare_for_forward(info, mri, src, bem, fname, meg, eeg, mindist,
+                             ignore_ref, overwrite, n_jobs, verbose)
+    megcoils, megcf, compcoils, compcf, eegels = \
+        _create_meg_eeg_coils(megchs, compchs, eegchs, info['dev_head_t'],
+                              templates)
+
+    # Time to do the heavy lifting: MEG first, then EEG
+    coil_types = ['meg', 'eeg']
+    coils = [megcoils, eegels]
+    cfs = [megcf, None]
+    ccoils = [compcoils, None]
+    ccfs = [compcf, None]
+    infos = [meg_info, None]
+    megfwd, eegfwd = _compute_forwards(src, bem, coils, cfs, ccoils, ccfs,
+                                       infos, coil_types, n_jobs)
+
+    fwd = _make_forward_dict(info, src, megfwd, eegfwd, megnames, eegnames,
+                             coord_frame, mri_head_t, meg, eeg)
+    if fname is not None:
+        logger.info('writing %s...', fname)
+        write_forward_solution(fname, fwd, overwrite, verbose=False)
+
+    logger.info('Finished.')
+    return fwd
+
+
+@verbose
+def make_forward_solution_positions(info, mri, src, bem, dev_head_ts,
+                                    meg=True, eeg=True, mindist=0.0,
+                                    ignore_ref=False, n_jobs=1, verbose=None):
+    """Calculate the gain matrices of a subject for several head positions
+
+    The source spaces and the BEM model are set up once and the computations
+    which depend on the sources are shared by all head positions, so this is
+    much faster than calling make_forward_solution for each position.
+
+    Parameters
+    ----------
+    info : instance of mne.fiff.meas_info.Info | str
+        If str, then it should be a filename to a Raw, Epochs, or Evoked
+        file with measurement information. If dict, should be an info
+        dict (such as one from Raw, Epochs, or Evoked).
+    mri : dict | str
+        Either a transformation filename (usually made using mne_analyze)
+        or an info dict (usually opened using read_trans()).
+        If string, an ending of `.fif` or `.fif.gz` will be assumed to
+        be in FIF format, any other ending will be assumed to be a text
+        file with a 4x4 transformation matrix (like the `--trans` MNE-C
+        option).
+    src : str | instance of SourceSpaces
+        If string, should be a source space filename. Can also be an
+        instance of loaded or generated SourceSpaces.
+    bem : str
+        Filename of the BEM (e.g., "sample-5120-5120-5120-bem-sol.fif") to
+        use.
+    dev_head_ts : list of dict | array, shape (n_positions, 4, 4)
+        The device to head transformations of the head positions, e.g.
+        the ones of several runs. The transformation of the head position
+        at time t[i] returned by get_chpi_positions is the 4x4 matrix with
+        rotation[i] as its upper left 3x3 block and translation[i] as the
+        first three elements of its last column.
+    meg : bool
+        If True (Default), include MEG computations.
+    eeg : bool
+        If True (Default), include EEG computations.
+    mindist : float
+        Minimum distance of sources from inner skull surface (in mm).
+    ignore_ref : bool
+        If True, do not include reference channels in compensation. This
+        option should be True for KIT files, since forward computation
+        with reference channels is not currently supported.
+    n_jobs : int
+        Number of jobs to run in parallel.
+    verbose : bool, str, int, or None
+        If not None, override default verbose level (see mne.verbose).
+
+    Returns
+    -------
+    fwd : dict
+        The forward solution for the first head position. The channels and
+        sources of the gain matrices are those of this forward solution.
+    gains : array, shape (n_positions, n_channels, 3 * n_sources)
+        The gain matrices (free source orientations) for all head
+        positions.
+    """
+    dev_head_ts = _check_dev_head_ts(dev_head_ts)
+    n_positions = len(dev_head_ts)
+
+    (info, mri_head_t, src, bem, megchs, compchs, eegchs, meg_info,
+     megnames, eegnames, templates, coord_frame) = \
+        _prepare_for_forward(info, mri, src, bem, None, meg, eeg, mindist,
+                             ignore_ref, False, n_jobs, verbose)
+
+    # The coils of all positions are processed together, the EEG electrodes
+    # do not move with respect to the head
+    logger.info('Creating the coil definitions of %d head positions...'
+                % n_positions)
+    all_coils = [_create_meg_eeg_coils(megchs, compchs, eegchs, t, templates)
+                 for t in dev_head_ts]
+    megcoils, megcf, compcoils, compcf, eegels = all_coils[0]
+    if megcoils is not None:
+        megcoils = sum([c[0] for c in all_coils], [])
+    if compcoils is not None:
+        compcoils = sum([c[2] for c in all_coils], [])
+
+    megfwd, eegfwd = _compute_forwards(src, bem, [megcoils, eegels],
+                                       [megcf, None], [compcoils, None],
+                                       [compcf, None], [meg_info, None],
+                                       ['meg', 'eeg'], n_jobs, n_positions)
+
+    # Assemble the gain matrices, MEG channels first like in the forward
+    gains = list()
+    megfwds = (np.split(megfwd, n_positions, 1) if megfwd is not None
+               else [None] * n_positions)
+    for this_megfwd in megfwds:
+        gains.append(np.concatenate([f.T for f in (this_megfwd, eegfwd)
+                                     if f is not None]))
+    gains = np.array(gains)
+
+    info['dev_head_t'] = dev_head_ts[0]
+    fwd = _make_forward_dict(info, src, megfwds[0], eegfwd, megnames,
+                             eegnames, coord_frame, mri_head_t, meg, eeg)
+    logger.info('Finished.')
+    return fwd, gains
+
+
+def _check_dev_head_ts(dev_head_ts):
+    """Make device to head transformation dicts"""
+    trans = list()
+    for t in dev_head_ts:
+        if isinstance(t, dict):
+            if not (t['from'] == FIFF.FIFFV_COORD_DEVICE and
+                    t['to'] == FIFF.FIFFV_COORD_HEAD):
+                raise ValueError('dev_head_ts must contain device to head '
+                                 'transformations')
+            t = t['trans']
+        t = np.asarray(t, dtype=np.float64)
+        if t.shape != (4, 4):
+            raise ValueError('dev_head_ts must contain 4x4 transformation '
+                             'matrices, got shape %s' % (t.shape,))
+        trans.append({'from': FIFF.FIFFV_COORD_DEVICE,
+                      'to': FIFF.FIFFV_COORD_HEAD, 'trans': t})
+    if len(trans) == 0:
+        raise ValueError('At least one head position is needed')
+    return trans
+
+
+def _prepare_for_forward(info, mri, src, bem, fname, meg, eeg, mindist,
+                         ignore_ref, overwrite, n_jobs, verbose):
+    """Read and set up everything which does not depend on the head position
+    """
     if isinstance(mri, string_types):
         if not op.isfile(mri):
             raise IOError('mri file "%s" not found' % mri)
@@ -315,7 +475,7 @@ def make_forward_solution(info, mri, src, bem, fname=None, meg=True, eeg=True,
     logger.info('')
 
     # MEG channels
-    megnames = None
+    megnames, megchs, compchs, eegchs = None, None, None, None
     if meg:
         picks = pick_types(info, meg=True, eeg=False, ref_meg=False,
                            exclude=[])
@@ -371,31 +531,11 @@ def make_forward_solution(info, mri, src, bem, fname=None, meg=True, eeg=True,
     if neeg <= 0 and nmeg <= 0:
         raise RuntimeError('Could not find any MEG or EEG channels')
 
-    # Create coil descriptions with transformation to head or MRI frame
     templates = _read_coil_defs()
     if nmeg > 0 and ncomp > 0:  # Compensation channel information
         logger.info('%d compensation data sets in %s'
                     % (ncomp_data, info_extra))
 
-    meg_xform = meg_head_t
-    extra_str = 'Head'
-
-    megcoils, megcf, compcoils, compcf = None, None, None, None
-    if nmeg > 0:
-        megcoils, megcf = _create_coils(megchs,
-                                        FIFF.FWD_COIL_ACCURACY_ACCURATE,
-                                        meg_xform, coil_type='meg',
-                                        coilset=templates)
-        if ncomp > 0:
-            compcoils, compcf = _create_coils(compchs,
-                                              FIFF.FWD_COIL_ACCURACY_NORMAL,
-                                              meg_xform, coil_type='meg',
-                                              coilset=templates)
-    eegels = None
-    if neeg > 0:
-        eegels, _ = _create_coils(eegchs, coil_type='eeg')
-    logger.info('%s coordinate coil definitions created.' % extra_str)
-
     # Transform the source spaces into the appropriate coordinates
     for s in src:
         transform_surface_to(s, coord_frame, mri_head_t)
@@ -433,16 +573,33 @@ def make_forward_solution(info, mri, src, bem, fname=None, meg=True, eeg=True,
                           n_jobs)
     logger.info('')
 
-    # Time to do the heavy lifting: MEG first, then EEG
-    coil_types = ['meg', 'eeg']
-    coils = [megcoils, eegels]
-    cfs = [megcf, None]
-    ccoils = [compcoils, None]
-    ccfs = [compcf, None]
-    infos = [meg_info, None]
-    megfwd, eegfwd = _compute_forwards(src, bem, coils, cfs, ccoils, ccfs,
-                                       infos, coil_types, n_jobs)
+    return (info, mri_head_t, src, bem, megchs, compchs, eegchs, meg_info,
+            megnames, eegnames, templates, coord_frame)
+
 
+def _create_meg_eeg_coils(megchs, compchs, eegchs, meg_head_t, templates):
+    """Create the coil and electrode definitions in head coordinates"""
+    megcoils, megcf, compcoils, compcf = None, None, None, None
+    if megchs is not None:
+        megcoils, megcf = _create_coils(megchs,
+                                        FIFF.FWD_COIL_ACCURACY_ACCURATE,
+                                        meg_head_t, coil_type='meg',
+                                        coilset=templates)
+        if compchs is not None:
+            compcoils, compcf = _create_coils(compchs,
+                                              FIFF.FWD_COIL_ACCURACY_NORMAL,
+                                              meg_head_t, coil_type='meg',
+                                              coilset=templates)
+    eegels = None
+    if eegchs is not None:
+        eegels, _ = _create_coils(eegchs, coil_type='eeg')
+    logger.info('Head coordinate coil definitions created.')
+    return megcoils, megcf, compcoils, compcf, eegels
+
+
+def _make_forward_dict(info, src, megfwd, eegfwd, megnames, eegnames,
+                       coord_frame, mri_head_t, meg, eeg):
+    """Put the MEG and EEG gain matrices in a forward solution dict"""
     # merge forwards into one
     megfwd = _to_forward_dict(megfwd, None, megnames, coord_frame,
                               FIFF.FIFFV_MNE_FREE_ORI)
@@ -471,11 +628,6 @@ def make_forward_solution(info, mri, src, bem, fname=None, meg=True, eeg=True,
                     source_rr=source_rr, surf_ori=False,
                     mri_head_t=mri_head_t))
     fwd['info']['mri_head_t'] = mri_head_t
-    if fname is not None:
-        logger.info('writing %s...', fname)
-        write_forward_solution(fname, fwd, overwrite, verbose=False)
-
-    logger.info('Finished.')
     return fwd
 
 
@@ -151,3 +151,45 @@ def test_make_field_map_meg():
     assert_true(len(fmd[0]['ch_names']), 106)
 
     assert_raises(ValueError, make_field_map, evoked, ch_type='foobar')
+
+
+def test_make_surface_mapping_dots():
+    """Test computing and caching the dot products of the field mapping
+    """
+    from mne.fiff.array import create_info
+    from mne.fiff.constants import FIFF
+    from mne.forward import _field_interpolation, _lead_dots
+    from mne.surface import _tessellate_sphere_surf
+    rng = np.random.RandomState(0)
+    n_channels = 20
+    info = create_info(['EEG %03d' % ii for ii in range(n_channels)], 1000.,
+                       ['eeg'] * n_channels)
+    pos = rng.randn(n_channels, 3)
+    pos[:, 2] = np.abs(pos[:, 2])
+    pos *= 0.09 / np.sqrt(np.sum(pos ** 2, axis=1))[:, np.newaxis]
+    pos[:, 2] += 0.04
+    for ch, p in zip(info['chs'], pos):
+        ch['eeg_loc'] = p[:, np.newaxis]
+    surf = _tessellate_sphere_surf(2, 0.1)
+    surf['rr'][:, 2] += 0.04
+    surf['coord_frame'] = FIFF.FIFFV_COORD_HEAD
+
+    _field_interpolation._clear_dots_cache()
+    fmd = _make_surface_mapping(info, surf, 'eeg')
+    assert_array_equal(fmd['data'].shape, (len(surf['rr']), n_channels))
+    assert_true(len(_field_interpolation._dots_cache) == 1)
+    # the cached dot products are used for the same geometry
+    fmd_cached = _make_surface_mapping(info, surf, 'eeg', n_jobs=2)
+    assert_allclose(fmd_cached['data'], fmd['data'])
+    assert_true(len(_field_interpolation._dots_cache) == 1)
+
+    # the results do not depend on the size of the blocks
+    max_block_size = _lead_dots._max_block_size
+    _lead_dots._max_block_size = 100
+    try:
+        _field_interpolation._clear_dots_cache()
+        fmd_blocks = _make_surface_mapping(info, surf, 'eeg')
+        assert_allclose(fmd_blocks['data'], fmd['data'], rtol=1e-10)
+    finally:
+        _lead_dots._max_block_size = max_block_size
+        _field_interpolation._clear_dots_cache()
@@ -4,7 +4,8 @@ import os
 import os.path as op
 from subprocess import CalledProcessError
 
-from nose.tools import assert_raises
+from nose.tools import assert_raises, assert_true
+import numpy as np
 from numpy.testing import (assert_equal, assert_allclose)
 
 from mne.datasets import sample
@@ -14,6 +15,14 @@ from mne.fiff.bti import read_raw_bti
 from mne import (read_forward_solution, make_forward_solution,
                  do_forward_solution, setup_source_space, read_trans,
                  convert_forward_solution)
+from mne.forward import _compute_forward
+from mne.forward._compute_forward import (_bem_pot_or_field, _bem_inf_pots,
+                                          _bem_inf_fields, _bem_specify_coils,
+                                          _bem_specify_els, _compute_forwards)
+from mne.forward._make_forward import (_create_meg_eeg_coils,
+                                       _read_coil_defs, _check_dev_head_ts)
+from mne.fiff.constants import FIFF
+from mne.surface import _tessellate_sphere_surf, _complete_surface_info
 from mne.utils import requires_mne, _TempDir
 from mne.tests.test_source_space import _compare_source_spaces
 
@@ -240,3 +249,159 @@ def test_do_forward_solution():
 
     # No need to actually calculate and check here, since it's effectively
     # done in previous tests.
+
+
+def test_bem_pot_or_field_chunks():
+    """Test computing BEM fields and potentials in chunks of sources
+    """
+    rng = np.random.RandomState(0)
+    n_src, n_bem, n_coils = 300, 200, 10
+    rr = 0.03 * rng.randn(n_src, 3)
+    mri_rr = rr + 0.001
+    mri_Q = np.eye(3) + 0.01 * rng.randn(3, 3)
+    srr = 0.1 * rng.randn(n_bem, 3)
+    coils = [dict(rmag=0.01 * rng.randn(n, 3) + [0, 0, 0.12],
+                  cosmag=rng.randn(n, 3), w=rng.rand(n))
+             for n in rng.randint(1, 9, n_coils)]
+    mults = rng.rand(1, n_bem)
+    solution = rng.randn(n_coils, n_bem)
+
+    # all sources at once
+    v0s = _bem_inf_pots(mri_rr, srr, mri_Q).reshape(3 * n_src, n_bem)
+    B_eeg = np.dot(v0s, (solution * mults).T)
+    prim = np.array([np.sum(c['w'] * _bem_inf_fields(rr, c['rmag'],
+                                                     c['cosmag']), 2).ravel()
+                     for c in coils]).T
+    B_meg = 1e-7 * (B_eeg + prim)
+
+    max_chunk_size = _compute_forward._max_chunk_size
+    _compute_forward._max_chunk_size = 1000
+    try:
+        for n_jobs in [1, 2]:
+            for coil_type, B in zip(['eeg', 'meg'], [B_eeg, B_meg]):
+                B_chunks = _bem_pot_or_field(rr, mri_rr, mri_Q, mults, coils,
+                                             solution.copy(), srr, n_jobs,
+                                             coil_type)
+                assert_allclose(B_chunks, B, rtol=1e-10,
+                                atol=1e-10 * np.abs(B).max())
+    finally:
+        _compute_forward._max_chunk_size = max_chunk_size
+
+
+def test_bem_sensors_cache():
+    """Test caching the BEM solutions at the sensors on disk
+    """
+    rng = np.random.RandomState(0)
+    surf = _complete_surface_info(_tessellate_sphere_surf(2, 0.09))
+    n_rr = len(surf['rr'])
+    bem = dict(surfs=[surf], field_mult=np.array([0.3]),
+               solution=rng.randn(n_rr, n_rr),
+               head_mri_t=dict(trans=np.eye(4)))
+    coils = [dict(rmag=0.01 * rng.randn(n, 3) + [0, 0, 0.12],
+                  cosmag=rng.randn(n, 3), w=rng.rand(n))
+             for n in rng.randint(1, 9, 5)]
+    els = [dict(rmag=1.05 * np.mean(surf['rr'][tri], axis=0)[np.newaxis],
+                w=np.ones(1)) for tri in surf['tris'][:5]]
+    cache_dir = op.join(temp_dir, 'cache')
+    fname_dir = op.join(cache_dir, 'bem_sensors')
+
+    keys = ('MNE_CACHE_DIR', 'MNE_CACHE_BEM_SENSORS')
+    old_env = [os.environ.get(k) for k in keys]
+    os.environ['MNE_CACHE_DIR'] = cache_dir
+    os.environ['MNE_CACHE_BEM_SENSORS'] = 'true'
+    try:
+        sol_coils = _bem_specify_coils(bem, coils, FIFF.FIFFV_COORD_MRI, 1)
+        sol_els = _bem_specify_els(bem, els)
+        assert_equal(len(os.listdir(fname_dir)), 2)
+        # the cached solutions are used
+        assert_allclose(_bem_specify_coils(bem, coils, FIFF.FIFFV_COORD_MRI,
+                                           1), sol_coils)
+        assert_allclose(_bem_specify_els(bem, els), sol_els)
+        assert_equal(len(os.listdir(fname_dir)), 2)
+        # other sensor positions give other files
+        coils[0]['rmag'] = coils[0]['rmag'] + 0.001
+        sol_moved = _bem_specify_coils(bem, coils, FIFF.FIFFV_COORD_MRI, 1)
+        assert_equal(len(os.listdir(fname_dir)), 3)
+        assert_true(np.abs(sol_moved - sol_coils).max() > 0)
+        # truncated files are computed again
+        for fname in os.listdir(fname_dir):
+            with open(op.join(fname_dir, fname), 'r+b') as fid:
+                fid.truncate(100)
+        assert_allclose(_bem_specify_els(bem, els), sol_els)
+        assert_allclose(_bem_specify_coils(bem, coils, FIFF.FIFFV_COORD_MRI,
+                                           1), sol_moved)
+        assert_equal(len(os.listdir(fname_dir)), 3)
+    finally:
+        for k, v in zip(keys, old_env):
+            if v is None:
+                os.environ.pop(k)
+            else:
+                os.environ[k] = v
+
+    # without caching, the same results are computed again
+    assert_allclose(_bem_specify_els(bem, els), sol_els)
+    assert_allclose(_bem_specify_coils(bem, coils, FIFF.FIFFV_COORD_MRI, 1),
+                    sol_moved)
+
+
+def test_compute_forwards_positions():
+    """Test computing the forward solution for several head positions at once
+    """
+    rng = np.random.RandomState(0)
+    surf = _complete_surface_info(_tessellate_sphere_surf(2, 0.09))
+    n_rr = len(surf['rr'])
+    bem = dict(surfs=[surf], field_mult=np.array([0.3]),
+               source_mult=np.array([2.]), bem_method='linear collocation',
+               solution=rng.randn(n_rr, n_rr),
+               head_mri_t={'from': FIFF.FIFFV_COORD_HEAD,
+                           'to': FIFF.FIFFV_COORD_MRI, 'trans': np.eye(4)})
+    src = [dict(rr=0.03 * rng.randn(20, 3), vertno=np.arange(0, 20, 2))]
+    megchs = list()
+    for ii in range(6):
+        coil_trans = np.eye(4)
+        coil_trans[:3, 3] = 0.01 * rng.randn(3) + [0, 0, 0.11]
+        megchs.append(dict(ch_name='MEG %03d' % ii, kind=FIFF.FIFFV_MEG_CH,
+                           coil_type=FIFF.FIFFV_COIL_VV_MAG_T3,
+                           coil_trans=coil_trans))
+    eegchs = [dict(ch_name='EEG %03d' % ii, kind=FIFF.FIFFV_EEG_CH,
+                   coil_type=FIFF.FIFFV_COIL_EEG,
+                   eeg_loc=1.05 * np.mean(surf['rr'][tri], 0)[:, np.newaxis])
+              for ii, tri in enumerate(surf['tris'][:4])]
+    info = dict(chs=megchs, comps=[])
+    templates = _read_coil_defs()
+    dev_head_ts = list()
+    for shift in [0., 0.005, -0.01]:
+        trans = np.eye(4)
+        trans[:3, 3] = [shift, 0., 0.02]
+        dev_head_ts.append(trans)
+    dev_head_ts = _check_dev_head_ts(dev_head_ts)
+
+    # the positions one at a time
+    megfwds = list()
+    for t in dev_head_ts:
+        megcoils, megcf, _, _, eegels = \
+            _create_meg_eeg_coils(megchs, None, eegchs, t, templates)
+        megfwd, eegfwd = _compute_forwards(src, bem, [megcoils, eegels],
+                                           [megcf, None], [None, None],
+                                           [None, None], [info, None],
+                                           ['meg', 'eeg'], 1)
+        megfwds.append(megfwd)
+    assert_true(np.abs(megfwds[1] - megfwds[0]).max() > 0)
+
+    # all positions together
+    megcoils = sum([_create_meg_eeg_coils(megchs, None, None, t,
+                                          templates)[0]
+                    for t in dev_head_ts], [])
+    megfwd_all, eegfwd_all = \
+        _compute_forwards(src, bem, [megcoils, eegels], [megcf, None],
+                          [None, None], [None, None], [info, None],
+                          ['meg', 'eeg'], 2, n_positions=len(dev_head_ts))
+    assert_allclose(megfwd_all, np.concatenate(megfwds, axis=1))
+    assert_allclose(eegfwd_all, eegfwd)
+
+    # device to head transformations are checked
+    assert_raises(ValueError, _check_dev_head_ts, [])
+    assert_raises(ValueError, _check_dev_head_ts, [np.eye(3)])
+    assert_raises(ValueError, _check_dev_head_ts,
+                  [{'from': FIFF.FIFFV_COORD_HEAD,
+                    'to': FIFF.FIFFV_COORD_MRI, 'trans': np.eye(4)}])
@@ -145,9 +145,11 @@ def _compute_pow_plv(data, K, sel, Ws, source_ori, use_fft, Vh, with_plv,
         if Vh is not None:
             e = np.dot(Vh, e)  # reducing data rank
 
-        for f, w in enumerate(Ws):
-            tfr = cwt(e, [w], use_fft=use_fft, decim=decim)
-            tfr = np.asfortranarray(tfr.reshape(len(e), -1))
+        # transform all frequencies at once, only the kept samples
+        tfrs = cwt(e, Ws, use_fft=use_fft, decim=decim)
+
+        for f in range(n_freqs):
+            tfr = tfrs[:, f, :]
 
             # phase lock and power at freq f
             if with_plv:
@@ -182,6 +184,7 @@ def _compute_pow_plv(data, K, sel, Ws, source_ori, use_fft, Vh, with_plv,
                 plv_f /= np.abs(plv_f)
                 plv[:, f, :] += plv_f
                 del plv_f
+        del tfrs
 
     return power, plv
 
@@ -9,6 +9,7 @@ from .externals.six import string_types
 import inspect
 import logging
 import os
+import threading
 
 from . import get_config
 from .utils import logger, verbose
@@ -146,3 +147,77 @@ def check_n_jobs(n_jobs, allow_cuda=False):
                 n_jobs = 1
 
     return n_jobs
+
+
+class _PrefetchError(object):
+    """Wrapper for an exception raised while prefetching"""
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _prefetch_generator(gen, n_buffer=2):
+    """Consume a generator in a background thread
+
+    The items of the generator are computed in a separate thread and
+    buffered, so that producing the next items (e.g., reading data and
+    applying an inverse operator) overlaps with the processing of the
+    current item by the caller. Exceptions raised by the generator are
+    re-raised in the calling thread.
+
+    Parameters
+    ----------
+    gen : iterable
+        The generator (or any iterable).
+    n_buffer : int
+        The maximum number of items computed in advance.
+
+    Returns
+    -------
+    gen_prefetch : generator
+        Generator returning the same items as gen.
+    """
+    try:
+        from queue import Queue, Full
+    except ImportError:
+        from Queue import Queue, Full  # Python 2
+
+    queue = Queue(maxsize=n_buffer)
+    sentinel = object()
+    stop = threading.Event()
+
+    def _put(item):
+        """Put an item in the queue unless the consumer has stopped"""
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _producer():
+        try:
+            for item in gen:
+                if not _put(item):
+                    return
+        except BaseException as exc:
+            _put(_PrefetchError(exc))
+        finally:
+            _put(sentinel)
+
+    thread = threading.Thread(target=_producer)
+    thread.daemon = True
+    thread.start()
+
+    # the producer stops when the caller stops consuming the items
+    try:
+        while True:
+            item = queue.get()
+            if item is sentinel:
+                break
+            if isinstance(item, _PrefetchError):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+    thread.join()
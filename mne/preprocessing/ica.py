@@ -12,6 +12,7 @@ from collections import namedtuple
 from math import ceil
 
 import os
+import os.path as op
 import json
 
 import numpy as np
@@ -38,7 +39,10 @@ from ..viz import plot_ica_panel, plot_ica_topomap
 from ..fiff.channels import _contains_ch_type
 from ..fiff.write import start_file, end_file, write_id
 from ..epochs import _is_good
-from ..utils import check_sklearn_version, logger, verbose
+from ..fiff.write import write_int
+from ..fiff.base import start_writing_raw, write_raw_buffer, finish_writing_raw
+from ..fiff.compensator import set_current_comp
+from ..utils import check_sklearn_version, logger, verbose, _check_fname
 
 try:
     from sklearn.utils.extmath import fast_dot
@@ -73,6 +77,60 @@ score_funcs.update(dict((n, _make_xy_sfunc(f, ndim_output=True))
                    if getargspec(f).args == ['x', 'y']))
 
 
+def _pearsonr(x, y):
+    """Pearson correlation of each row of x with each row of y
+
+    Parameters
+    ----------
+    x : array, shape = (n_sources, n_times)
+        The sources.
+    y : array, shape = (n_times,) | (n_targets, n_times)
+        The target(s).
+
+    Returns
+    -------
+    r : array, shape = (n_sources,) | (n_targets, n_sources)
+        The correlation coefficients.
+    """
+    y = np.asarray(y)
+    ndim = y.ndim
+    x = x - np.mean(x, axis=1)[:, None]
+    y = np.atleast_2d(y) - np.mean(np.atleast_2d(y), axis=1)[:, None]
+    r = fast_dot(y, x.T)
+    r /= np.sqrt(np.sum(y * y, axis=1))[:, None]
+    r /= np.sqrt(np.sum(x * x, axis=1))[None, :]
+    np.clip(r, -1., 1., out=r)
+    return r[0] if ndim < 2 else r
+
+_pearsonr.__name__ = 'score_func.scipy.stats.stats.pearsonr'
+score_funcs['pearsonr'] = _pearsonr
+
+
+def _central_moments(sources):
+    """Second, third and fourth central moments of each source"""
+    x = sources - np.mean(sources, axis=1)[:, None]
+    x2 = x * x
+    return (np.mean(x2, axis=1), np.mean(x2 * x, axis=1),
+            np.mean(x2 * x2, axis=1))
+
+
+def _skew_from_moments(m2, m3, m4):
+    """Same as scipy.stats.skew"""
+    zero = m2 == 0
+    return np.where(zero, 0., m3 / np.where(zero, 1., m2) ** 1.5)
+
+
+def _kurtosis_from_moments(m2, m3, m4):
+    """Same as scipy.stats.kurtosis"""
+    zero = m2 == 0
+    return np.where(zero, 0., m4 / np.where(zero, 1., m2) ** 2) - 3.
+
+# univariate score functions computed from the central moments
+_moment_score_funcs = [(stats.skew, _skew_from_moments),
+                       (stats.kurtosis, _kurtosis_from_moments),
+                       (np.var, lambda m2, m3, m4: m2)]
+
+
 __all__ = ['ICA', 'ica_find_ecg_events', 'ica_find_eog_events', 'score_funcs',
            'read_ica', 'run_ica']
 
@@ -233,7 +291,7 @@ class ICA(object):
     @verbose
     def decompose_raw(self, raw, picks=None, start=None, stop=None,
                       decim=None, reject=None, flat=None, tstep=2.0,
-                      verbose=None):
+                      buffer_size=None, max_samples=None, verbose=None):
         """Run the ICA decomposition on raw data
 
         Caveat! If supplying a noise covariance keep track of the projections
@@ -269,6 +327,18 @@ class ICA(object):
             If flat is None then no rejection is done.
         tstep : float
             Length of data chunks for artefact rejection in seconds.
+        buffer_size : int | None
+            If not None, the raw data are read in blocks of about buffer_size
+            samples. The channel covariance is accumulated in a single pass
+            over the blocks and the PCA is derived from it, so the memory
+            used does not depend on the length of the recording. The ICA is
+            then fitted on the time points selected by decim and
+            max_samples.
+        max_samples : int | None
+            The maximum number of time points used to fit the ICA when
+            buffer_size is not None. If the data contain more time points, a
+            random subset of them is used. If None, all time points are
+            used.
         verbose : bool, str, int, or None
             If not None, override default verbose level (see mne.verbose).
             Defaults to self.verbose.
@@ -281,6 +351,9 @@ class ICA(object):
         if self.current_fit != 'unfitted':
             raise RuntimeError('ICA decomposition has already been fitted. '
                                'Please start a new ICA session.')
+        if max_samples is not None and buffer_size is None:
+            raise ValueError('max_samples can only be used together with '
+                             'buffer_size')
 
         logger.info('Computing signal decomposition on raw data. '
                     'Please be patient, this may take some time')
@@ -300,6 +373,12 @@ class ICA(object):
         self.ch_names = self.info['ch_names']
         start, stop = _check_start_stop(raw, start, stop)
 
+        if buffer_size is not None:
+            self._decompose_raw_buffered(raw, picks, start, stop, decim,
+                                         reject, flat, tstep, buffer_size,
+                                         max_samples)
+            return self
+
         data = raw[picks, start:stop][0]
         if decim is not None:
             data = data[:, ::decim].copy()
@@ -432,15 +511,44 @@ class ICA(object):
         -------
         sources : array, shape = (n_components, n_times)
             The ICA sources time series.
+
+        Notes
+        -----
+        The channel data are read and unmixed in blocks of 10 s, so only
+        the sources are kept in memory.
         """
         if not hasattr(self, 'mixing_matrix_'):
             raise RuntimeError('No fit available. Please first fit ICA '
                                'decomposition.')
         start, stop = _check_start_stop(raw, start, stop)
+        start = 0 if start is None else start
+        stop = raw.n_times if stop is None else min(stop, raw.n_times)
+        sources = np.empty((self.n_components_, stop - start))
+        self._get_sources_raw_blocks(raw, start, stop, sources)
+        return sources
 
+    def _get_sources_raw_blocks(self, raw, start, stop, sources):
+        """Compute the sources of raw data block by block into sources"""
         picks = [raw.ch_names.index(k) for k in self.ch_names]
-        data, _ = self._pre_whiten(raw[picks, start:stop][0], raw.info, picks)
-        return self._get_sources(data)
+        buffer_size = int(ceil(10. * raw.info['sfreq']))
+        blocks = [(first, min(first + buffer_size, stop))
+                  for first in range(start, stop, buffer_size)]
+
+        if self.noise_cov is None:
+            # the standardization depends on all the data, so it is
+            # computed in a first pass
+            pre_whitener = _raw_standardizer(raw, picks, blocks)
+        else:
+            # the whitener only depends on the noise covariance
+            pre_whitener = self._pre_whiten(raw[picks, start:start + 1][0],
+                                            raw.info, picks)[1]
+        for first, last in blocks:
+            data = raw[picks, first:last][0]
+            if self.noise_cov is None:
+                data /= pre_whitener
+            else:
+                data = fast_dot(pre_whitener, data)
+            sources[:, first - start:last - start] = self._get_sources(data)
 
     def get_sources_epochs(self, epochs, concatenate=False):
         """Estimate epochs sources given the unmixing matrix
@@ -534,8 +642,6 @@ class ICA(object):
             picks = pick_types(raw.info, meg=False, eeg=False, misc=True,
                                ecg=True, eog=True, stim=True, exclude='bads')
 
-        # merge copied instance and picked data with sources
-        sources = self.get_sources_raw(raw, start=start, stop=stop)
         if raw._preloaded:  # get data and temporarily delete
             data, times = raw._data, raw._times
             del raw._data, raw._times
@@ -544,11 +650,24 @@ class ICA(object):
         if raw._preloaded:
             raw._data, raw._times = data, times
 
-        # populate copied raw.
+        # populate copied raw, the sources and the picked channels are
+        # written block by block into the data of out
         start, stop = _check_start_stop(raw, start, stop)
-        data_, times_ = raw[picks, start:stop]
-        out._data = np.r_[sources, data_]
-        out._times = times_
+        first, last = (0 if start is None else start,
+                       raw.n_times if stop is None else min(stop, raw.n_times))
+        n_components = self.n_components_
+        out._data = np.empty((n_components + len(picks), last - first))
+        self._get_sources_raw_blocks(raw, first, last,
+                                     out._data[:n_components])
+        buffer_size = int(ceil(10. * raw.info['sfreq']))
+        times = list()
+        for block_start in range(first, last, buffer_size):
+            block_stop = min(block_start + buffer_size, last)
+            data_, times_ = raw[picks, block_start:block_stop]
+            out._data[n_components:, block_start - first:
+                      block_stop - first] = data_
+            times.append(times_)
+        out._times = np.concatenate(times)
         out._filenames = list()
         out._preloaded = True
 
@@ -764,20 +883,12 @@ class ICA(object):
         scores : ndarray
             scores for each source as returned from score_func
         """
-        sources = self.get_sources_raw(raw=raw, start=start, stop=stop)
+        start, stop = _check_start_stop(raw, start, stop)
+        sources = self.get_sources_raw(raw, start=start, stop=stop)
         # auto target selection
         if target is not None:
-            start, stop = _check_start_stop(raw, start, stop)
-            if hasattr(target, 'ndim'):
-                if target.ndim < 2:
-                    target = target.reshape(1, target.shape[-1])
-            if isinstance(target, string_types):
-                pick = _get_target_ch(raw, target)
-                target, _ = raw[pick, start:stop]
-            if sources.shape[1] != target.shape[1]:
-                raise ValueError('Source and targets do not have the same'
-                                 'number of time slices.')
-            target = target.ravel()
+            target = _get_raw_target(raw, target, start, stop,
+                                     sources.shape[1])
 
         return _find_sources(sources, target, score_func)
 
@@ -860,11 +971,17 @@ class ICA(object):
         -------
         raw : instance of Raw
             raw instance with selected ICA components removed
+
+        Notes
+        -----
+        The removal of the sources is a linear operation on the channel
+        data, which is computed once and applied to blocks of data. To
+        clean raw data which are not preloaded, use save_clean_raw.
         """
         if not raw._preloaded:
             raise ValueError('raw data should be preloaded to have this '
                              'working. Please read raw data with '
-                             'preload=True.')
+                             'preload=True or use save_clean_raw.')
 
         if self.current_fit != 'raw':
             raise ValueError('Currently no raw data fitted.'
@@ -885,17 +1002,102 @@ class ICA(object):
         picks = pick_types(raw.info, meg=False, include=self.ch_names,
                            exclude='bads')
 
-        data = raw[picks, start:stop][0]
-        data, _ = self._pre_whiten(data, raw.info, picks)
-
-        data = self._pick_sources(data, include, self.exclude)
+        cleaner, offset = self._get_cleaning_operator(include, self.exclude)
 
         if copy is True:
             raw = raw.copy()
 
-        raw[picks, start:stop] = data
+        start = 0 if start is None else start
+        stop = raw.n_times if stop is None else min(stop, raw.n_times)
+        buffer_size = int(ceil(10. * raw.info['sfreq']))
+        for first in range(start, stop, buffer_size):
+            last = min(first + buffer_size, stop)
+            raw._data[picks, first:last] = _apply_cleaner(
+                cleaner, offset, raw._data[picks, first:last])
         return raw
 
+    @verbose
+    def save_clean_raw(self, raw, fname, include=None, exclude=None,
+                       n_pca_components=None, start=None, stop=None,
+                       buffer_size_sec=10., overwrite=False, verbose=None):
+        """Save raw data with ICA components removed to a new file
+
+        The data are read, cleaned and written in blocks, so the raw data
+        do not need to be preloaded.
+
+        Parameters
+        ----------
+        raw : instance of Raw
+            Raw object to remove ICA components from.
+        fname : str
+            File name of the new dataset. It has to be a new filename
+            unless data have been preloaded.
+        include : list-like | None
+            The source indices to use. If None all are used.
+        exclude : list-like | None
+            The source indices to remove. If None all are used.
+        n_pca_components : int | float
+            The number of PCA components to be unwhitened (see
+            pick_sources_raw).
+        start : int | float | None
+            First sample to include. If float, data will be interpreted as
+            time in seconds. If None, data will be used from the first sample.
+        stop : int | float | None
+            Last sample to not include. If float, data will be interpreted as
+            time in seconds. If None, data will be used to the last sample.
+        buffer_size_sec : float
+            Size of data chunks in seconds.
+        overwrite : bool
+            If True, the destination file (if it exists) will be overwritten.
+            If False (default), an error will be raised if the file exists.
+        verbose : bool, str, int, or None
+            If not None, override default verbose level (see mne.verbose).
+            Defaults to self.verbose.
+
+        Notes
+        -----
+        The data are saved in single precision and, like with raw.save, the
+        projections of raw are not applied.
+        """
+        if self.current_fit != 'raw':
+            raise ValueError('Currently no raw data fitted.'
+                             'Please fit raw data first.')
+        fname = op.realpath(fname)
+        if not raw._preloaded and fname in raw._filenames:
+            raise ValueError('You cannot save data to the same file.'
+                             ' Please use a different filename.')
+        _check_fname(fname, overwrite)
+
+        if n_pca_components is not None:
+            self.n_pca_components = n_pca_components
+        cleaner, offset = self._get_cleaning_operator(include, exclude)
+        picks = pick_types(raw.info, meg=False, include=self.ch_names,
+                           exclude='bads')
+
+        # set the correct compensation grade and make inverse compensator
+        info = raw.info
+        inv_comp = None
+        if raw.comp is not None:
+            inv_comp = linalg.inv(raw.comp)
+            info = deepcopy(info)
+            set_current_comp(info, raw._orig_comp_grade)
+
+        start, stop = _check_start_stop(raw, start, stop)
+        start = 0 if start is None else start
+        stop = raw.n_times if stop is None else min(stop, raw.n_times)
+        outfid, cals = start_writing_raw(fname, info)
+        if raw.first_samp + start != 0:
+            write_int(outfid, FIFF.FIFF_FIRST_SAMPLE, raw.first_samp + start)
+        buffer_size = int(ceil(buffer_size_sec * raw.info['sfreq']))
+        for first in range(start, stop, buffer_size):
+            last = min(first + buffer_size, stop)
+            data, _ = raw[:, first:last]
+            data[picks] = _apply_cleaner(cleaner, offset, data[picks])
+            logger.info('Writing ...')
+            write_raw_buffer(outfid, data, cals, 'single', inv_comp)
+            logger.info('[done]')
+        finish_writing_raw(outfid)
+
     def pick_sources_epochs(self, epochs, include=None, exclude=None,
                             n_pca_components=None, copy=True):
         """Recompose epochs
@@ -946,17 +1148,13 @@ class ICA(object):
         if n_pca_components is not None:
             self.n_pca_components = n_pca_components
 
-        data = np.hstack(epochs.get_data()[:, picks])
-        data, _ = self._pre_whiten(data, epochs.info, picks)
-        data = self._pick_sources(data, include=include,
-                                  exclude=exclude)
+        cleaner, offset = self._get_cleaning_operator(include, exclude)
 
         if copy is True:
             epochs = epochs.copy()
 
-        # restore epochs, channels, tsl order
-        epochs._data[:, picks] = np.array(np.split(data,
-                                          len(epochs.events), 1))
+        for epoch in epochs._data:
+            epoch[picks] = _apply_cleaner(cleaner, offset, epoch[picks])
         epochs.preload = True
 
         return epochs
@@ -1138,17 +1336,139 @@ class ICA(object):
         pca = RandomizedPCA(n_components=max_pca_components, whiten=True,
                             copy=True)
 
+        full_var = None
         if isinstance(self.n_components, float):
             # compute full feature variance before doing PCA
             full_var = np.var(data, axis=1).sum()
 
         data = pca.fit_transform(data.T)
 
+        # unwhiten pca components and put scaling in unmixintg matrix later.
+        exp_var = pca.explained_variance_
+        pca_components = pca.components_ * np.sqrt(exp_var[:, None])
+        self._fit_ica(data, pca.mean_, pca_components, exp_var, full_var,
+                      fit_type)
+
+    def _decompose_raw_buffered(self, raw, picks, start, stop, decim, reject,
+                                flat, tstep, buffer_size, max_samples):
+        """Aux function to decompose raw data read in blocks"""
+        from sklearn.utils import check_random_state
+
+        info = self.info
+        start = 0 if start is None else start
+        stop = raw.n_times if stop is None else min(stop, raw.n_times)
+        decim = 1 if decim is None else decim
+        rejecting = (reject is not None) or (flat is not None)
+        idx_by_type = channel_indices_by_type(info)
+        step = int(ceil(tstep * info['sfreq']))
+        step = int(ceil(step / float(decim)))
+
+        # the time points (after decimation) used to fit the ICA
+        n_times = len(range(start, stop, decim))
+        rng = check_random_state(self.random_state)
+        sel_times = None  # all time points
+        if max_samples is not None and max_samples < n_times:
+            sel_times = np.sort(rng.permutation(n_times)[:max_samples])
+
+        # blocks contain whole rejection segments and decimation steps
+        seg_len = step * decim if rejecting else decim
+        block_len = max(buffer_size // seg_len, 1) * seg_len
+
+        n_channels = len(picks)
+        data_sum = np.zeros(n_channels)
+        data_cov = np.zeros((n_channels, n_channels))
+        n_samples = 0
+        data_fit = list()
+        for first in range(start, stop, block_len):
+            data = raw[picks, first:min(first + block_len, stop)][0]
+            data = data[:, ::decim]
+            first_time = (first - start) // decim
+            good = np.ones(data.shape[1], dtype=np.bool)
+            if rejecting:
+                for this_first in range(0, data.shape[1], step):
+                    this_last = this_first + step
+                    data_buffer = data[:, this_first:this_last]
+                    if data_buffer.shape[1] < step:
+                        # end of the time segment
+                        good[this_first:] = False
+                    elif not _is_good(data_buffer, info['ch_names'],
+                                      idx_by_type, reject, flat,
+                                      ignore_chs=info['bads']):
+                        good[this_first:this_last] = False
+                        logger.info("Artifact detected in [%d, %d]"
+                                    % (first_time + this_first,
+                                       first_time + this_last))
+            is_fit = np.ones(data.shape[1], dtype=np.bool)
+            if sel_times is not None:
+                is_fit[:] = False
+                this_sel = sel_times[np.searchsorted(sel_times, first_time):
+                                     np.searchsorted(sel_times, first_time +
+                                                     data.shape[1])]
+                is_fit[this_sel - first_time] = True
+            if not good.all():
+                data, is_fit = data[:, good], is_fit[good]
+            data_sum += data.sum(axis=1)
+            data_cov += fast_dot(data, data.T)
+            n_samples += data.shape[1]
+            data_fit.append(data[:, is_fit])
+
+        self.n_samples_ = n_samples
+        if n_samples == 0 or not data_cov.any():
+            raise RuntimeError('No clean segment found. Please '
+                               'consider updating your rejection '
+                               'thresholds.')
+        data_fit = np.concatenate(data_fit, axis=1)
+        data_mean = data_sum / n_samples
+        data_cov /= n_samples
+
+        if self.noise_cov is None:
+            # z-score by channel type, using the pooled mean and variance
+            pre_whitener = np.empty([n_channels, 1])
+            for ch_type in ['mag', 'grad', 'eeg']:
+                if _contains_ch_type(info, ch_type):
+                    if ch_type == 'eeg':
+                        this_picks = pick_types(info, meg=False, eeg=True)
+                    else:
+                        this_picks = pick_types(info, meg=ch_type, eeg=False)
+                    this_mean = data_mean[this_picks].mean()
+                    this_var = (np.diag(data_cov)[this_picks].mean() -
+                                this_mean ** 2)
+                    pre_whitener[this_picks] = np.sqrt(this_var)
+            self._pre_whitener = pre_whitener
+            data_mean /= pre_whitener[:, 0]
+            data_cov /= pre_whitener
+            data_cov /= pre_whitener.T
+            data_fit /= pre_whitener
+        else:
+            data_fit, self._pre_whitener = self._pre_whiten(data_fit,
+                                                            raw.info, picks)
+            data_mean = np.dot(self._pre_whitener, data_mean)
+            data_cov = fast_dot(self._pre_whitener,
+                                fast_dot(data_cov, self._pre_whitener.T))
+
+        # PCA from the covariance of the centered data
+        data_cov -= np.outer(data_mean, data_mean)
+        exp_var, pca_components = linalg.eigh(data_cov)
+        order = np.argsort(exp_var)[::-1][:self.max_pca_components]
+        exp_var = exp_var[order]
+        pca_components = pca_components[:, order].T
+        full_var = np.trace(data_cov)
+
+        # whitened PCA data of the time points used to fit the ICA
+        data_fit -= data_mean[:, None]
+        data_fit = fast_dot(pca_components, data_fit)
+        data_fit /= np.sqrt(exp_var)[:, None]
+        self._fit_ica(data_fit.T, data_mean, pca_components, exp_var,
+                      full_var, 'raw')
+
+    def _fit_ica(self, data, pca_mean, pca_components, exp_var, full_var,
+                 fit_type):
+        """Aux function to fit the ICA on whitened PCA data"""
         if isinstance(self.n_components, float):
             logger.info('Selecting PCA components by explained variance.')
             # compute eplained variance manually, cf. sklearn bug
             # fixed in #2664
-            explained_variance_ratio_ = pca.explained_variance_ / full_var
+            explained_variance_ratio_ = exp_var / full_var
             n_components_ = np.sum(explained_variance_ratio_.cumsum()
                                    <= self.n_components)
             sel = slice(n_components_)
@@ -1158,15 +1478,12 @@ class ICA(object):
                 sel = slice(self.n_components)
             else:  # None case
                 logger.info('Using all PCA components.')
-                sel = slice(len(pca.components_))
+                sel = slice(len(pca_components))
 
         # the things to store for PCA
-        self.pca_mean_ = pca.mean_
-        self.pca_components_ = pca.components_
-        # unwhiten pca components and put scaling in unmixintg matrix later.
-        self.pca_explained_variance_ = exp_var = pca.explained_variance_
-        self.pca_components_ *= np.sqrt(exp_var[:, None])
-        del pca
+        self.pca_mean_ = pca_mean
+        self.pca_components_ = pca_components
+        self.pca_explained_variance_ = exp_var
         # update number of components
         self.n_components_ = sel.stop
         if self.n_pca_components is not None:
@@ -1186,8 +1503,12 @@ class ICA(object):
         self.mixing_matrix_ = linalg.pinv(self.unmixing_matrix_)
         self.current_fit = fit_type
 
-    def _pick_sources(self, data, include, exclude):
-        """Aux function"""
+    def _get_cleaning_operator(self, include, exclude):
+        """Get the operator recomposing the data from the picked sources
+
+        The recomposed data are np.dot(cleaner, data) + offset[:, None],
+        where data are the (not pre-whitened) channel data.
+        """
         if exclude is None:
             exclude = self.exclude
         else:
@@ -1202,38 +1523,43 @@ class ICA(object):
 
         n_components = self.n_components_
 
-        # Apply first PCA
-        if self.pca_mean_ is not None:
-            data -= self.pca_mean_[:, None]
-
-        pca_data = fast_dot(self.pca_components_, data)
-        # Apply unmixing to low dimension PCA
-        sources = fast_dot(self.unmixing_matrix_, pca_data[:n_components])
-
+        # Sources to keep
+        mask = np.ones(n_components)
         if include not in (None, []):
-            mask = np.ones(len(sources), dtype=np.bool)
-            mask[np.unique(include)] = False
-            sources[mask] = 0.
+            mask[:] = 0.
+            mask[np.unique(include)] = 1.
         elif exclude not in (None, []):
-            sources[np.unique(exclude)] = 0.
-
-        pca_data[:n_components] = fast_dot(self.mixing_matrix_, sources)
-        data = fast_dot(self.pca_components_[:n_components].T,
-                        pca_data[:n_components])
+            mask[np.unique(exclude)] = 0.
+
+        # Unmix the first PCA components, drop sources and remix them
+        pca_components = self.pca_components_[:n_components]
+        cleaner = fast_dot(self.mixing_matrix_ * mask[None, :],
+                           self.unmixing_matrix_)
+        cleaner = fast_dot(pca_components.T,
+                           fast_dot(cleaner, pca_components))
+        # Add the next PCA components
         if self.n_pca_components is not None and _n_pca_comp > n_components:
-            data += fast_dot(self.pca_components_[n_components:_n_pca_comp].T,
-                             pca_data[n_components:_n_pca_comp])
+            pca_components = self.pca_components_[n_components:_n_pca_comp]
+            cleaner += fast_dot(pca_components.T, pca_components)
 
+        # The mean is removed before the PCA and restored afterwards
         if self.pca_mean_ is not None:
-            data += self.pca_mean_[:, None]
+            offset = self.pca_mean_ - fast_dot(cleaner, self.pca_mean_)
+        else:
+            offset = np.zeros(len(cleaner))
 
-        # restore scaling
+        # Apply the pre-whitening and restore the scaling
         if self.noise_cov is None:  # revert standardization
-            data *= self._pre_whitener
+            cleaner *= self._pre_whitener
+            cleaner /= self._pre_whitener.T
+            offset *= self._pre_whitener[:, 0]
         else:
-            data = fast_dot(linalg.pinv(self._pre_whitener), data)
+            pre_whitener_inv = linalg.pinv(self._pre_whitener)
+            cleaner = fast_dot(pre_whitener_inv,
+                               fast_dot(cleaner, self._pre_whitener))
+            offset = fast_dot(pre_whitener_inv, offset)
 
-        return data
+        return cleaner, offset
 
 
 @verbose
@@ -1356,14 +1682,72 @@ def _get_target_ch(container, target):
     return picks
 
 
-def _find_sources(sources, target, score_func):
+def _raw_standardizer(raw, picks, blocks):
+    """Compute the standard deviations of the channel types block by block
+
+    This gives the same scaling as ICA._pre_whiten without a noise
+    covariance, computed on all the blocks at once.
+    """
+    info = pick_info(deepcopy(raw.info), picks)
+    pre_whitener = np.empty([len(picks), 1])
+    type_picks = list()
+    for ch_type in ['mag', 'grad', 'eeg']:
+        if _contains_ch_type(info, ch_type):
+            if ch_type == 'eeg':
+                this_picks = pick_types(info, meg=False, eeg=True)
+            else:
+                this_picks = pick_types(info, meg=ch_type, eeg=False)
+            type_picks.append(this_picks)
+    # number of values, mean and sum of squared deviations of each type
+    moments = np.zeros((len(type_picks), 3))
+    for first, last in blocks:
+        data = raw[picks, first:last][0]
+        for this_moments, this_picks in zip(moments, type_picks):
+            x = data[this_picks]
+            n, mean = x.size, x.mean()
+            m2 = np.sum((x - mean) ** 2)
+            n_tot = this_moments[0] + n
+            delta = mean - this_moments[1]
+            this_moments[2] += m2 + delta ** 2 * this_moments[0] * n / n_tot
+            this_moments[1] += delta * n / n_tot
+            this_moments[0] = n_tot
+    for this_moments, this_picks in zip(moments, type_picks):
+        pre_whitener[this_picks] = np.sqrt(this_moments[2] / this_moments[0])
+    return pre_whitener
+
+
+def _apply_cleaner(cleaner, offset, data):
+    """Remove ICA sources from channel data with the cleaning operator"""
+    data = fast_dot(cleaner, data)
+    data += offset[:, None]
+    return data
+
+
+def _get_raw_target(raw, target, start, stop, n_times):
+    """Aux function to get the target time series from raw data"""
+    if isinstance(target, string_types):
+        pick = _get_target_ch(raw, target)
+        target, _ = raw[pick, start:stop]
+    target = np.atleast_2d(target)
+    if target.shape[1] != n_times:
+        raise ValueError('Source and targets do not have the same'
+                         'number of time slices.')
+    return target.ravel()
+
+
+def _get_score_func(score_func):
     """Aux function"""
     if isinstance(score_func, string_types):
         score_func = score_funcs.get(score_func, score_func)
 
     if not callable(score_func):
         raise ValueError('%s is not a valid score_func.' % score_func)
+    return score_func
+
 
+def _find_sources(sources, target, score_func):
+    """Aux function"""
+    score_func = _get_score_func(score_func)
     scores = (score_func(sources, target) if target is not None
               else score_func(sources, 1))
 
@@ -1569,6 +1953,41 @@ def read_ica(fname):
 _ica_node = namedtuple('Node', 'name target score_func criterion')
 
 
+def _score_sources(raw, sources, nodes, start, stop):
+    """Score the sources for all nodes of the artifact detection
+
+    The correlations with all targets are computed in one pass, and the
+    skewness, kurtosis and variance from the same central moments.
+    """
+    n_times = sources.shape[1]
+    funcs = [_get_score_func(node.score_func) for node in nodes]
+    scores = [None] * len(nodes)
+
+    corr_idx = [ii for ii, (node, func) in enumerate(zip(nodes, funcs))
+                if node.target is not None and func is _pearsonr]
+    if len(corr_idx) > 0:
+        targets = [_get_raw_target(raw, nodes[ii].target, start, stop,
+                                   n_times) for ii in corr_idx]
+        for ii, r in zip(corr_idx, _pearsonr(sources, np.array(targets))):
+            scores[ii] = r
+
+    moments = None
+    for ii, (node, func) in enumerate(zip(nodes, funcs)):
+        if scores[ii] is not None:
+            continue
+        moment_func = [f for sf, f in _moment_score_funcs if sf is func]
+        if node.target is None and len(moment_func) > 0:
+            if moments is None:
+                moments = _central_moments(sources)
+            scores[ii] = moment_func[0](*moments)
+        else:
+            target = node.target
+            if target is not None:
+                target = _get_raw_target(raw, target, start, stop, n_times)
+            scores[ii] = _find_sources(sources, target, func)
+    return scores
+
+
 def _detect_artifacts(ica, raw, start_find, stop_find, ecg_ch, ecg_score_func,
                       ecg_criterion, eog_ch, eog_score_func, eog_criterion,
                       skew_criterion, kurt_criterion, var_criterion,
@@ -1598,10 +2017,12 @@ def _detect_artifacts(ica, raw, start_find, stop_find, ecg_ch, ecg_score_func,
     if add_nodes is not None:
         nodes.extend(add_nodes)
 
-    for node in nodes:
-        scores = ica.find_sources_raw(raw, start=start_find, stop=stop_find,
-                                      target=node.target,
-                                      score_func=node.score_func)
+    start, stop = _check_start_stop(raw, start_find, stop_find)
+    # the sources are computed once and used for all criteria
+    sources = ica.get_sources_raw(raw, start=start, stop=stop)
+    all_scores = _score_sources(raw, sources, nodes, start, stop)
+
+    for node, scores in zip(nodes, all_scores):
         if isinstance(node.criterion, float):
             found = list(np.where(np.abs(scores) > node.criterion)[0])
         else:
@@ -9,6 +9,7 @@ import os
 import os.path as op
 from functools import wraps
 import warnings
+import pickle
 
 from nose.tools import assert_true, assert_raises, assert_equal
 from copy import deepcopy
@@ -456,3 +457,200 @@ def test_ica_twice():
                    n_pca_components=1.0, random_state=0)
         ica2.decompose_raw(raw_new, picks=picks, decim=3)
         assert_equal(ica1.n_components_, ica2.n_components_)
+
+
+@requires_sklearn
+def test_ica_raw_buffered():
+    """Test ICA fitted on raw data read in blocks"""
+    from mne.fiff.array import RawArray, create_info
+    rng = np.random.RandomState(0)
+    n_channels, n_times = 10, 20000
+    sources = np.r_[rng.laplace(size=(3, n_times)),
+                    rng.uniform(-1, 1, size=(1, n_times))]
+    data = np.dot(rng.randn(n_channels, 4), sources)
+    data += 0.05 * rng.randn(n_channels, n_times) + 1.
+    info = create_info(['EEG %03d' % ii for ii in range(n_channels)], 1000.,
+                       ['eeg'] * n_channels)
+    raw = RawArray(data * 1e-5, info)
+    raw._data[2, 5000:5005] = 1e-3  # artifact
+
+    kwargs = dict(decim=2, reject=dict(eeg=5e-4), tstep=0.5)
+    ica = ICA(n_components=4, max_pca_components=8, n_pca_components=8)
+    ica.decompose_raw(raw, **kwargs)
+    for max_samples in [None, 5000]:
+        ica_buf = ICA(n_components=4, max_pca_components=8,
+                      n_pca_components=8)
+        ica_buf.decompose_raw(raw, buffer_size=3000, max_samples=max_samples,
+                              **kwargs)
+        # the rejection and the PCA do not depend on the blocks
+        assert_equal(ica_buf.n_samples_, ica.n_samples_)
+        assert_true(ica.n_samples_ == n_times // 2 - 250)
+        assert_allclose(ica_buf._pre_whitener, ica._pre_whitener)
+        assert_allclose(ica_buf.pca_mean_, ica.pca_mean_)
+        assert_allclose(ica_buf.pca_explained_variance_[:4],
+                        ica.pca_explained_variance_[:4], rtol=1e-5)
+        # the sources are recovered
+        corr = np.corrcoef(np.r_[ica_buf.get_sources_raw(raw, start=6000),
+                                 sources[:, 6000:]])
+        assert_true(np.all(np.abs(corr[:4, 4:]).max(axis=1) > 0.99))
+
+    ica_buf = ICA(n_components=0.9, max_pca_components=None,
+                  n_pca_components=1.)
+    ica_buf.decompose_raw(raw, buffer_size=3000, **kwargs)
+    ica = ICA(n_components=0.9, max_pca_components=None, n_pca_components=1.)
+    ica.decompose_raw(raw, **kwargs)
+    assert_equal(ica_buf.n_components_, ica.n_components_)
+
+    ica = ICA(n_components=4)
+    assert_raises(ValueError, ica.decompose_raw, raw, max_samples=1000)
+
+
+@requires_sklearn
+def test_ica_pick_sources_operator():
+    """Test removing ICA sources with a precomputed cleaning operator"""
+    from mne.fiff.array import RawArray, create_info
+    rng = np.random.RandomState(0)
+    n_channels, n_times = 10, 5000
+    sources = np.r_[rng.laplace(size=(3, n_times)),
+                    rng.uniform(-1, 1, size=(1, n_times))]
+    data = np.dot(rng.randn(n_channels, 4), sources)
+    data += 0.05 * rng.randn(n_channels, n_times)
+    info = create_info(['EEG %03d' % ii for ii in range(n_channels)], 1000.,
+                       ['eeg'] * n_channels)
+    raw = RawArray(data * 1e-5, info)
+    ica = ICA(n_components=4, max_pca_components=8, n_pca_components=6)
+    ica.decompose_raw(raw)
+
+    # the operator gives the same results as recomposing the sources
+    raw_clean = ica.pick_sources_raw(raw, exclude=[1])
+    data_w = raw._data / ica._pre_whitener - ica.pca_mean_[:, None]
+    pca_data = np.dot(ica.pca_components_, data_w)
+    sources = np.dot(ica.unmixing_matrix_, pca_data[:4])
+    sources[1] = 0.
+    data_clean = np.dot(ica.pca_components_[:6].T,
+                        np.r_[np.dot(ica.mixing_matrix_, sources),
+                              pca_data[4:6]])
+    data_clean += ica.pca_mean_[:, None]
+    data_clean *= ica._pre_whitener
+    assert_allclose(raw_clean._data, data_clean, rtol=1e-6,
+                    atol=1e-6 * np.abs(data_clean).max())
+    assert_equal(ica.exclude, [1])
+
+    # raw data which are not preloaded are cleaned block by block into a
+    # new file
+    raw_fname_tmp = op.join(tempdir, 'test_ica_raw.fif')
+    raw.save(raw_fname_tmp)
+    raw_disk = fiff.Raw(raw_fname_tmp, preload=False)
+    assert_raises(ValueError, ica.pick_sources_raw, raw_disk)
+    raw_fname_clean = op.join(tempdir, 'test_ica_clean_raw.fif')
+    ica.save_clean_raw(raw_disk, raw_fname_clean, buffer_size_sec=1.)
+    raw_read = fiff.Raw(raw_fname_clean, preload=True)
+    assert_allclose(raw_read._data, raw_clean._data, rtol=1e-4,
+                    atol=1e-4 * np.abs(data_clean).max())
+    ica.save_clean_raw(raw_disk, raw_fname_clean, start=100, stop=2000,
+                       overwrite=True)
+    raw_read = fiff.Raw(raw_fname_clean, preload=True)
+    assert_equal(raw_read.first_samp, raw_disk.first_samp + 100)
+    assert_allclose(raw_read._data, raw_clean._data[:, 100:2000], rtol=1e-4,
+                    atol=1e-4 * np.abs(data_clean).max())
+    assert_raises(IOError, ica.save_clean_raw, raw_disk, raw_fname_clean)
+
+
+@requires_sklearn
+def test_ica_scores():
+    """Test vectorized scoring of ICA sources
+    """
+    from mne.fiff.array import RawArray, create_info
+    rng = np.random.RandomState(0)
+    n_channels, n_times = 8, 3000
+    data = np.dot(rng.randn(n_channels, 4),
+                  np.r_[rng.laplace(size=(3, n_times)),
+                        rng.uniform(-1, 1, size=(1, n_times))])
+    data += 0.05 * rng.randn(n_channels, n_times)
+    ch_names = ['EEG %03d' % ii for ii in range(n_channels)]
+    info = create_info(ch_names + ['EOG 001', 'ECG 001'], 1000.,
+                       ['eeg'] * n_channels + ['eog', 'ecg'])
+    targets = data[:2] + rng.randn(2, n_times)
+    raw = RawArray(np.r_[data, targets] * 1e-5, info)
+    ica = ICA(n_components=4, max_pca_components=6)
+    ica.decompose_raw(raw, picks=np.arange(n_channels))
+    sources = ica.get_sources_raw(raw)
+
+    # correlations are the same as the ones of scipy
+    scores = ica.find_sources_raw(raw, target='EOG 001', score_func='pearsonr')
+    assert_allclose(scores, [stats.pearsonr(s, targets[0])[0]
+                             for s in sources], rtol=1e-7)
+    scores = ica.find_sources_raw(raw, target=targets[1, 100:2000],
+                                  start=100, stop=2000, score_func='pearsonr')
+    assert_allclose(scores, [stats.pearsonr(s, targets[1, 100:2000])[0]
+                             for s in sources[:, 100:2000]], rtol=1e-7)
+
+    # the scores follow changes of the data
+    raw_changed = RawArray(np.r_[data, targets] * 1e-5, info)
+    raw_changed._data[-2] = -raw_changed._data[-2]
+    scores_changed = ica.find_sources_raw(raw_changed, target='EOG 001',
+                                          score_func='pearsonr')
+    raw_changed._data[-2] = -raw_changed._data[-2]
+    scores = ica.find_sources_raw(raw_changed, target='EOG 001',
+                                  score_func='pearsonr')
+    assert_allclose(scores_changed, -scores)
+
+    # the ICA can be pickled
+    ica_read = pickle.loads(pickle.dumps(ica))
+    assert_allclose(ica_read.get_sources_raw(raw), sources)
+
+    # all criteria are computed in one pass
+    raw = RawArray(np.r_[data, targets] * 1e-5, info)
+    ica.exclude = []
+    ica.detect_artifacts(raw, ecg_ch='ECG 001', ecg_criterion=0.5,
+                         eog_ch=['EOG 001', targets[1]], eog_criterion=0.5,
+                         skew_criterion=None, kurt_criterion=slice(1),
+                         var_criterion=None)
+    expected = set([np.abs(stats.kurtosis(sources, 1)).argmin()])
+    for target in targets:
+        r = np.array([stats.pearsonr(s, target)[0] for s in sources])
+        expected.update(np.where(np.abs(r) > 0.5)[0])
+    assert_equal(sorted(ica.exclude), sorted(expected))
+
+    nodes = [('skew', None, stats.skew, 0), ('kurt', None, stats.kurtosis, 0),
+             ('var', None, np.var, 0), ('std', None, np.std, 0)]
+    from mne.preprocessing.ica import _score_sources, _ica_node
+    nodes = [_ica_node(*node) for node in nodes]
+    all_scores = _score_sources(raw, sources, nodes, None, None)
+    for node, scores in zip(nodes, all_scores):
+        assert_allclose(scores, node.score_func(sources, 1), rtol=1e-7)
+
+
+@requires_sklearn
+def test_ica_sources_blocks():
+    """Test computing raw ICA sources block by block"""
+    from mne.fiff.array import RawArray, create_info
+    rng = np.random.RandomState(0)
+    n_channels, n_times = 6, 5000
+    data = np.dot(rng.randn(n_channels, 3), rng.laplace(size=(3, n_times)))
+    data += 0.1 * rng.randn(n_channels, n_times)
+    info = create_info(['EEG %03d' % ii for ii in range(n_channels)] +
+                       ['EOG 001'], 100., ['eeg'] * n_channels + ['eog'])
+    raw = RawArray(np.r_[data, rng.randn(1, n_times)] * 1e-5, info)
+    ica = ICA(n_components=3, max_pca_components=5)
+    ica.decompose_raw(raw, picks=np.arange(n_channels))
+
+    # 10 s blocks give the same sources as the whole data at once
+    picks = np.arange(n_channels)
+    for start, stop in [(None, None), (150, 4321)]:
+        data_w, _ = ica._pre_whiten(raw[picks, start:stop][0], raw.info,
+                                    picks)
+        assert_allclose(ica.get_sources_raw(raw, start, stop),
+                        ica._get_sources(data_w), rtol=1e-7)
+
+    # raw data which are not preloaded are exported block by block
+    raw_fname_tmp = op.join(tempdir, 'test_ica_blocks_raw.fif')
+    raw.save(raw_fname_tmp)
+    raw_disk = fiff.Raw(raw_fname_tmp, preload=False)
+    raw_disk_read = fiff.Raw(raw_fname_tmp, preload=True)
+    ica_raw = ica.sources_as_raw(raw_disk, start=150, stop=4321)
+    assert_equal(ica_raw._data.shape, (4, 4171))
+    assert_allclose(ica_raw._data[:3],
+                    ica.get_sources_raw(raw_disk_read, 150, 4321), rtol=1e-7)
+    assert_allclose(ica_raw._data[3], raw_disk_read._data[-1, 150:4321])
+    assert_allclose(ica_raw._times, raw_disk_read._times[150:4321])
@@ -2126,7 +2126,8 @@ def morph_data_precomputed(subject_from, subject_to, stc_from, vertices_to,
 
 
 @verbose
-def spatio_temporal_src_connectivity(src, n_times, dist=None, verbose=None):
+def spatio_temporal_src_connectivity(src, n_times, dist=None, compact=False,
+                                     verbose=None):
     """Compute connectivity for a source space activation over time
 
     Parameters
@@ -2139,12 +2140,16 @@ def spatio_temporal_src_connectivity(src, n_times, dist=None, verbose=None):
         Maximal geodesic distance (in m) between vertices in the
         source space to consider neighbors. If None, immediate neighbors
         are extracted from an ico surface.
+    compact : bool
+        If True, return an instance of SpatioTemporalConnectivity that only
+        stores the spatial graph and handles the temporal adjacency
+        implicitly, instead of the full sparse matrix.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
     Returns
     -------
-    connectivity : sparse COO matrix
+    connectivity : sparse COO matrix | instance of SpatioTemporalConnectivity
         The connectivity matrix describing the spatio-temporal
         graph structure. If N is the number of vertices in the
         source space, the N first nodes in the graph are the
@@ -2160,11 +2165,13 @@ def spatio_temporal_src_connectivity(src, n_times, dist=None, verbose=None):
         lh_tris = np.searchsorted(used_verts[0], src[0]['use_tris'])
         rh_tris = np.searchsorted(used_verts[1], src[1]['use_tris'])
         tris = np.concatenate((lh_tris, rh_tris + np.max(lh_tris) + 1))
-        connectivity = spatio_temporal_tris_connectivity(tris, n_times)
+        # the compact form only needs the spatial graph
+        n_times_ = 1 if compact else n_times
+        connectivity = spatio_temporal_tris_connectivity(tris, n_times_)
 
         # deal with source space only using a subset of vertices
         masks = [in1d(u, s['vertno']) for s, u in zip(src, used_verts)]
-        if sum(u.size for u in used_verts) != connectivity.shape[0] / n_times:
+        if sum(u.size for u in used_verts) != connectivity.shape[0] / n_times_:
             raise ValueError('Used vertices do not match connectivity shape')
         if [np.sum(m) for m in masks] != [len(s['vertno']) for s in src]:
             raise ValueError('Vertex mask does not match number of vertices')
@@ -2176,7 +2183,7 @@ def spatio_temporal_src_connectivity(src, n_times, dist=None, verbose=None):
                           'Consider using distance-based connectivity or '
                           'morphing data to all source space vertices.'
                           % missing)
-            masks = np.tile(masks, n_times)
+            masks = np.tile(masks, n_times_)
             masks = np.where(masks)[0]
             connectivity = connectivity.tocsr()
             connectivity = connectivity[masks]
@@ -2184,9 +2191,12 @@ def spatio_temporal_src_connectivity(src, n_times, dist=None, verbose=None):
             # return to original format
             connectivity = connectivity.tocoo()
 
+        if compact:
+            connectivity = SpatioTemporalConnectivity(connectivity, n_times)
         return connectivity
     else:  # use distances computed and saved in the source space file
-        return spatio_temporal_dist_connectivity(src, n_times, dist)
+        return spatio_temporal_dist_connectivity(src, n_times, dist,
+                                                 compact=compact)
 
 
 @verbose
@@ -2212,7 +2222,8 @@ def grade_to_tris(grade, verbose=None):
 
 
 @verbose
-def spatio_temporal_tris_connectivity(tris, n_times, verbose=None):
+def spatio_temporal_tris_connectivity(tris, n_times, compact=False,
+                                      verbose=None):
     """Compute connectivity from triangles and time instants
 
     Parameters
@@ -2221,12 +2232,16 @@ def spatio_temporal_tris_connectivity(tris, n_times, verbose=None):
         N x 3 array defining triangles.
     n_times : int
         Number of time points
+    compact : bool
+        If True, return an instance of SpatioTemporalConnectivity that only
+        stores the spatial graph and handles the temporal adjacency
+        implicitly, instead of the full sparse matrix.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
     Returns
     -------
-    connectivity : sparse COO matrix
+    connectivity : sparse COO matrix | instance of SpatioTemporalConnectivity
         The connectivity matrix describing the spatio-temporal
         graph structure. If N is the number of vertices in the
         source space, the N first nodes in the graph are the
@@ -2234,11 +2249,14 @@ def spatio_temporal_tris_connectivity(tris, n_times, verbose=None):
         during time 2, etc.
     """
     edges = mesh_edges(tris).tocoo()
+    if compact:
+        return SpatioTemporalConnectivity(edges, n_times)
     return _get_connectivity_from_edges(edges, n_times)
 
 
 @verbose
-def spatio_temporal_dist_connectivity(src, n_times, dist, verbose=None):
+def spatio_temporal_dist_connectivity(src, n_times, dist, compact=False,
+                                      verbose=None):
     """Compute connectivity from distances in a source space and time instants
 
     Parameters
@@ -2252,12 +2270,16 @@ def spatio_temporal_dist_connectivity(src, n_times, dist, verbose=None):
     dist : float
         Maximal geodesic distance (in m) between vertices in the
         source space to consider neighbors.
+    compact : bool
+        If True, return an instance of SpatioTemporalConnectivity that only
+        stores the spatial graph and handles the temporal adjacency
+        implicitly, instead of the full sparse matrix.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
     Returns
     -------
-    connectivity : sparse COO matrix
+    connectivity : sparse COO matrix | instance of SpatioTemporalConnectivity
         The connectivity matrix describing the spatio-temporal
         graph structure. If N is the number of vertices in the
         source space, the N first nodes in the graph are the
@@ -2274,6 +2296,8 @@ def spatio_temporal_dist_connectivity(src, n_times, dist, verbose=None):
     edges = edges.tocsr()
     edges.eliminate_zeros()
     edges = edges.tocoo()
+    if compact:
+        return SpatioTemporalConnectivity(edges, n_times)
     return _get_connectivity_from_edges(edges, n_times)
 
 
@@ -2374,6 +2398,84 @@ def sparse_block_diag(mats, format=None, dtype=None):
         return sparse.bmat(rows, format=format, dtype=dtype)
 
 
+class SpatioTemporalConnectivity(object):
+    """Compact connectivity for spatio-temporal data
+
+    Only the spatial graph is stored. Each vertex is implicitly connected
+    to itself at the neighboring time instants, so the memory needed does
+    not grow with the number of time instants. The neighbor lists and the
+    disjoint sets (partitions) used by the clustering functions are computed
+    once and cached.
+
+    Parameters
+    ----------
+    spatial : sparse matrix
+        The n_vertices x n_vertices spatial connectivity matrix.
+    n_times : int
+        Number of time instants.
+
+    Attributes
+    ----------
+    spatial : sparse COO matrix
+        The spatial connectivity matrix.
+    n_times : int
+        Number of time instants.
+    n_vertices : int
+        Number of spatial vertices.
+    shape : tuple
+        The shape of the equivalent full spatio-temporal connectivity matrix.
+    """
+    def __init__(self, spatial, n_times):
+        if not sparse.issparse(spatial):
+            raise ValueError('spatial must be a sparse matrix')
+        if spatial.shape[0] != spatial.shape[1]:
+            raise ValueError('spatial must be a square matrix')
+        n_times = int(n_times)
+        if n_times < 1:
+            raise ValueError('n_times must be a positive integer')
+        self.spatial = spatial.tocoo()
+        self.n_times = n_times
+        self._neighbors = None
+        self._partitions = dict()
+
+    def __repr__(self):
+        return ('<SpatioTemporalConnectivity  |  %d vertices x %d times, '
+                '%d spatial edges>' % (self.n_vertices, self.n_times,
+                                       self.spatial.nnz))
+
+    @property
+    def n_vertices(self):
+        return self.spatial.shape[0]
+
+    @property
+    def shape(self):
+        return (self.n_vertices * self.n_times,) * 2
+
+    @property
+    def neighbors(self):
+        """List of arrays of the spatial neighbors of each vertex"""
+        if self._neighbors is None:
+            # only the upper triangular part is assumed to be defined
+            conn = (self.spatial + self.spatial.transpose()).tocsr()
+            self._neighbors = [conn.indices[conn.indptr[i]:conn.indptr[i + 1]]
+                               for i in range(len(conn.indptr) - 1)]
+        return self._neighbors
+
+    def tocoo(self):
+        """Return the full spatio-temporal connectivity matrix
+
+        Returns
+        -------
+        connectivity : sparse COO matrix
+            The connectivity matrix with shape (n_vertices * n_times,) * 2.
+        """
+        return _get_connectivity_from_edges(self.spatial, self.n_times)
+
+    def todense(self):
+        """Return the full spatio-temporal connectivity as a dense matrix"""
+        return self.tocoo().todense()
+
+
 @verbose
 def _get_connectivity_from_edges(edges, n_times, verbose=None):
     """Given edges sparse matrix, create connectivity matrix"""
@@ -2502,6 +2604,23 @@ def _get_label_flip(labels, label_vertidx, src):
     return label_flip
 
 
+def _get_label_mean_operator(label_vertidx, label_flip, n_sources):
+    """Sparse matrix that averages the (sign-flipped) sources of labels"""
+    rows, cols, vals = list(), list(), list()
+    for i, (vertidx, flip) in enumerate(zip(label_vertidx, label_flip)):
+        if vertidx is None:
+            continue  # empty label, all-zero time course
+        rows.append(np.repeat(i, len(vertidx)))
+        cols.append(vertidx)
+        this_vals = np.ones(len(vertidx)) if flip is None else flip.ravel()
+        vals.append(this_vals / float(len(vertidx)))
+    if len(rows) == 0:
+        return sparse.csr_matrix((len(label_vertidx), n_sources))
+    return sparse.csr_matrix((np.concatenate(vals),
+                              (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(len(label_vertidx), n_sources))
+
+
 @verbose
 def _gen_extract_label_time_course(stcs, labels, src, mode='mean',
                                    allow_empty=False, verbose=None):
@@ -2549,7 +2668,7 @@ def _gen_extract_label_time_course(stcs, labels, src, mode='mean',
 
     # mode-dependent initalization
     if mode == 'mean':
-        pass  # we have this here to catch invalid values for mode
+        label_flip = [None] * n_labels
     elif mode == 'mean_flip':
        # get the sign-flip vector for every label
         label_flip = _get_label_flip(labels, label_vertidx, src)
@@ -2561,6 +2680,14 @@ def _gen_extract_label_time_course(stcs, labels, src, mode='mean',
     else:
         raise ValueError('%s is an invalid mode' % mode)
 
+    if mode in ('mean', 'mean_flip'):
+        # linear modes: the extraction is a (sparse) matrix product, for
+        # source estimates given by an inverse kernel and sensor data it is
+        # applied to the kernel so the source data are never computed
+        label_op = _get_label_mean_operator(label_vertidx, label_flip,
+                                            sum(nvert))
+        kernel, label_kernel = None, None
+
     # loop through source estimates and extract time series
     for stc in stcs:
 
@@ -2574,18 +2701,21 @@ def _gen_extract_label_time_course(stcs, labels, src, mode='mean',
                     % (n_labels, mode))
 
         # do the extraction
+        if mode in ('mean', 'mean_flip'):
+            if stc._kernel is not None and stc._sens_data is not None:
+                if stc._kernel is not kernel:
+                    kernel = stc._kernel
+                    label_kernel = label_op * kernel
+                label_tc = np.dot(label_kernel, stc._sens_data)
+            else:
+                label_tc = label_op * stc.data
+            # this is a generator!
+            yield label_tc
+            continue
+
         label_tc = np.zeros((n_labels, stc.data.shape[1]),
                             dtype=stc.data.dtype)
-        if mode == 'mean':
-            for i, vertidx in enumerate(label_vertidx):
-                if vertidx is not None:
-                    label_tc[i] = np.mean(stc.data[vertidx, :], axis=0)
-        elif mode == 'mean_flip':
-            for i, (vertidx, flip) in enumerate(zip(label_vertidx,
-                                                    label_flip)):
-                if vertidx is not None:
-                    label_tc[i] = np.mean(flip * stc.data[vertidx, :], axis=0)
-        elif mode == 'pca_flip':
+        if mode == 'pca_flip':
             for i, (vertidx, flip) in enumerate(zip(label_vertidx,
                                                     label_flip)):
                 if vertidx is not None:
@@ -17,7 +17,7 @@ from .parametric import f_oneway
 from ..parallel import parallel_func, check_n_jobs
 from ..utils import split_list, logger, verbose
 from ..fixes import in1d, unravel_index
-from ..source_estimate import SourceEstimate
+from ..source_estimate import SourceEstimate, SpatioTemporalConnectivity
 
 
 def _get_clusters_spatial(s, neighbors):
@@ -510,20 +510,70 @@ def _pval_from_histogram(T, H0, tail):
 
 
 def _setup_connectivity(connectivity, n_vertices, n_times):
-    if connectivity.shape[0] == n_vertices:  # use global algorithm
+    if isinstance(connectivity, SpatioTemporalConnectivity):
+        # temporal adjacency is implicit, neighbor lists are cached
+        if (connectivity.n_times != n_times or
+                connectivity.shape[0] != n_vertices):
+            raise ValueError('connectivity must be of the correct size')
+        connectivity = connectivity.neighbors
+    elif connectivity.shape[0] == n_vertices:  # use global algorithm
         connectivity = connectivity.tocoo()
         n_times = None
     else:  # use temporal adjacency algorithm
         if not round(n_vertices / float(connectivity.shape[0])) == n_times:
             raise ValueError('connectivity must be of the correct size')
-        # we claim to only use upper triangular part... not true here
-        connectivity = (connectivity + connectivity.transpose()).tocsr()
-        connectivity = [connectivity.indices[connectivity.indptr[i]:
-                        connectivity.indptr[i + 1]] for i in
-                        range(len(connectivity.indptr) - 1)]
+        connectivity = SpatioTemporalConnectivity(connectivity,
+                                                  n_times).neighbors
     return connectivity
 
 
+def _compact_connectivity(include, connectivity):
+    """Restrict connectivity to the points that can be part of a cluster
+
+    Excluded points never belong to a cluster, so they cannot link clusters
+    either and removing them does not change the clustering. For the
+    temporal adjacency algorithm, vertices that are excluded at all times
+    and the leading and trailing time points that are entirely excluded are
+    removed.
+
+    Returns
+    -------
+    idx : array of int | None
+        Indices of the tests kept, or None if nothing can be removed.
+    connectivity : sparse matrix in COO format | list
+        The connectivity of the kept tests.
+    include : array of bool | None
+        The inclusion mask of the kept tests.
+    n_times : int | None
+        The number of time points kept for the temporal algorithm.
+    """
+    if isinstance(connectivity, list):  # temporal adjacency algorithm
+        n_vertices = len(connectivity)
+        mask = include.reshape(-1, n_vertices)
+        v_idx = np.where(np.any(mask, axis=0))[0]
+        t_idx = np.where(np.any(mask, axis=1))[0]
+        if len(v_idx) == n_vertices and len(t_idx) == mask.shape[0]:
+            return None, connectivity, include, mask.shape[0]
+        t_idx = np.arange(t_idx[0], t_idx[-1] + 1)
+        idx = (t_idx[:, np.newaxis] * n_vertices + v_idx).ravel()
+        mapping = np.empty(n_vertices, dtype=int)
+        mapping.fill(-1)
+        mapping[v_idx] = np.arange(len(v_idx))
+        connectivity = [mapping[connectivity[v]] for v in v_idx]
+        connectivity = [n[n >= 0] for n in connectivity]
+        n_times = len(t_idx)
+    else:  # global algorithm
+        idx = np.where(include)[0]
+        if len(idx) == len(include):
+            return None, connectivity, include, None
+        connectivity = connectivity.tocsr()[idx][:, idx].tocoo()
+        n_times = None
+    include = include[idx]
+    if np.all(include):
+        include = None
+    return idx, connectivity, include, n_times
+
+
 def _do_permutations(X_full, slices, threshold, tail, connectivity, stat_fun,
                      max_step, include, partitions, t_power, seeds,
                      sample_shape, buffer_size):
@@ -690,6 +740,10 @@ def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
     n_tests = X[0].shape[1]
 
     if connectivity is not None:
+        if isinstance(connectivity, SpatioTemporalConnectivity):
+            compact_connectivity = connectivity
+        else:
+            compact_connectivity = None
         connectivity = _setup_connectivity(connectivity, n_tests, n_times)
 
     if (exclude is not None) and not exclude.size == n_tests:
@@ -698,6 +752,7 @@ def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
     # Step 1: Calculate T-stat for original data
     # -------------------------------------------------------------
     T_obs = stat_fun(*X)
+    T_obs_raw = np.reshape(T_obs, -1)  # view, unaffected by reshaping T_obs
     logger.info('stat_fun(H1): min=%f max=%f' % (np.min(T_obs), np.max(T_obs)))
 
     # test if stat_fun treats variables independently
@@ -723,7 +778,11 @@ def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
 
     # determine if connectivity itself can be separated into disjoint sets
     if check_disjoint is True and connectivity is not None:
-        partitions = _get_partitions_from_connectivity(connectivity, n_times)
+        if compact_connectivity is not None:  # re-use cached partitions
+            connectivity_ = compact_connectivity
+        else:
+            connectivity_ = connectivity
+        partitions = _get_partitions_from_connectivity(connectivity_, n_times)
     else:
         partitions = None
 
@@ -751,6 +810,28 @@ def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
     # The stat should have the same shape as the samples
     T_obs.shape = sample_shape
 
+    # Only the included points matter for the permutations, so restrict
+    # data, connectivity and partitions to them when possible
+    compact_idx = None
+    if include is not None and connectivity is not None and len(clusters) > 0:
+        compact_idx, connectivity_c, include_c, n_times_c = \
+            _compact_connectivity(include, connectivity)
+        if compact_idx is not None:
+            X_c = [x[:, compact_idx] for x in X]
+            T_obs_c = stat_fun(*X_c)
+            if np.alltrue(T_obs_raw[compact_idx] == T_obs_c):
+                logger.info('Restricting permutations to %d of %d tests'
+                            % (len(compact_idx), n_tests))
+                X, connectivity, include = X_c, connectivity_c, include_c
+                if partitions is not None:
+                    partitions = _get_partitions_from_connectivity(
+                        connectivity, n_times_c)
+            else:
+                logger.warning('Provided stat_fun does not treat variables '
+                               'independently. Permutations will be done '
+                               'using all tests.')
+                compact_idx = None
+
     if len(X) == 1:  # 1 sample test
         do_perm_func = _do_1samp_permutations
         X_full = X[0]
@@ -791,6 +872,8 @@ def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
         step_down_include = None  # start out including all points
         n_step_downs = 0
         while n_removed > 0:
+            if compact_idx is not None and step_down_include is not None:
+                step_down_include = step_down_include[compact_idx]
             # actually do the clustering for each partition
             if include is not None:
                 if step_down_include is not None:
@@ -1033,13 +1116,16 @@ def permutation_cluster_1samp_test(X, threshold=None, n_permutations=1024,
         the distribution.
     stat_fun : function
         Function used to compute the statistical map.
-    connectivity : sparse matrix or None
+    connectivity : sparse matrix | SpatioTemporalConnectivity | None
         Defines connectivity between features. The matrix is assumed to
         be symmetric and only the upper triangular half is used.
         This matrix must be square with dimension (n_vertices * n_times) or
         (n_vertices). Default is None, i.e, a regular lattice connectivity.
         Use square n_vertices matrix for datasets with a large temporal
-        extent to save on memory and computation time.
+        extent to save on memory and computation time. An instance of
+        SpatioTemporalConnectivity (e.g. obtained with compact=True) can be
+        re-used across tests, as its neighbor lists and partitions are
+        cached.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
     n_jobs : int
@@ -1158,13 +1244,16 @@ def spatio_temporal_cluster_1samp_test(X, threshold=None,
         the distribution.
     stat_fun : function
         Function used to compute the statistical map.
-    connectivity : sparse matrix or None
+    connectivity : sparse matrix | SpatioTemporalConnectivity | None
         Defines connectivity between features. The matrix is assumed to
         be symmetric and only the upper triangular half is used.
         This matrix must be square with dimension (n_vertices * n_times) or
         (n_vertices). Default is None, i.e, a regular lattice connectivity.
         Use square n_vertices matrix for datasets with a large temporal
-        extent to save on memory and computation time.
+        extent to save on memory and computation time. An instance of
+        SpatioTemporalConnectivity (e.g. obtained with compact=True) can be
+        re-used across tests, as its neighbor lists and partitions are
+        cached.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
     n_jobs : int
@@ -1282,10 +1371,13 @@ def spatio_temporal_cluster_test(X, threshold=1.67,
     stat_fun : function
         function called to calculate statistics, must accept 1d-arrays as
         arguments (default: scipy.stats.f_oneway)
-    connectivity : sparse matrix or None
+    connectivity : sparse matrix | SpatioTemporalConnectivity | None
         Defines connectivity between features. The matrix is assumed to
         be symmetric and only the upper triangular half is used.
-        Default is None, i.e, a regular lattice connectivity.
+        Default is None, i.e, a regular lattice connectivity. An instance of
+        SpatioTemporalConnectivity (e.g. obtained with compact=True) can be
+        re-used across tests, as its neighbor lists and partitions are
+        cached.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
     n_jobs : int
@@ -1406,6 +1498,12 @@ def _st_mask_from_s_inds(n_times, n_vertices, vertices, set_as=True):
 def _get_partitions_from_connectivity(connectivity, n_times, verbose=None):
     """Use indices to specify disjoint subsets (e.g., hemispheres) based on
     connectivity"""
+    if isinstance(connectivity, SpatioTemporalConnectivity):
+        if n_times not in connectivity._partitions:
+            connectivity._partitions[n_times] = \
+                _get_partitions_from_connectivity(connectivity.neighbors,
+                                                  n_times)
+        return connectivity._partitions[n_times]
     if isinstance(connectivity, list):
         test = np.ones(len(connectivity))
         test_conn = np.zeros((len(connectivity), len(connectivity)),
@@ -8,14 +8,30 @@
 import numpy as np
 
 
-def _ecdf(x):
-    '''no frills empirical cdf used in fdrcorrection
-    '''
-    nobs = len(x)
-    return np.arange(1, nobs + 1) / float(nobs)
+def _check_pvals(pvals):
+    """Aux function: flatten p-values, keeping float32 if given"""
+    pvals = np.asarray(pvals)
+    if not np.issubdtype(pvals.dtype, np.floating):
+        pvals = pvals.astype(np.float64)
+    return pvals.ravel(), pvals.shape
+
+
+def _map_from_sorted(pvals, pvals_sorted, values_sorted, block_size):
+    """Aux function: get the values of each p-value from the sorted ones
+
+    This replaces the inverse permutation (argsort of argsort) by a
+    blockwise binary search, so no integer index array of the size of the
+    data is needed. Tied p-values get identical corrected values, so any
+    of their positions can be used.
+    """
+    out = np.empty(pvals.shape, dtype=values_sorted.dtype)
+    for start in range(0, len(pvals), block_size):
+        sl = slice(start, start + block_size)
+        out[sl] = values_sorted[np.searchsorted(pvals_sorted, pvals[sl])]
+    return out
 
 
-def fdr_correction(pvals, alpha=0.05, method='indep'):
+def fdr_correction(pvals, alpha=0.05, method='indep', block_size=2 ** 20):
     """P-value correction with False Discovery Rate (FDR)
 
     Correction for multiple comparison using FDR.
@@ -32,13 +48,18 @@ def fdr_correction(pvals, alpha=0.05, method='indep'):
     method : 'indep' | 'negcorr'
         If 'indep' it implements Benjamini/Hochberg for independent or if
         'negcorr' it corresponds to Benjamini/Yekutieli.
+    block_size : int
+        The number of p-values processed at a time. This bounds the size of
+        the temporary arrays for very large numbers of tests, the results do
+        not depend on it.
 
     Returns
     -------
     reject : array, bool
         True if a hypothesis is rejected, False if not
     pval_corrected : array
-        pvalues adjusted for multiple hypothesis testing to limit FDR
+        pvalues adjusted for multiple hypothesis testing to limit FDR. The
+        dtype of pvals is kept for floating point inputs (e.g. float32).
 
     Notes
     -----
@@ -47,34 +68,93 @@ def fdr_correction(pvals, alpha=0.05, method='indep'):
     Thresholding of statistical maps in functional neuroimaging using the false
     discovery rate. Neuroimage. 2002 Apr;15(4):870-8.
     """
-    pvals = np.asarray(pvals)
-    shape_init = pvals.shape
-    pvals = pvals.ravel()
-
-    pvals_sortind = np.argsort(pvals)
-    pvals_sorted = pvals[pvals_sortind]
-    sortrevind = pvals_sortind.argsort()
+    pvals, shape_init = _check_pvals(pvals)
+    n_tests = len(pvals)
 
     if method in ['i', 'indep', 'p', 'poscorr']:
-        ecdffactor = _ecdf(pvals_sorted)
+        cm = 1.
     elif method in ['n', 'negcorr']:
-        cm = np.sum(1. / np.arange(1, len(pvals_sorted) + 1))
-        ecdffactor = _ecdf(pvals_sorted) / cm
+        cm = np.sum(1. / np.arange(1, n_tests + 1))
     else:
         raise ValueError("Method should be 'indep' and 'negcorr'")
 
-    reject = pvals_sorted < (ecdffactor * alpha)
-    if reject.any():
-        rejectmax = max(np.nonzero(reject)[0])
+    # only the values are sorted, the order is recovered by binary search
+    pvals_sorted = np.sort(pvals)
+    pvals_corrected = np.empty_like(pvals_sorted)
+    # step-up procedure, done blockwise from the largest p-values down
+    thresh = None
+    running_min = np.inf
+    for stop in range(n_tests, 0, -block_size):
+        start = max(stop - block_size, 0)
+        p_block = pvals_sorted[start:stop]
+        ecdffactor = np.arange(start + 1, stop + 1) / (n_tests * cm)
+        if thresh is None:
+            below = np.nonzero(p_block < ecdffactor * alpha)[0]
+            if below.size > 0:
+                thresh = p_block[below[-1]]
+        q = np.minimum.accumulate((p_block / ecdffactor)[::-1])[::-1]
+        pvals_corrected[start:stop] = np.minimum(q, running_min)
+        running_min = pvals_corrected[start]
+    np.minimum(pvals_corrected, 1.0, out=pvals_corrected)
+
+    pvals_corrected = _map_from_sorted(pvals, pvals_sorted, pvals_corrected,
+                                       block_size).reshape(shape_init)
+    if thresh is None:
+        reject = np.zeros(shape_init, dtype=bool)
     else:
-        rejectmax = 0
-    reject[:rejectmax] = True
-
-    pvals_corrected_raw = pvals_sorted / ecdffactor
-    pvals_corrected = np.minimum.accumulate(pvals_corrected_raw[::-1])[::-1]
-    pvals_corrected[pvals_corrected > 1.0] = 1.0
-    pvals_corrected = pvals_corrected[sortrevind].reshape(shape_init)
-    reject = reject[sortrevind].reshape(shape_init)
+        reject = (pvals <= thresh).reshape(shape_init)
+    return reject, pvals_corrected
+
+
+def holm_correction(pvals, alpha=0.05, block_size=2 ** 20):
+    """P-value correction with the Holm-Bonferroni step-down method
+
+    Controls the family-wise error rate like the Bonferroni correction, but
+    is uniformly more powerful.
+
+    Parameters
+    ----------
+    pvals : array_like
+        set of p-values of the individual tests.
+    alpha : float
+        error rate
+    block_size : int
+        The number of p-values processed at a time. This bounds the size of
+        the temporary arrays for very large numbers of tests, the results do
+        not depend on it.
+
+    Returns
+    -------
+    reject : array, bool
+        True if a hypothesis is rejected, False if not
+    pval_corrected : array
+        pvalues adjusted for multiple hypothesis testing to limit FWER. The
+        dtype of pvals is kept for floating point inputs (e.g. float32).
+
+    Notes
+    -----
+    Reference:
+    Holm S. A simple sequentially rejective multiple test procedure.
+    Scandinavian Journal of Statistics. 1979;6(2):65-70.
+    """
+    pvals, shape_init = _check_pvals(pvals)
+    n_tests = len(pvals)
+
+    pvals_sorted = np.sort(pvals)
+    pvals_corrected = np.empty_like(pvals_sorted)
+    # step-down procedure, done blockwise from the smallest p-values up
+    running_max = -np.inf
+    for start in range(0, n_tests, block_size):
+        stop = min(start + block_size, n_tests)
+        factor = np.arange(n_tests - start, n_tests - stop, -1)
+        q = np.maximum.accumulate(pvals_sorted[start:stop] * factor)
+        pvals_corrected[start:stop] = np.maximum(q, running_max)
+        running_max = pvals_corrected[stop - 1]
+    np.minimum(pvals_corrected, 1.0, out=pvals_corrected)
+
+    pvals_corrected = _map_from_sorted(pvals, pvals_sorted, pvals_corrected,
+                                       block_size).reshape(shape_init)
+    reject = pvals_corrected < alpha
     return reject, pvals_corrected
 
 
@@ -141,6 +141,63 @@ def _iter_contrasts(n_subjects, factor_levels, effect_picks):
         yield c_, df1, df2
 
 
+# cache of the stacked contrasts, keys are (n_subjects, factor_levels,
+# effect_picks), the order of the keys in _contrasts_cache_order is the order
+# of use
+_contrasts_cache = dict()
+_contrasts_cache_order = list()
+_contrasts_cache_max_bytes = 2 ** 24
+
+
+def _clear_contrasts_cache():
+    """Empty the memory cache of contrasts"""
+    _contrasts_cache.clear()
+    del _contrasts_cache_order[:]
+
+
+def _store_contrasts(key, contrasts):
+    """Add contrasts to the cache and drop the least recently used"""
+    if key in _contrasts_cache:
+        _contrasts_cache_order.remove(key)
+    _contrasts_cache[key] = contrasts
+    _contrasts_cache_order.append(key)
+    n_bytes = sum(_contrasts_cache[k][0].nbytes
+                  for k in _contrasts_cache_order)
+    while (n_bytes > _contrasts_cache_max_bytes and
+           len(_contrasts_cache_order) > 1):
+        old_key = _contrasts_cache_order.pop(0)
+        n_bytes -= _contrasts_cache.pop(old_key)[0].nbytes
+
+
+def _get_contrasts(n_subjects, factor_levels, effect_picks):
+    """ Aux Function: Get (cached) contrasts stacked for a single dot product
+
+    Returns
+    -------
+    c_all : ndarray, shape (n_conditions, n_columns)
+        The contrast matrices of all requested effects stacked column-wise.
+    slices : list of slice
+        The columns of c_all belonging to each effect.
+    dfs : list of tuple
+        The degrees of freedom (df1, df2) of each effect.
+    """
+    key = (n_subjects, tuple(factor_levels), tuple(effect_picks))
+    if key in _contrasts_cache:
+        _store_contrasts(key, _contrasts_cache[key])
+        return _contrasts_cache[key]
+
+    contrasts, slices, dfs = [], [], []
+    start = 0
+    for c_, df1, df2 in _iter_contrasts(n_subjects, factor_levels,
+                                        effect_picks):
+        contrasts.append(c_)
+        slices.append(slice(start, start + c_.shape[1]))
+        dfs.append((df1, df2))
+        start += c_.shape[1]
+    _store_contrasts(key, (np.concatenate(contrasts, axis=1), slices, dfs))
+    return _contrasts_cache[key]
+
+
 def f_threshold_twoway_rm(n_subjects, factor_levels, effects='A*B',
                           pvalue=0.05):
     """ Compute f-value thesholds for a two-way ANOVA
@@ -171,8 +228,8 @@ def f_threshold_twoway_rm(n_subjects, factor_levels, effects='A*B',
     effect_picks = _check_effects(effects)
 
     f_threshold = []
-    for _, df1, df2 in _iter_contrasts(n_subjects, factor_levels,
-                                       effect_picks):
+    for df1, df2 in _get_contrasts(n_subjects, factor_levels,
+                                   effect_picks)[2]:
         f_threshold.append(stats.f(df1, df2).isf(pvalue))
 
     return f_threshold if len(f_threshold) > 1 else f_threshold[0]
@@ -181,7 +238,7 @@ def f_threshold_twoway_rm(n_subjects, factor_levels, effects='A*B',
 # The following functions based on MATLAB code by Rik Henson
 # and Python code from the pvttble toolbox by Roger Lew.
 def f_twoway_rm(data, factor_levels, effects='A*B', alpha=0.05,
-                correction=False, return_pvals=True):
+                correction=False, return_pvals=True, buffer_size=None):
     """ 2 way repeated measures ANOVA for fully balanced designs
 
     data : ndarray
@@ -215,6 +272,11 @@ def f_twoway_rm(data, factor_levels, effects='A*B', alpha=0.05,
         method will be applied.
     return_pvals : bool
         If True, return p values corresponding to f values.
+    buffer_size : int | None
+        If not None, the f values will be computed for blocks of
+        "buffer_size" observations at a time, which bounds the size of the
+        temporary arrays when the number of observations is large. The
+        results do not depend on this value.
 
     Returns
     -------
@@ -232,34 +294,43 @@ def f_twoway_rm(data, factor_levels, effects='A*B', alpha=0.05,
                             np.prod(data.shape[2:]))
 
     effect_picks = _check_effects(effects)
-    n_obs = data.shape[2]
-    n_replications = data.shape[0]
-
-    # pute last axis in fornt to 'iterate' over mass univariate instances.
-    data = np.rollaxis(data, 2)
-    fvalues, pvalues = [], []
-    for c_, df1, df2 in _iter_contrasts(n_replications, factor_levels,
-                                        effect_picks):
-        y = np.dot(data, c_)
-        b = np.mean(y, axis=1)[:, np.newaxis, :]
-        ss = np.sum(np.sum(y * b, axis=2), axis=1)
-        mse = (np.sum(np.sum(y * y, axis=2), axis=1) - ss) / (df2 / df1)
-        fvals = ss / mse
-        fvalues.append(fvals)
-        if correction:
-            # sample covariances, leave off "/ (y.shape[1] - 1)" norm because
-            # it falls out.
-            v = np.array([np.dot(y_.T, y_) for y_ in y])
-            v = (np.array([np.trace(vv) for vv in v]) ** 2 /
-                 (df1 * np.sum(np.sum(v * v, axis=2), axis=1)))
-            eps = v
-
-        df1, df2 = np.zeros(n_obs) + df1, np.zeros(n_obs) + df2
-        if correction:
-            df1, df2 = [d[None, :] * eps for d in (df1, df2)]
-
+    n_replications, n_conditions, n_obs = data.shape
+    c_all, slices, dfs = _get_contrasts(n_replications, factor_levels,
+                                        effect_picks)
+    if buffer_size is None or buffer_size >= n_obs:
+        buffer_size = n_obs
+
+    # contrasts of all effects are applied in a single dot product per block
+    fvalues = np.empty((len(dfs), n_obs))
+    if correction:
+        eps = np.empty((len(dfs), n_obs))
+    for pos in range(0, n_obs, buffer_size):
+        # put observations in front to 'iterate' over mass univariate
+        # instances, shape (n_block, n_replications, n_columns)
+        block = np.rollaxis(data[:, :, pos:pos + buffer_size], 2)
+        y_all = np.dot(block.reshape(-1, n_conditions), c_all)
+        y_all = y_all.reshape(block.shape[0], n_replications, -1)
+        for ii, (sl, (df1, df2)) in enumerate(zip(slices, dfs)):
+            y = y_all[:, :, sl]
+            b = np.mean(y, axis=1)
+            ss = n_replications * np.sum(b * b, axis=1)
+            mse = (np.sum(np.sum(y * y, axis=2), axis=1) - ss) / (df2 / df1)
+            fvalues[ii, pos:pos + buffer_size] = ss / mse
+            if correction:
+                # sample covariances, leave off "/ (y.shape[1] - 1)" norm
+                # because it falls out.
+                v = np.einsum('ijk,ijl->ikl', y, y)
+                eps[ii, pos:pos + buffer_size] = \
+                    (np.einsum('ikk->i', v) ** 2 /
+                     (df1 * np.sum(np.sum(v * v, axis=2), axis=1)))
+
+    pvalues = []
+    for ii, (df1, df2) in enumerate(dfs):
         if return_pvals:
-            pvals = stats.f(df1, df2).sf(fvals)
+            df1, df2 = np.zeros(n_obs) + df1, np.zeros(n_obs) + df2
+            if correction:
+                df1, df2 = [d * eps[ii] for d in (df1, df2)]
+            pvals = stats.f(df1, df2).sf(fvalues[ii])
         else:
             pvals = np.empty(0)
         pvalues.append(pvals)
@@ -48,18 +48,25 @@ def bin_perm_rep(ndim, a=0, b=1):
     return perms
 
 
-def _max_stat(X, X2, perms, dof_scaling):
+def _max_stat(X, X2, perms, dof_scaling, stat_obs=None, order=None):
     """Aux function for permutation_t_test (for parallel comp)"""
     n_samples = len(X)
     mus = np.dot(perms, X) / float(n_samples)
     stds = np.sqrt(X2[None, :] - mus ** 2) * dof_scaling  # std with splitting
-    max_abs = np.max(np.abs(mus) / (stds / sqrt(n_samples)), axis=1)  # t-max
-    return max_abs
+    T_abs = np.abs(mus) / (stds / sqrt(n_samples))
+    max_abs = np.max(T_abs, axis=1)  # t-max
+    if order is None:
+        return max_abs
+    # successive maxima over the tests sorted by increasing observed
+    # statistic, as needed for the step-down procedure
+    T_abs = np.maximum.accumulate(T_abs[:, order], axis=1)
+    counts = np.sum(T_abs >= stat_obs[order][None, :], axis=0)
+    return max_abs, counts
 
 
 @verbose
 def permutation_t_test(X, n_permutations=10000, tail=0, n_jobs=1,
-                       verbose=None):
+                       step_down=False, verbose=None):
     """One sample/paired sample permutation test based on a t-statistic.
 
     This function can perform the test on one variable or
@@ -89,6 +96,11 @@ def permutation_t_test(X, n_permutations=10000, tail=0, n_jobs=1,
         is that the mean of the data is less than 0 (lower tailed test).
     n_jobs : int
         Number of CPUs to use for computation.
+    step_down : bool
+        If True, the p-values are adjusted with the step-down "tmax" method,
+        which is more powerful than the single-step "tmax" method while still
+        controlling the family-wise error rate. This is computed from the
+        same permutations, i.e. at little extra cost.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
@@ -113,6 +125,10 @@ def permutation_t_test(X, n_permutations=10000, tail=0, n_jobs=1,
     Overview of standard nonparametric randomization and permutation
     testing applied to neuroimaging data (e.g. fMRI)
     DOI: http://dx.doi.org/10.1002/hbm.1058
+
+    The step-down procedure is described in:
+    Westfall, P. H. & Young, S. S. (1993). Resampling-Based Multiple
+    Testing. Wiley, New York.
     """
     n_samples, n_tests = X.shape
 
@@ -132,20 +148,35 @@ def permutation_t_test(X, n_permutations=10000, tail=0, n_jobs=1,
     else:
         perms = np.sign(0.5 - np.random.rand(n_permutations, n_samples))
 
-    parallel, my_max_stat, n_jobs = parallel_func(_max_stat, n_jobs)
+    if tail == 0:
+        stat_obs = np.abs(T_obs)
+    elif tail == 1:
+        stat_obs = T_obs
+    elif tail == -1:
+        stat_obs = -T_obs
 
-    max_abs = np.concatenate(parallel(my_max_stat(X, X2, p, dof_scaling)
-                                      for p in np.array_split(perms, n_jobs)))
+    parallel, my_max_stat, n_jobs = parallel_func(_max_stat, n_jobs)
+    if step_down:
+        order = np.argsort(stat_obs)
+        out = parallel(my_max_stat(X, X2, p, dof_scaling, stat_obs, order)
+                       for p in np.array_split(perms, n_jobs))
+        max_abs = np.concatenate([o[0] for o in out])
+        counts = np.sum([o[1] for o in out], axis=0)
+    else:
+        max_abs = np.concatenate(parallel(my_max_stat(X, X2, p, dof_scaling)
+                                 for p in np.array_split(perms, n_jobs)))
     H0 = np.sort(max_abs)
 
     scaling = float(n_permutations + 1)
 
-    if tail == 0:
-        p_values = 1.0 - np.searchsorted(H0, np.abs(T_obs)) / scaling
-    elif tail == 1:
-        p_values = 1.0 - np.searchsorted(H0, T_obs) / scaling
-    elif tail == -1:
-        p_values = 1.0 - np.searchsorted(H0, -T_obs) / scaling
+    if step_down:
+        # the observed data count as one permutation, and the p-values must
+        # not decrease when going down to less significant tests
+        p_values = np.empty(len(T_obs))
+        p_values[order] = np.maximum.accumulate(
+            ((counts + 1.) / scaling)[::-1])[::-1]
+    else:
+        p_values = 1.0 - np.searchsorted(H0, stat_obs) / scaling
 
     return T_obs, p_values, H0
 
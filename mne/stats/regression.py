@@ -0,0 +1,411 @@
+"""Mass-univariate linear regression (general linear model)
+"""
+
+# License: Simplified BSD
+
+from collections import namedtuple
+from math import sqrt
+
+import numpy as np
+from scipy import linalg, stats
+
+from .cluster_level import (_find_clusters, _setup_connectivity,
+                            _get_partitions_from_connectivity,
+                            _pval_from_histogram, _cluster_indices_to_mask,
+                            _cluster_mask_to_indices, _reshape_clusters)
+from ..parallel import parallel_func, check_n_jobs
+from ..utils import split_list, logger, verbose
+from ..fixes import matrix_rank
+from ..source_estimate import SpatioTemporalConnectivity
+
+
+lm_params = namedtuple('lm_params', 'beta stderr t_val p_val mlog10_p_val')
+
+
+def _check_design_matrix(design_matrix, n_samples):
+    """Aux function"""
+    design_matrix = np.asarray(design_matrix, dtype=np.float64)
+    if design_matrix.ndim == 1:
+        design_matrix = design_matrix[:, np.newaxis]
+    if design_matrix.ndim != 2 or design_matrix.shape[0] != n_samples:
+        raise ValueError('design_matrix must have shape (n_samples, '
+                         'n_regressors) with n_samples == %d, got %s'
+                         % (n_samples, design_matrix.shape))
+    n_regressors = design_matrix.shape[1]
+    if matrix_rank(design_matrix) < n_regressors:
+        raise ValueError('design_matrix is rank deficient')
+    df = n_samples - n_regressors
+    if df < 1:
+        raise ValueError('design_matrix must have more samples (%d) than '
+                         'regressors (%d)' % (n_samples, n_regressors))
+    return design_matrix, df
+
+
+def _fit_lm(data, design_matrix, df, buffer_size=None):
+    """Ordinary least squares fit of all tests at once
+
+    data is of shape (n_samples, n_tests). The pseudo-inverse of the design
+    matrix is computed once, the tests are then processed in blocks of
+    buffer_size columns with a single matrix product per block.
+    """
+    n_samples, n_tests = data.shape
+    n_regressors = design_matrix.shape[1]
+    pinv_X = linalg.pinv(design_matrix)
+    # diagonal of inv(X'X)
+    unscaled_var = np.sum(pinv_X * pinv_X, axis=1)
+    if buffer_size is None or buffer_size >= n_tests:
+        buffer_size = n_tests
+
+    beta = np.empty((n_regressors, n_tests))
+    rss = np.empty(n_tests)
+    for pos in range(0, n_tests, buffer_size):
+        y = data[:, pos:pos + buffer_size]
+        b = np.dot(pinv_X, y)
+        resid = y - np.dot(design_matrix, b)
+        beta[:, pos:pos + buffer_size] = b
+        rss[pos:pos + buffer_size] = np.sum(resid * resid, axis=0)
+
+    stderr = np.sqrt(rss[np.newaxis, :] / df * unscaled_var[:, np.newaxis])
+    t_val = beta / stderr
+    # use the log survival function so that tiny p-values do not underflow
+    log_p_val = np.log(2.) + stats.t.logsf(np.abs(t_val), df)
+    p_val = np.exp(log_p_val)
+    mlog10_p_val = -log_p_val / np.log(10.)
+    return beta, stderr, t_val, p_val, mlog10_p_val
+
+
+@verbose
+def linear_regression(inst, design_matrix, names=None, picks=None,
+                      buffer_size=None, verbose=None):
+    """Fit an ordinary least squares model for every test at once
+
+    This can be used for single-trial regression of epochs data: a design
+    matrix containing one row per epoch is fitted against the data of each
+    channel and time point in a single vectorized operation.
+
+    Parameters
+    ----------
+    inst : instance of Epochs | array, shape (n_samples, ...)
+        The data to be regressed. If an array, the first dimension
+        corresponds to the samples (e.g. trials or subjects) and the
+        remaining dimensions to the tests.
+    design_matrix : array, shape (n_samples, n_regressors)
+        The regressors to be used. Must be of full rank. Include a column
+        of ones to model an intercept.
+    names : list of str | None
+        The names of the regressors. If None, 'x0', 'x1', ... is used.
+    picks : array-like of int | None
+        Channels to use if inst is an instance of Epochs. If None only MEG
+        and EEG channels are used.
+    buffer_size : int | None
+        If not None, the model will be fitted for blocks of "buffer_size"
+        tests at a time, which bounds the size of the temporary arrays when
+        the number of tests is large. The results do not depend on this
+        value.
+    verbose : bool, str, int, or None
+        If not None, override default verbose level (see mne.verbose).
+
+    Returns
+    -------
+    lm : dict
+        A dict with the regressor names as keys. Each value is a namedtuple
+        with the fields 'beta', 'stderr', 't_val', 'p_val' and
+        'mlog10_p_val'. If inst is an instance of Epochs, each field is an
+        instance of Evoked, otherwise an array with the shape of a sample
+        of inst. p-values are two-sided.
+    """
+    from ..epochs import _BaseEpochs
+    from ..fiff.pick import pick_types
+
+    if isinstance(inst, _BaseEpochs):
+        if picks is None:
+            picks = pick_types(inst.info, meg=True, eeg=True, ref_meg=True,
+                               stim=False, eog=False, ecg=False, emg=False,
+                               exclude=[])
+        picks = np.sort(picks)
+        data = inst.get_data()[:, picks]
+        template = inst.average(picks=picks)
+    else:
+        data = np.asarray(inst)
+        template = None
+    n_samples = data.shape[0]
+    sample_shape = data.shape[1:]
+    data = data.reshape(n_samples, -1)
+
+    design_matrix, df = _check_design_matrix(design_matrix, n_samples)
+    n_regressors = design_matrix.shape[1]
+    if names is None:
+        names = ['x%i' % ii for ii in range(n_regressors)]
+    if len(names) != n_regressors:
+        raise ValueError('The number of names (%d) must match the number of '
+                         'regressors (%d)' % (len(names), n_regressors))
+    logger.info('Fitting linear model with %d regressors to %d tests '
+                '(%d samples)' % (n_regressors, data.shape[1], n_samples))
+    out = _fit_lm(data, design_matrix, df, buffer_size)
+
+    lm = dict()
+    for ii, name in enumerate(names):
+        values = list()
+        for v in out:
+            v = v[ii].reshape(sample_shape)
+            if template is not None:
+                evoked = template.copy()
+                evoked.data = v
+                evoked.comment = name
+                v = evoked
+            values.append(v)
+        lm[name] = lm_params(*values)
+    return lm
+
+
+def _lm_perm_t(resid, sum_sq, pinv_row, Q, scale, order, buffer_size):
+    """Aux function: t-values of one regressor for permuted residuals
+
+    Permuting the rows of the data is equivalent to permuting the columns of
+    the fixed projectors, so the data are never copied.
+    """
+    n_tests = resid.shape[1]
+    inv = np.argsort(order)
+    W = np.concatenate((pinv_row[inv][np.newaxis, :], Q[inv].T), axis=0)
+    t_val = np.empty(n_tests)
+    for pos in range(0, n_tests, buffer_size):
+        proj = np.dot(W, resid[:, pos:pos + buffer_size])
+        rss = sum_sq[pos:pos + buffer_size] - np.sum(proj[1:] ** 2, axis=0)
+        rss = np.maximum(rss, np.finfo(rss.dtype).tiny)
+        t_val[pos:pos + buffer_size] = proj[0] / (scale * np.sqrt(rss))
+    return t_val
+
+
+def _do_lm_permutations(resid, sum_sq, pinv_row, Q, scale, threshold, tail,
+                        connectivity, max_step, include, partitions, t_power,
+                        seeds, sample_shape, buffer_size):
+    """Aux function: Freedman-Lane permutations"""
+    n_samples = resid.shape[0]
+    max_cluster_sums = np.empty(len(seeds), dtype=np.double)
+    for seed_idx, seed in enumerate(seeds):
+        rng = np.random.RandomState(seed)
+        order = np.arange(n_samples)
+        rng.shuffle(order)
+        T_obs_surr = _lm_perm_t(resid, sum_sq, pinv_row, Q, scale, order,
+                                buffer_size)
+
+        # The stat should have the same shape as the samples for no conn.
+        if connectivity is None:
+            T_obs_surr.shape = sample_shape
+
+        out = _find_clusters(T_obs_surr, threshold=threshold, tail=tail,
+                             max_step=max_step, connectivity=connectivity,
+                             partitions=partitions, include=include,
+                             t_power=t_power)
+        perm_clusters_sums = out[1]
+        if len(perm_clusters_sums) > 0:
+            # get max with sign info
+            idx_max = np.argmax(np.abs(perm_clusters_sums))
+            max_cluster_sums[seed_idx] = perm_clusters_sums[idx_max]
+        else:
+            max_cluster_sums[seed_idx] = 0
+    return max_cluster_sums
+
+
+@verbose
+def permutation_cluster_lm_test(X, design_matrix, regressor=0,
+                                threshold=None, n_permutations=1024, tail=0,
+                                connectivity=None, verbose=None, n_jobs=1,
+                                seed=None, max_step=1, exclude=None,
+                                t_power=1, out_type='mask',
+                                check_disjoint=False, buffer_size=1000):
+    """Cluster-level permutation test of one regressor of a linear model
+
+    The t-values of the regressor of interest are computed for every test
+    and clustered. The null distribution of the maximum cluster statistic
+    is obtained with the Freedman-Lane procedure: the residuals of the
+    reduced model (all regressors but the one tested) are permuted, which
+    accounts for the nuisance regressors.
+
+    Parameters
+    ----------
+    X : array, shape (n_samples, p[, q])
+        The data. The first dimension corresponds to the samples
+        (observations), the remaining dimensions to the tests, e.g.
+        (n_samples, n_times, n_vertices) for spatio-temporal data.
+    design_matrix : array, shape (n_samples, n_regressors)
+        The design matrix. Must be of full rank. Include a column of ones
+        to model an intercept.
+    regressor : int
+        The index of the column of design_matrix to test.
+    threshold : float | dict | None
+        If threshold is None, it will choose a t-threshold equivalent to
+        p < 0.05 for the residual degrees of freedom of the model.
+        If a dict is used, then threshold-free cluster enhancement (TFCE)
+        will be used.
+    n_permutations : int
+        The number of permutations to compute.
+    tail : -1 or 0 or 1 (default = 0)
+        If tail is 1, the statistic is thresholded above threshold.
+        If tail is -1, the statistic is thresholded below threshold.
+        If tail is 0, the statistic is thresholded on both sides of
+        the distribution.
+    connectivity : sparse matrix | SpatioTemporalConnectivity | None
+        Defines connectivity between features. The matrix is assumed to
+        be symmetric and only the upper triangular half is used.
+        This matrix must be square with dimension (n_vertices * n_times) or
+        (n_vertices). Default is None, i.e, a regular lattice connectivity.
+    verbose : bool, str, int, or None
+        If not None, override default verbose level (see mne.verbose).
+    n_jobs : int
+        Number of permutations to run in parallel (requires joblib package).
+    seed : int or None
+        Seed the random number generator for results reproducibility.
+    max_step : int
+        When connectivity is a n_vertices x n_vertices matrix, specify the
+        maximum number of steps between vertices along the second dimension
+        (typically time) to be considered connected. This is not used for full
+        or None connectivity matrices.
+    exclude : boolean array or None
+        Mask to apply to the data to exclude certain points from clustering
+        (e.g., medial wall vertices). Should be the same shape as X[0]. If
+        None, no points are excluded.
+    t_power : float
+        Power to raise the statistical values (usually t-values) by before
+        summing (sign will be retained). Note that t_power == 0 will give a
+        count of nodes in each cluster, t_power == 1 will weight each node by
+        its statistical score.
+    out_type : str
+        For arrays with connectivity, this sets the output format for clusters.
+        If 'mask', it will pass back a list of boolean mask arrays.
+        If 'indices', it will pass back a list of lists, where each list is the
+        set of vertices in a given cluster. Note that the latter may use far
+        less memory for large datasets.
+    check_disjoint : bool
+        If True, the connectivity matrix (or list) will be examined to
+        determine of it can be separated into disjoint sets. In some cases
+        (usually with connectivity as a list and many "time" points), this
+        can lead to faster clustering, but results should be identical.
+    buffer_size: int or None
+        The statistics will be computed for blocks of variables of size
+        "buffer_size" at a time, which bounds the memory needed per
+        permutation.
+
+    Returns
+    -------
+    T_obs : array
+        t-values of the tested regressor for all variables.
+    clusters : list
+        List type defined by out_type above.
+    cluster_pv : array
+        P-value for each cluster
+    H0 : array of shape [n_permutations]
+        Max cluster level stats observed under permutation.
+
+    Notes
+    -----
+    Reference:
+    Freedman D. & Lane D. (1983), "A nonstochastic interpretation of
+    reported significance levels", Journal of Business and Economic
+    Statistics, Vol. 1, No. 4, pp. 292-298.
+
+    Winkler A.M. et al. (2014), "Permutation inference for the general
+    linear model", NeuroImage, Vol. 92, pp. 381-397.
+    """
+    n_jobs = check_n_jobs(n_jobs)
+    if out_type not in ['mask', 'indices']:
+        raise ValueError('out_type must be either \'mask\' or \'indices\'')
+    X = np.asarray(X)
+    if X.ndim == 1:
+        X = X[:, np.newaxis]
+    n_samples, n_times = X.shape[:2]
+    sample_shape = X.shape[1:]
+    X = X.reshape(n_samples, -1)
+    n_tests = X.shape[1]
+
+    design_matrix, df = _check_design_matrix(design_matrix, n_samples)
+    n_regressors = design_matrix.shape[1]
+    if not 0 <= regressor < n_regressors:
+        raise ValueError('regressor must be between 0 and %d, got %s'
+                         % (n_regressors - 1, regressor))
+    if threshold is None:
+        p_thresh = 0.05 / (1 + (tail == 0))
+        threshold = -stats.distributions.t.ppf(p_thresh, df)
+        if np.sign(tail) < 0:
+            threshold = -threshold
+    if buffer_size is None or buffer_size >= n_tests:
+        buffer_size = n_tests
+
+    if connectivity is not None:
+        connectivity_ = connectivity
+        connectivity = _setup_connectivity(connectivity, n_tests, n_times)
+        if not isinstance(connectivity_, SpatioTemporalConnectivity):
+            connectivity_ = connectivity
+    if (exclude is not None) and not exclude.size == n_tests:
+        raise ValueError('exclude must be the same shape as X[0]')
+    include = None if exclude is None else np.logical_not(exclude)
+    if check_disjoint is True and connectivity is not None:
+        partitions = _get_partitions_from_connectivity(connectivity_, n_times)
+    else:
+        partitions = None
+
+    # residuals of the reduced (nuisance only) model, computed blockwise
+    Z = np.delete(design_matrix, regressor, axis=1)
+    resid = np.array(X, dtype=np.float64)
+    if Z.shape[1] > 0:
+        pinv_Z = linalg.pinv(Z)
+        for pos in range(0, n_tests, buffer_size):
+            sl = slice(pos, pos + buffer_size)
+            resid[:, sl] -= np.dot(Z, np.dot(pinv_Z, resid[:, sl]))
+    sum_sq = np.sum(resid * resid, axis=0)
+
+    # everything needed from the full model, permuted row-wise later
+    pinv_X = linalg.pinv(design_matrix)
+    pinv_row = pinv_X[regressor]
+    Q = linalg.qr(design_matrix, mode='economic')[0]
+    scale = sqrt(np.sum(pinv_row ** 2) / df)
+
+    # Step 1: t-values of the observed data (identity permutation)
+    T_obs = _lm_perm_t(resid, sum_sq, pinv_row, Q, scale,
+                       np.arange(n_samples), buffer_size)
+    logger.info('t-values (H1): min=%f max=%f' % (np.min(T_obs),
+                                                   np.max(T_obs)))
+    if connectivity is None:
+        T_obs.shape = sample_shape
+
+    out = _find_clusters(T_obs, threshold, tail, connectivity,
+                         max_step=max_step, include=include,
+                         partitions=partitions, t_power=t_power,
+                         show_info=True)
+    clusters, cluster_stats = out
+    # For TFCE, return the "adjusted" statistic instead of raw scores
+    if isinstance(threshold, dict):
+        T_obs = cluster_stats.copy()
+    logger.info('Found %d clusters' % len(clusters))
+
+    # convert clusters to old format
+    if connectivity is not None:
+        if out_type == 'mask':
+            clusters = _cluster_indices_to_mask(clusters, n_tests)
+    else:
+        if out_type == 'indices':
+            clusters = _cluster_mask_to_indices(clusters)
+    T_obs.shape = sample_shape
+
+    if len(clusters) == 0:
+        return T_obs, np.array([]), np.array([]), np.array([])
+
+    # Step 2: permute the reduced model residuals
+    if seed is None:
+        seeds = [None] * n_permutations
+    else:
+        seeds = list(seed + np.arange(n_permutations))
+    parallel, my_do_perm_func, _ = parallel_func(_do_lm_permutations, n_jobs)
+    H0 = parallel(my_do_perm_func(resid, sum_sq, pinv_row, Q, scale,
+                                  threshold, tail, connectivity, max_step,
+                                  include, partitions, t_power, s,
+                                  sample_shape, buffer_size)
+                  for s in split_list(seeds, n_jobs))
+    H0 = np.concatenate(H0)
+    cluster_pv = _pval_from_histogram(cluster_stats, H0, tail)
+
+    clusters = _reshape_clusters(clusters, sample_shape)
+    return T_obs, clusters, cluster_pv, H0
+
+
+permutation_cluster_lm_test.__test__ = False
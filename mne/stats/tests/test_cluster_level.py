@@ -6,6 +6,7 @@ from scipy import sparse, linalg, stats
 from mne.fixes import partial
 import warnings
 from mne.parallel import _force_serial
+from mne.source_estimate import SpatioTemporalConnectivity
 from mne.stats.cluster_level import (permutation_cluster_test,
                                      permutation_cluster_1samp_test,
                                      spatio_temporal_cluster_test,
@@ -231,6 +232,18 @@ def test_cluster_permutation_with_connectivity():
                      out_connectivity_3[1]])
         assert_true(len(data_1.intersection(data_2)) == len(data_1))
 
+        # compact connectivity must give the same results, and can be re-used
+        compact = SpatioTemporalConnectivity(connectivity, 2)
+        for _ in range(2):
+            out_compact = spatio_temporal_func(X1d_3, n_permutations=50,
+                                               connectivity=compact,
+                                               max_step=0, threshold=1.67,
+                                               check_disjoint=True, seed=0)
+            assert_array_equal(out_compact[0], out_connectivity_3[0])
+            assert_true(len(out_compact[1]) == 2 * n_clust_orig)
+        assert_raises(ValueError, spatio_temporal_func, X1d_3,
+                      connectivity=SpatioTemporalConnectivity(connectivity, 3))
+
         # test new versus old method
         out_connectivity_4 = spatio_temporal_func(X1d_3, n_permutations=50,
                                                   connectivity=connectivity,
@@ -422,6 +435,64 @@ def ttest_1samp(X):
     return stats.ttest_1samp(X, 0)[0]
 
 
+def test_permutation_exclude_compact():
+    """Test that compacting excluded points keeps permutation results
+    """
+    try:
+        try:
+            from sklearn.feature_extraction.image import grid_to_graph
+        except ImportError:
+            from scikits.learn.feature_extraction.image import grid_to_graph
+    except ImportError:
+        return
+    from mne.stats import cluster_level
+    rng = np.random.RandomState(0)
+    X = rng.randn(10, 5, 20)
+    X[:, 1:3, 2:6] += 1.5
+    X[:, 3, 12:15] -= 1.5
+    spatial_exclude = np.r_[0, 8:12, 18:20]
+    exclude = np.zeros((5, 20), dtype=bool)
+    exclude[:, spatial_exclude] = True
+    exclude[4] = True  # last time point
+    exclude = exclude.ravel()
+
+    compact = cluster_level._compact_connectivity
+
+    def _no_compact(include, connectivity):
+        return None, connectivity, include, None
+
+    for conn, step_down_p in [(grid_to_graph(1, 20), 0.05),
+                              (grid_to_graph(5, 20), 0)]:
+        kwargs = dict(threshold=1.5, n_permutations=50, seed=0,
+                      connectivity=conn, exclude=exclude, out_type='indices',
+                      check_disjoint=True, step_down_p=step_down_p)
+        out = permutation_cluster_1samp_test(X, **kwargs)
+        assert_true(len(out[1]) > 0)
+        cluster_level._compact_connectivity = _no_compact
+        try:
+            out_full = permutation_cluster_1samp_test(X, **kwargs)
+        finally:
+            cluster_level._compact_connectivity = compact
+        assert_array_equal(out[0], out_full[0])
+        assert_equal(len(out[1]), len(out_full[1]))
+        for c, c_full in zip(out[1], out_full[1]):
+            assert_array_equal(c, c_full)
+        assert_array_equal(out[2], out_full[2])
+        assert_array_equal(out[3], out_full[3])
+
+    # the excluded points are removed from the connectivity
+    include = np.logical_not(exclude)
+    conn = grid_to_graph(1, 20)
+    conn_list = cluster_level._setup_connectivity(conn, 100, 5)
+    idx, conn_c, include_c, n_times = compact(include, conn_list)
+    assert_equal(n_times, 4)
+    assert_equal(len(conn_c), 13)
+    assert_true(include_c is None)
+    assert_equal(len(idx), 4 * 13)
+    idx, conn_c, include_c, n_times = compact(include, grid_to_graph(5, 20))
+    assert_equal(conn_c.shape, (include.sum(),) * 2)
+
+
 def test_summarize_clusters():
     """Test cluster summary stcs
     """
@@ -3,7 +3,28 @@ from numpy.testing import assert_almost_equal, assert_allclose, assert_raises
 from nose.tools import assert_true
 from scipy import stats
 
-from mne.stats import fdr_correction, bonferroni_correction
+from mne.stats import fdr_correction, bonferroni_correction, holm_correction
+
+
+def _fdr_correction_argsort(pvals, alpha, method):
+    """Reference implementation based on argsort"""
+    pvals = np.asarray(pvals, dtype=np.float64)
+    shape_init = pvals.shape
+    pvals = pvals.ravel()
+    pvals_sortind = np.argsort(pvals)
+    pvals_sorted = pvals[pvals_sortind]
+    sortrevind = pvals_sortind.argsort()
+    ecdffactor = np.arange(1, len(pvals) + 1) / float(len(pvals))
+    if method == 'negcorr':
+        ecdffactor /= np.sum(1. / np.arange(1, len(pvals_sorted) + 1))
+    reject = pvals_sorted < (ecdffactor * alpha)
+    if reject.any():
+        reject[:max(np.nonzero(reject)[0])] = True
+    pvals_corrected = pvals_sorted / ecdffactor
+    pvals_corrected = np.minimum.accumulate(pvals_corrected[::-1])[::-1]
+    pvals_corrected[pvals_corrected > 1.0] = 1.0
+    return (reject[sortrevind].reshape(shape_init),
+            pvals_corrected[sortrevind].reshape(shape_init))
 
 
 def test_multi_pval_correction():
@@ -42,3 +63,38 @@ def test_multi_pval_correction():
     thresh_fdr = np.min(np.abs(T)[reject_fdr])
     assert_true(0 <= (reject_fdr.sum() - 50) <= 50 * 1.05)
     assert_true(thresh_uncorrected <= thresh_fdr <= thresh_bonferroni)
+
+
+def test_fdr_blocks_and_dtype():
+    """Test blockwise FDR and Holm against reference implementations
+    """
+    rng = np.random.RandomState(0)
+    pval = rng.rand(50, 40) ** 3
+    pval[0, :5] = pval[0, 5]  # ties
+    for method in ['indep', 'negcorr']:
+        reject_ref, pval_ref = _fdr_correction_argsort(pval, 0.05, method)
+        for block_size in [7, 2 ** 20]:
+            reject, pval_fdr = fdr_correction(pval, 0.05, method,
+                                              block_size=block_size)
+            assert_true(np.array_equal(reject, reject_ref))
+            assert_allclose(pval_fdr, pval_ref)
+        reject, pval_fdr = fdr_correction(pval.astype(np.float32), 0.05,
+                                          method)
+        assert_true(pval_fdr.dtype == np.float32)
+        assert_allclose(pval_fdr, pval_ref, rtol=1e-5)
+
+    # Holm
+    pval_sorted = np.sort(pval.ravel())
+    n_tests = pval.size
+    pval_holm_ref = np.maximum.accumulate(
+        pval_sorted * np.arange(n_tests, 0, -1))
+    pval_holm_ref = np.minimum(pval_holm_ref, 1.)
+    for block_size in [7, 2 ** 20]:
+        reject, pval_holm = holm_correction(pval, 0.05, block_size)
+        assert_true(pval_holm.shape == pval.shape)
+        assert_allclose(np.sort(pval_holm.ravel()), pval_holm_ref)
+        assert_true(np.array_equal(reject, pval_holm < 0.05))
+    # Holm is between Bonferroni and uncorrected
+    pval_bonferroni = np.minimum(bonferroni_correction(pval)[1], 1.)
+    assert_true(np.all(pval_holm <= pval_bonferroni))
+    assert_true(np.all(pval_holm >= pval))
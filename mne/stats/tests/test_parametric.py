@@ -1,6 +1,7 @@
 from itertools import product
 from ..parametric import (f_twoway_rm, f_threshold_twoway_rm,
                           defaults_twoway_rm)
+from .. import parametric
 from nose.tools import assert_raises, assert_true
 from numpy.testing import assert_array_almost_equal
 
@@ -89,3 +90,37 @@ def test_f_twoway_rm():
 
     _, pvals = f_twoway_rm(test_data, [2, 3], correction=True)
     assert_array_almost_equal(pvals, test_external['spss_pvals_corrected'], 3)
+
+
+def test_f_twoway_rm_buffer():
+    """ Test 2-way anova with buffered computation """
+    rng = np.random.RandomState(0)
+    data = rng.randn(10, 6, 25)
+    for effects in ['A', 'A:B', 'A*B']:
+        for correction in [False, True]:
+            fvals, pvals = f_twoway_rm(data, [2, 3], effects,
+                                       correction=correction)
+            fvals_b, pvals_b = f_twoway_rm(data, [2, 3], effects,
+                                           correction=correction,
+                                           buffer_size=7)
+            assert_array_almost_equal(fvals, fvals_b)
+            assert_array_almost_equal(pvals, pvals_b)
+
+
+def test_contrasts_cache():
+    """ Test the bounded cache of the ANOVA contrasts """
+    parametric._clear_contrasts_cache()
+    c_all = parametric._get_contrasts(10, [2, 3], [0, 1, 2])[0]
+    assert_true(parametric._get_contrasts(10, [2, 3], [0, 1, 2])[0]
+                is c_all)
+    max_bytes = parametric._contrasts_cache_max_bytes
+    parametric._contrasts_cache_max_bytes = 2 * c_all.nbytes
+    try:
+        for n_subjects in (11, 12):
+            parametric._get_contrasts(n_subjects, [2, 3], [0, 1, 2])
+        # the least recently used contrasts are dropped
+        assert_true(len(parametric._contrasts_cache) == 2)
+        assert_true((10, (2, 3), (0, 1, 2)) not in parametric._contrasts_cache)
+    finally:
+        parametric._contrasts_cache_max_bytes = max_bytes
+        parametric._clear_contrasts_cache()
@@ -1,6 +1,7 @@
 import numpy as np
 from numpy.testing import assert_array_equal, assert_almost_equal
 from scipy import stats
+from nose.tools import assert_true
 
 from mne.stats.permutations import permutation_t_test
 
@@ -31,3 +32,23 @@ def test_permutation_t_test():
     T_obs_scipy, p_values_scipy = stats.ttest_1samp(X[:, 0], 0)
     assert_almost_equal(T_obs[0], T_obs_scipy, 8)
     assert_almost_equal(p_values[0], p_values_scipy, 2)
+
+    # step-down is at least as powerful as single-step, and identical for
+    # the most significant test
+    X = np.random.randn(20, 10)
+    X[:, :3] += np.linspace(0.5, 1, 3)
+    for tail in [-1, 0, 1]:
+        np.random.seed(0)
+        T_obs, p_values, H0 = permutation_t_test(X, 999, tail)
+        np.random.seed(0)
+        T_obs_sd, p_values_sd, H0_sd = permutation_t_test(X, 999, tail,
+                                                          step_down=True)
+        assert_array_equal(T_obs, T_obs_sd)
+        assert_array_equal(H0, H0_sd)
+        assert_true(np.all(p_values_sd <= p_values + 1e-12))
+        stat = {-1: -T_obs, 0: np.abs(T_obs), 1: T_obs}[tail]
+        best = np.argmax(stat)
+        assert_almost_equal(p_values_sd[best], p_values[best])
+        # monotonic in the statistic
+        order = np.argsort(stat)
+        assert_true(np.all(np.diff(p_values_sd[order]) <= 1e-12))
@@ -0,0 +1,125 @@
+import warnings
+
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+from nose.tools import assert_true, assert_raises, assert_equal
+from scipy import stats
+
+from mne import Epochs
+from mne.fiff.array import RawArray, create_info
+from mne.stats.regression import (linear_regression,
+                                  permutation_cluster_lm_test)
+
+warnings.simplefilter('always')
+
+
+def test_linear_regression():
+    """Test mass-univariate linear regression on arrays
+    """
+    rng = np.random.RandomState(42)
+    n_samples = 30
+    x = rng.randn(n_samples)
+    design_matrix = np.c_[np.ones(n_samples), x]
+    data = rng.randn(n_samples, 4, 5)
+    data[:, 0, 0] += 3 * x
+
+    lm = linear_regression(data, design_matrix, names=['intercept', 'x'])
+    assert_equal(sorted(lm.keys()), ['intercept', 'x'])
+    for field in lm['x']:
+        assert_equal(field.shape, (4, 5))
+    for ii in range(4):
+        for jj in range(5):
+            slope, intercept, _, p_val, stderr = \
+                stats.linregress(x, data[:, ii, jj])
+            assert_array_almost_equal(lm['x'].beta[ii, jj], slope)
+            assert_array_almost_equal(lm['intercept'].beta[ii, jj], intercept)
+            assert_array_almost_equal(lm['x'].stderr[ii, jj], stderr)
+            assert_array_almost_equal(lm['x'].p_val[ii, jj], p_val)
+    assert_array_almost_equal(lm['x'].mlog10_p_val,
+                              -np.log10(lm['x'].p_val))
+    assert_true(lm['x'].p_val[0, 0] < 1e-6)
+
+    # blockwise computation gives the same results
+    lm_buff = linear_regression(data, design_matrix, names=['intercept', 'x'],
+                                buffer_size=3)
+    for a, b in zip(lm['x'], lm_buff['x']):
+        assert_array_almost_equal(a, b)
+
+    # default names
+    assert_equal(sorted(linear_regression(data, design_matrix).keys()),
+                 ['x0', 'x1'])
+
+    assert_raises(ValueError, linear_regression, data, design_matrix[:-1])
+    assert_raises(ValueError, linear_regression, data, design_matrix,
+                  names=['x'])
+    assert_raises(ValueError, linear_regression, data,
+                  np.c_[design_matrix, 2 * x])
+    assert_raises(ValueError, linear_regression, data[:2],
+                  design_matrix[:2])
+
+
+def test_linear_regression_epochs():
+    """Test single-trial regression on epochs
+    """
+    rng = np.random.RandomState(42)
+    n_channels, sfreq = 5, 100.
+    info = create_info(['EEG %03d' % ii for ii in range(n_channels)], sfreq,
+                       ['eeg'] * n_channels)
+    raw = RawArray(rng.randn(n_channels, 2000), info)
+    events = np.c_[np.arange(100, 1900, 100), np.zeros(18, int),
+                   np.ones(18, int)]
+    epochs = Epochs(raw, events, None, -0.1, 0.2, baseline=None,
+                    preload=True)
+    n_epochs = len(epochs)
+    design_matrix = np.c_[np.ones(n_epochs), np.arange(n_epochs)]
+    # the intercept of a centered regressor is the average
+    design_matrix[:, 1] -= design_matrix[:, 1].mean()
+    lm = linear_regression(epochs, design_matrix, ['intercept', 'trial'])
+    evoked = epochs.average()
+    assert_array_almost_equal(lm['intercept'].beta.data, evoked.data)
+    assert_equal(lm['trial'].t_val.ch_names, evoked.ch_names)
+    assert_equal(lm['trial'].t_val.comment, 'trial')
+    lm_array = linear_regression(epochs.get_data(), design_matrix)
+    assert_array_almost_equal(lm['trial'].t_val.data, lm_array['x1'].t_val)
+
+
+def test_permutation_cluster_lm_test():
+    """Test Freedman-Lane cluster permutation test
+    """
+    rng = np.random.RandomState(0)
+    n_samples, n_times = 40, 50
+    x = rng.randn(n_samples)
+    nuisance = rng.randn(n_samples)
+    design_matrix = np.c_[np.ones(n_samples), x, nuisance]
+    data = rng.randn(n_samples, n_times)
+    data[:, 20:30] += x[:, np.newaxis]
+    data += 5 * nuisance[:, np.newaxis]
+
+    T_obs, clusters, cluster_pv, H0 = \
+        permutation_cluster_lm_test(data, design_matrix, regressor=1,
+                                    n_permutations=100, seed=0)
+    lm = linear_regression(data, design_matrix)
+    assert_array_almost_equal(T_obs, lm['x1'].t_val)
+    assert_equal(len(H0), 100)
+    assert_true(np.min(cluster_pv) < 0.05)
+    sig = clusters[np.argmin(cluster_pv)][0]
+    assert_true(sig.start >= 15 and sig.stop <= 35)
+
+    # the result does not depend on the block size
+    out = permutation_cluster_lm_test(data, design_matrix, regressor=1,
+                                      n_permutations=100, seed=0,
+                                      buffer_size=7)
+    assert_array_almost_equal(T_obs, out[0])
+    assert_array_almost_equal(H0, out[3])
+
+    # no nuisance regressor at all
+    out = permutation_cluster_lm_test(data - 5 * nuisance[:, np.newaxis],
+                                      x[:, np.newaxis] - x.mean(),
+                                      n_permutations=10, seed=0)
+    assert_equal(out[0].shape, (n_times,))
+
+    assert_raises(ValueError, permutation_cluster_lm_test, data,
+                  design_matrix, regressor=3)
+    assert_raises(ValueError, permutation_cluster_lm_test, data,
+                  design_matrix, out_type='foo')
+
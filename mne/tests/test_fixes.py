@@ -6,12 +6,13 @@
 import numpy as np
 
 from nose.tools import assert_equal
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_array_almost_equal
 from distutils.version import LooseVersion
 from scipy import signal
 
 from ..fixes import (_in1d, _tril_indices, _copysign, _unravel_index,
-                     _Counter, _unique, _bincount)
+                     _Counter, _unique, _bincount, _stacked_eigh,
+                     _stacked_svd)
 from ..fixes import _firwin2 as mne_firwin2
 from ..fixes import _filtfilt as mne_filtfilt
 
@@ -112,6 +113,22 @@ def test_copysign():
     assert_array_equal(_copysign(b, a), a)
 
 
+def test_stacked_linalg():
+    """Test replacements of linalg functions on stacks of matrices"""
+    rng = np.random.RandomState(0)
+    a = rng.randn(4, 3, 3)
+    a_sym = np.array([np.dot(m, m.T) for m in a])
+    vals, vecs = _stacked_eigh(a_sym)
+    for m, val, vec in zip(a_sym, vals, vecs):
+        val_m, vec_m = np.linalg.eigh(m)
+        assert_array_almost_equal(val, val_m)
+        assert_array_almost_equal(np.abs(vec), np.abs(vec_m))
+    u, s, vh = _stacked_svd(a)
+    assert_equal(s.shape, (4, 3))
+    for m, this_u, this_s, this_vh in zip(a, u, s, vh):
+        assert_array_almost_equal(np.dot(this_u * this_s, this_vh), m)
+
+
 def test_firwin2():
     """Test firwin2 backport
     """
@@ -16,7 +16,8 @@ from mne import (stats, SourceEstimate, VolSourceEstimate, Label,
 from mne import read_source_estimate, morph_data, extract_label_time_course
 from mne.source_estimate import (spatio_temporal_tris_connectivity,
                                  spatio_temporal_src_connectivity,
-                                 compute_morph_matrix, grade_to_vertices)
+                                 compute_morph_matrix, grade_to_vertices,
+                                 SpatioTemporalConnectivity)
 
 from mne.minimum_norm import read_inverse_operator
 from mne.label import read_annot, label_sign_flip
@@ -313,6 +314,43 @@ def test_extract_label_time_course():
     assert_true(x.size == 0)
 
 
+def test_extract_label_time_course_kernel():
+    """Test extraction of label time courses from inverse kernels
+    """
+    rng = np.random.RandomState(0)
+    n_sensors, n_times = 10, 20
+    vertices = [np.arange(0, 60, 2), np.arange(0, 40, 2)]
+    src = [dict(vertno=v, nn=rng.randn(100, 3)) for v in vertices]
+    n_verts = len(vertices[0]) + len(vertices[1])
+    labels = [Label(vertices=np.arange(10, 30), hemi='lh'),
+              Label(vertices=np.arange(5, 40, 3), hemi='rh'),
+              Label(vertices=[1, 3, 5], hemi='lh'),  # no source space vertex
+              Label(vertices=np.arange(3, 17), hemi='lh')]
+    kernel = rng.randn(n_verts, n_sensors)
+    stcs_kernel, stcs = list(), list()
+    for ii in range(3):
+        sens_data = rng.randn(n_sensors, n_times)
+        stcs_kernel.append(SourceEstimate((kernel, sens_data), vertices, 0, 1))
+        stcs.append(SourceEstimate(np.dot(kernel, sens_data), vertices, 0, 1))
+    for mode in ['mean', 'mean_flip']:
+        tc_kernel = extract_label_time_course(stcs_kernel, labels, src,
+                                              mode=mode, allow_empty=True)
+        tc = extract_label_time_course(stcs, labels, src, mode=mode,
+                                       allow_empty=True)
+        for tc1, tc2, stc in zip(tc_kernel, tc, stcs):
+            assert_equal(tc1.shape, (len(labels), n_times))
+            assert_array_almost_equal(tc1, tc2)
+            assert_array_equal(tc1[2], np.zeros(n_times))
+            idx = np.searchsorted(vertices[0], np.arange(10, 30, 2))
+            flip = 1.
+            if mode == 'mean_flip':
+                flip = label_sign_flip(labels[0], src)[:, None]
+            assert_array_almost_equal(tc1[0],
+                                      np.mean(flip * stc.data[idx], axis=0))
+    # the source data were never computed
+    assert_true(all(stc._kernel is not None for stc in stcs_kernel))
+
+
 @sample.requires_sample_data
 def test_morph_data():
     """Test morphing of data
@@ -472,6 +510,16 @@ def test_spatio_temporal_tris_connectivity():
     for c, n in zip(components, new_fmt):
         assert_array_equal(c, n)
 
+    # compact representation only stores the spatial graph
+    compact = spatio_temporal_tris_connectivity(tris, 2, compact=True)
+    assert_true(isinstance(compact, SpatioTemporalConnectivity))
+    assert_equal(compact.shape, connectivity.shape)
+    assert_equal(compact.spatial.shape, (6, 6))
+    assert_array_equal(compact.todense(), connectivity.todense())
+    assert_true(compact.neighbors is compact.neighbors)  # cached
+    assert_true('6 vertices x 2 times' in repr(compact))
+    assert_raises(ValueError, SpatioTemporalConnectivity, np.eye(3), 2)
+
 
 @sample.requires_sample_data
 def test_spatio_temporal_src_connectivity():
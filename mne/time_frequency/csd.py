@@ -11,7 +11,8 @@ from scipy.fftpack import fftfreq
 from ..fiff.pick import pick_types
 from ..utils import logger, verbose
 from ..time_frequency.multitaper import (dpss_windows, _mt_spectra,
-                                         _csd_from_mt, _psd_from_mt_adaptive)
+                                         _psd_from_mt_adaptive)
+from ..time_frequency.tfr import _check_complex_dtype
 
 
 class CrossSpectralDensity(object):
@@ -55,7 +56,7 @@ class CrossSpectralDensity(object):
 def compute_epochs_csd(epochs, mode='multitaper', fmin=0, fmax=np.inf,
                        fsum=True, tmin=None, tmax=None, n_fft=None,
                        mt_bandwidth=None, mt_adaptive=False, mt_low_bias=True,
-                       projs=None, verbose=None):
+                       projs=None, dtype=np.complex128, verbose=None):
     """Estimate cross-spectral density from epochs
 
     Note: Baseline correction should be used when creating the Epochs.
@@ -98,6 +99,9 @@ def compute_epochs_csd(epochs, mode='multitaper', fmin=0, fmax=np.inf,
     projs : list of Projection | None
         List of projectors to use in CSD calculation, or None to indicate that
         the projectors from the epochs should be inherited.
+    dtype : np.complex128 | np.complex64
+        The dtype of the spectra and of the cross-spectral density. Use
+        np.complex64 to halve the memory used at the expense of precision.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
@@ -135,124 +139,221 @@ def compute_epochs_csd(epochs, mode='multitaper', fmin=0, fmax=np.inf,
     ch_names = [epochs.ch_names[k] for k in picks_meeg]
 
     # Preparing time window slice
+    tslice = _time_window_slice(epochs.times, tmin, tmax)
+    n_times = len(epochs.times[tslice])
+    n_fft = n_times if n_fft is None else n_fft
+
+    logger.info('Computing cross-spectral density from epochs...')
+    csds, frequencies, _ = _compute_csd_windows(epochs, picks_meeg, [tslice],
+        [(fmin, fmax)], mode=mode, n_fft=n_fft, fsum=fsum,
+        mt_bandwidth=mt_bandwidth, mt_adaptive=mt_adaptive,
+        mt_low_bias=mt_low_bias, dtype=dtype)
+    csds, frequencies = csds[0], frequencies[0]
+    logger.info('[done]')
+
+    # Summing over frequencies of interest or returning a list of separate CSD
+    # matrices for each frequency
+    if fsum is True:
+        csd = CrossSpectralDensity(csds[0], ch_names, projs,
+                                   epochs.info['bads'],
+                                   frequencies=frequencies[0], n_fft=n_fft)
+        return csd
+    else:
+        csds_out = []
+        for this_csd, this_freq in zip(csds, frequencies):
+            csds_out.append(CrossSpectralDensity(this_csd, ch_names, projs,
+                                                 epochs.info['bads'],
+                                                 frequencies=this_freq,
+                                                 n_fft=n_fft))
+        return csds_out
+
+
+def _time_window_slice(times, tmin, tmax):
+    """Get the slice of the samples between tmin and tmax"""
     tstart, tend = None, None
     if tmin is not None:
-        tstart = np.where(epochs.times >= tmin)[0][0]
+        tstart = np.where(times >= tmin)[0][0]
     if tmax is not None:
-        tend = np.where(epochs.times <= tmax)[0][-1] + 1
-    tslice = slice(tstart, tend, None)
-    n_times = len(epochs.times[tslice])
-    n_fft = n_times if n_fft is None else n_fft
+        tend = np.where(times <= tmax)[0][-1] + 1
+    return slice(tstart, tend, None)
 
-    # Preparing frequencies of interest
-    sfreq = epochs.info['sfreq']
-    frequencies = fftfreq(n_fft, 1. / sfreq)
-    freq_mask = (frequencies > fmin) & (frequencies < fmax)
-    frequencies = frequencies[freq_mask]
-    n_freqs = len(frequencies)
 
-    if n_freqs == 0:
-        raise ValueError('No discrete fourier transform results within '
-                         'the given frequency window. Please widen either '
-                         'the frequency window or the time window')
+def _compute_csd_windows(epochs, picks, tslices, freq_bins, mode='multitaper',
+                         n_fft=None, fsum=True, mt_bandwidth=None,
+                         mt_adaptive=False, mt_low_bias=True,
+                         dtype=np.complex128):
+    """Compute CSD matrices for several time windows and frequency bins
 
-    # Preparing for computing CSD
-    logger.info('Computing cross-spectral density from epochs...')
-    if mode == 'multitaper':
-        # Compute standardized half-bandwidth
-        if mt_bandwidth is not None:
-            half_nbw = float(mt_bandwidth) * n_times / (2 * sfreq)
-        else:
-            half_nbw = 2
-
-        # Compute DPSS windows
-        n_tapers_max = int(2 * half_nbw)
-        window_fun, eigvals = dpss_windows(n_times, half_nbw, n_tapers_max,
-                                           low_bias=mt_low_bias)
-        n_tapers = len(eigvals)
-        logger.info('    using multitaper spectrum estimation with %d DPSS '
-                    'windows' % n_tapers)
-
-        if mt_adaptive and len(eigvals) < 3:
-            warnings.warn('Not adaptively combining the spectral estimators '
-                          'due to a low number of tapers.')
-            mt_adaptive = False
-    elif mode == 'fourier':
-        logger.info('    using FFT with a Hanning window to estimate spectra')
-        window_fun = np.hanning(n_times)
-        mt_adaptive = False
-        eigvals = 1.
-        n_tapers = None
-    else:
-        raise ValueError('Mode has an invalid value.')
+    Each epoch is read once and the tapered spectra are computed once per
+    epoch and time window. The CSD matrices of all frequencies of interest
+    are obtained from them with one matrix product per frequency and summed
+    for each frequency bin.
 
-    csds_mean = np.zeros((len(ch_names), len(ch_names), n_freqs),
-                         dtype=complex)
+    Parameters
+    ----------
+    epochs : instance of Epochs
+        The epochs.
+    picks : array of int
+        The channels to use.
+    tslices : list of slice
+        The time windows.
+    freq_bins : list of tuple of float
+        The (fmin, fmax) frequency bins, the frequencies strictly between
+        fmin and fmax are used.
+    mode : 'multitaper' | 'fourier'
+        Spectrum estimation mode.
+    n_fft : int | None
+        Length of the FFT. If None the number of samples of each time window
+        is used.
+    fsum : bool
+        If True, sum the CSD over the frequencies of each bin. If False, the
+        CSD of each frequency is returned (only a single bin is allowed).
+    mt_bandwidth, mt_adaptive, mt_low_bias :
+        Multitaper parameters, see compute_epochs_csd.
+    dtype : np.complex128 | np.complex64
+        The dtype of the spectra and CSDs.
+
+    Returns
+    -------
+    csds : list of array, shape=(n_bins, n_channels, n_channels)
+        The CSD matrices averaged over epochs for each time window. With
+        fsum=False, the first dimension corresponds to the frequencies.
+    frequencies : list of list of array
+        The frequencies for each time window and bin.
+    n_epochs : int
+        The number of epochs used.
+    """
+    if not fsum and len(freq_bins) != 1:
+        raise ValueError('fsum=False is only supported for a single bin')
+    dtype, _ = _check_complex_dtype(dtype)
+    sfreq = epochs.info['sfreq']
+    n_channels = len(picks)
+
+    # prepare the tapers and frequencies of each time window
+    windows = list()
+    for tslice in tslices:
+        n_times = len(epochs.times[tslice])
+        this_n_fft = n_times if n_fft is None else n_fft
+        freqs = fftfreq(this_n_fft, 1. / sfreq)
+        freqs = freqs[freqs >= 0]
+        bin_masks = [(freqs > fmin) & (freqs < fmax)
+                     for fmin, fmax in freq_bins]
+        if any(not np.any(mask) for mask in bin_masks):
+            raise ValueError('No discrete fourier transform results within '
+                             'the given frequency window. Please widen either '
+                             'the frequency window or the time window')
+        # the frequencies needed by any bin
+        freq_mask = np.any(bin_masks, axis=0)
+        bin_idx = [np.where(mask[freq_mask])[0] for mask in bin_masks]
+        if not fsum:
+            bin_idx = [np.array([ii]) for ii in bin_idx[0]]
+
+        adaptive = mt_adaptive
+        if mode == 'multitaper':
+            # Compute standardized half-bandwidth
+            if mt_bandwidth is not None:
+                half_nbw = float(mt_bandwidth) * n_times / (2 * sfreq)
+            else:
+                half_nbw = 2
+
+            # Compute DPSS windows
+            n_tapers_max = int(2 * half_nbw)
+            window_fun, eigvals = dpss_windows(n_times, half_nbw,
+                                               n_tapers_max,
+                                               low_bias=mt_low_bias)
+            logger.info('    using multitaper spectrum estimation with %d '
+                        'DPSS windows' % len(eigvals))
+
+            if adaptive and len(eigvals) < 3:
+                warnings.warn('Not adaptively combining the spectral '
+                              'estimators due to a low number of tapers.')
+                adaptive = False
+            weights = np.sqrt(eigvals)[np.newaxis, :, np.newaxis]
+            # Scaling by sampling frequency for compatibility with Matlab
+            scale = 1. / sfreq
+        elif mode == 'fourier':
+            logger.info('    using FFT with a Hanning window to estimate '
+                        'spectra')
+            window_fun = np.hanning(n_times)
+            adaptive = False
+            eigvals = 1.
+            weights = np.array([1.])[:, None, None]
+            # Scaling by number of samples and compensating for loss of power
+            # due to windowing (see section 11.5.2 in Bendat & Piersol).
+            scale = 8 / (3. * n_times * sfreq)
+        else:
+            raise ValueError('Mode has an invalid value.')
+        windows.append(dict(tslice=tslice, n_fft=this_n_fft,
+                            window_fun=window_fun, eigvals=eigvals,
+                            adaptive=adaptive, weights=weights, scale=scale,
+                            freq_mask=freq_mask, bin_idx=bin_idx,
+                            freqs=[freqs[freq_mask][idx] for idx in bin_idx]))
+
+    # sum over the epochs in double precision whatever the dtype of the
+    # spectra, like spectral_connectivity
+    csds = [np.zeros((len(w['bin_idx']), n_channels, n_channels),
+                     dtype=np.complex128) for w in windows]
 
     # Compute CSD for each epoch
     n_epochs = 0
     for epoch in epochs:
-        epoch = epoch[picks_meeg][:, tslice]
-
-        # Calculating Fourier transform using multitaper module
-        x_mt, _ = _mt_spectra(epoch, window_fun, sfreq, n_fft)
-
-        if mt_adaptive:
-            # Compute adaptive weights
-            _, weights = _psd_from_mt_adaptive(x_mt, eigvals, freq_mask,
-                                               return_weights=True)
-            # Tiling weights so that we can easily use _csd_from_mt()
-            weights = weights[:, np.newaxis, :, :]
-            weights = np.tile(weights, [1, x_mt.shape[0], 1, 1])
-        else:
-            # Do not use adaptive weights
-            if mode == 'multitaper':
-                weights = np.sqrt(eigvals)[np.newaxis, np.newaxis, :,
-                                           np.newaxis]
+        epoch = epoch[picks]
+        for w, csd in zip(windows, csds):
+            # Calculating Fourier transform using multitaper module
+            x_mt, _ = _mt_spectra(epoch[:, w['tslice']], w['window_fun'],
+                                  sfreq, w['n_fft'], dtype)
+            if w['adaptive']:
+                # Compute adaptive weights
+                _, weights = _psd_from_mt_adaptive(x_mt, w['eigvals'],
+                                                   w['freq_mask'],
+                                                   return_weights=True)
             else:
-                # Hack so we can sum over axis=-2
-                weights = np.array([1.])[:, None, None, None]
-
-        # Picking frequencies of interest
-        x_mt = x_mt[:, :, freq_mask]
-
-        # Calculating CSD
-        # Tiling x_mt so that we can easily use _csd_from_mt()
-        x_mt = x_mt[:, np.newaxis, :, :]
-        x_mt = np.tile(x_mt, [1, x_mt.shape[0], 1, 1])
-        y_mt = np.transpose(x_mt, axes=[1, 0, 2, 3])
-        weights_y = np.transpose(weights, axes=[1, 0, 2, 3])
-        csds_epoch = _csd_from_mt(x_mt, y_mt, weights, weights_y)
-
-        # Scaling by number of samples and compensating for loss of power due
-        # to windowing (see section 11.5.2 in Bendat & Piersol).
-        if mode == 'fourier':
-            csds_epoch /= n_times
-            csds_epoch *= 8 / 3.
-
-        # Scaling by sampling frequency for compatibility with Matlab
-        csds_epoch /= sfreq
-
-        csds_mean += csds_epoch
+                weights = w['weights']
+            x_mt = x_mt[:, :, w['freq_mask']]
+            csd += _csd_matrices_from_mt(x_mt, weights, w['bin_idx'],
+                                         w['scale'])
         n_epochs += 1
 
-    csds_mean /= n_epochs
+    csds = [(csd / n_epochs).astype(dtype) for csd in csds]
 
-    logger.info('[done]')
+    return csds, [w['freqs'] for w in windows], n_epochs
 
-    # Summing over frequencies of interest or returning a list of separate CSD
-    # matrices for each frequency
-    if fsum is True:
-        csd_mean_fsum = np.sum(csds_mean, 2)
-        csd = CrossSpectralDensity(csd_mean_fsum, ch_names, projs,
-                                   epochs.info['bads'],
-                                   frequencies=frequencies, n_fft=n_fft)
-        return csd
-    else:
-        csds = []
-        for i in range(n_freqs):
-            csds.append(CrossSpectralDensity(csds_mean[:, :, i], ch_names,
-                                             projs, epochs.info['bads'],
-                                             frequencies=frequencies[i],
-                                             n_fft=n_fft))
-        return csds
+
+def _csd_matrices_from_mt(x_mt, weights, bin_idx, scale=1.):
+    """Compute the CSD matrices of frequency bins from tapered spectra
+
+    Parameters
+    ----------
+    x_mt : array, shape=(n_channels, n_tapers, n_freqs)
+        The tapered spectra.
+    weights : array, shape=(n_channels or 1, n_tapers, n_freqs or 1)
+        The weights of the tapered spectra.
+    bin_idx : list of array
+        The frequency indices summed for each bin.
+    scale : float
+        Scaling factor applied to the CSDs.
+
+    Returns
+    -------
+    csd : array, shape=(n_bins, n_channels, n_channels)
+        The CSD matrices, equivalent to summing _csd_from_mt over the
+        frequencies of each bin for all pairs of channels.
+    """
+    n_channels, _, n_freqs = x_mt.shape
+    weights = np.asarray(weights, dtype=np.finfo(x_mt.dtype).dtype)
+    x_w = weights * x_mt
+    # (n_freqs, n_channels, n_tapers) for matrix products
+    x_w = np.ascontiguousarray(np.rollaxis(x_w, 2))
+    norm = np.sqrt(np.sum(np.abs(weights) ** 2, axis=-2))
+    norm = np.broadcast_arrays(norm, np.empty((n_channels, n_freqs)))[0]
+    norm = norm.T / np.sqrt(2. * scale)  # (n_freqs, n_channels)
+
+    csd_freqs = np.empty((n_freqs, n_channels, n_channels), dtype=x_w.dtype)
+    for f, (this_x_w, this_norm) in enumerate(zip(x_w, norm)):
+        this_x_w = this_x_w / this_norm[:, np.newaxis]
+        csd_freqs[f] = np.dot(this_x_w, this_x_w.conj().T)
+
+    csd = np.empty((len(bin_idx), n_channels, n_channels), dtype=x_w.dtype)
+    for b, idx in enumerate(bin_idx):
+        csd[b] = np.sum(csd_freqs[idx], axis=0)
+    return csd
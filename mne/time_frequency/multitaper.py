@@ -3,12 +3,18 @@
 
 # Parts of this code were copied from NiTime http://nipy.sourceforge.net/nitime
 from warnings import warn
+import os
+import os.path as op
+import errno
+import tempfile
+from zipfile import BadZipfile
 
 import numpy as np
 from scipy import fftpack, linalg, interpolate
 
 from ..parallel import parallel_func
-from ..utils import verbose, sum_squared
+from ..utils import logger, verbose, sum_squared, get_config
+from .tfr import _check_complex_dtype
 
 
 def tridisolve(d, e, b, overwrite_b=True):
@@ -140,6 +146,16 @@ def dpss_windows(N, half_nbw, Kmax, low_bias=True, interp_from=None,
 
     Notes
     -----
+    The windows are cached (least recently used sets are dropped first), so
+    repeated calls with the same N, half_nbw and Kmax do not solve the
+    eigenvalue problem again. If the MNE_CACHE_DPSS config value is 'true'
+    and MNE_CACHE_DIR is set, the windows are also stored in a "dpss"
+    subdirectory of MNE_CACHE_DIR and reused by later sessions. For long
+    sequences (N >= 16384) without cached windows, the windows are
+    interpolated from a cached set with the same half_nbw and a longer N
+    if there is one. Interpolated windows are only kept in memory and are
+    never used in place of exactly computed ones.
+
     Tridiagonal form of DPSS calculation from:
 
     Slepian, D. Prolate spheroidal wave functions, Fourier analysis, and
@@ -147,6 +163,146 @@ def dpss_windows(N, half_nbw, Kmax, low_bias=True, interp_from=None,
     Volume 57 (1978), 1371430
     """
     Kmax = int(Kmax)
+    N = int(N)
+    if interp_from is not None:
+        dpss, eigvals = _compute_dpss(N, half_nbw, Kmax, interp_from,
+                                      interp_kind)
+    else:
+        dpss, eigvals = _get_dpss(N, half_nbw, Kmax)
+        dpss, eigvals = dpss.copy(), eigvals.copy()
+
+    if low_bias:
+        idx = (eigvals > 0.9)
+        dpss, eigvals = dpss[idx], eigvals[idx]
+
+    return dpss, eigvals
+
+
+# cache of the DPSS windows, keys are (N, half_nbw, Kmax, interpolated), the
+# order of the keys in _dpss_cache_order is the order of use
+_dpss_cache = dict()
+_dpss_cache_order = list()
+_dpss_cache_max_bytes = 2 ** 27
+_dpss_interp_min_n = 2 ** 14
+
+
+def _clear_dpss_cache():
+    """Empty the memory cache of DPSS windows"""
+    _dpss_cache.clear()
+    del _dpss_cache_order[:]
+
+
+def _dpss_cache_fname(key):
+    """Get the file used to store DPSS windows or None if not persistent"""
+    cache_dir = get_config('MNE_CACHE_DIR')
+    if cache_dir is None or get_config('MNE_CACHE_DPSS',
+                                       'false').lower() != 'true':
+        return None
+    return op.join(cache_dir, 'dpss', 'dpss_%d_%r_%d.npz' % key[:3])
+
+
+def _store_dpss(key, dpss, eigvals):
+    """Add DPSS windows to the cache and drop the least recently used"""
+    if key in _dpss_cache:
+        _dpss_cache_order.remove(key)
+    _dpss_cache[key] = (dpss, eigvals)
+    _dpss_cache_order.append(key)
+    n_bytes = sum(_dpss_cache[k][0].nbytes for k in _dpss_cache_order)
+    while n_bytes > _dpss_cache_max_bytes and len(_dpss_cache_order) > 1:
+        old_key = _dpss_cache_order.pop(0)
+        n_bytes -= _dpss_cache.pop(old_key)[0].nbytes
+
+
+def _use_cached_dpss(key, Kmax):
+    """Get the first Kmax windows of a cached set and mark it as used"""
+    _store_dpss(key, *_dpss_cache[key])
+    dpss, eigvals = _dpss_cache[key]
+    return dpss[:Kmax], eigvals[:Kmax]
+
+
+def _get_dpss(N, half_nbw, Kmax):
+    """Get DPSS windows (without low bias selection) using the cache"""
+    key = (N, float(half_nbw), Kmax, False)
+    # a cached set with more windows has the windows we need, exact sets are
+    # preferred to interpolated ones
+    keys = [k for k in _dpss_cache_order if k[:2] == key[:2]
+            and k[2] >= Kmax]
+    keys.sort(key=lambda k: k[3])
+    if len(keys) > 0 and not keys[0][3]:
+        return _use_cached_dpss(keys[0], Kmax)
+
+    fname = _dpss_cache_fname(key)
+    data = _read_dpss_cache(fname)
+    if data is not None:
+        _store_dpss(key, *data)
+        return data
+
+    if len(keys) > 0:
+        return _use_cached_dpss(keys[0], Kmax)
+
+    # interpolate from the shortest longer exact set for long sequences,
+    # interpolated sets are only kept in memory under their own keys
+    longer = [k for k in _dpss_cache_order if k[1] == key[1] and k[0] > N
+              and k[2] >= Kmax and not k[3]]
+    if N >= _dpss_interp_min_n and len(longer) > 0:
+        long_key = min(longer)
+        logger.debug('Interpolating DPSS windows from N=%d' % long_key[0])
+        long_dpss = _dpss_cache[long_key][0][:Kmax]
+        interp = interpolate.interp1d(np.linspace(0, 1, long_key[0]),
+                                      long_dpss, axis=-1)
+        dpss = interp(np.linspace(0, 1, N))
+        dpss /= np.sqrt(np.sum(dpss ** 2, axis=1))[:, np.newaxis]
+        dpss, eigvals = _dpss_eigvals(dpss, float(half_nbw) / N)
+        _store_dpss(key[:3] + (True,), dpss, eigvals)
+        return dpss, eigvals
+
+    dpss, eigvals = _compute_dpss(N, half_nbw, Kmax)
+    _store_dpss(key, dpss, eigvals)
+    _write_dpss_cache(fname, dpss, eigvals)
+    return dpss, eigvals
+
+
+def _read_dpss_cache(fname):
+    """Read DPSS windows from the disk cache if they are there"""
+    if fname is None or not op.isfile(fname):
+        return None
+    logger.debug('Reading DPSS windows from %s' % fname)
+    try:
+        data = np.load(fname)
+        try:
+            return data['dpss'], data['eigvals']
+        finally:
+            data.close()
+    except (IOError, ValueError, EOFError, KeyError, BadZipfile):
+        logger.debug('Could not read %s, computing the windows' % fname)
+        return None
+
+
+def _write_dpss_cache(fname, dpss, eigvals):
+    """Store DPSS windows in the disk cache
+
+    The cache may be shared by concurrent jobs, so the windows are written
+    to a temporary file which is then renamed.
+    """
+    if fname is None:
+        return
+    cache_dir = op.dirname(fname)
+    try:
+        os.makedirs(cache_dir)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    fd, tmp_fname = tempfile.mkstemp(suffix='.npz', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as fid:
+            np.savez(fid, dpss=dpss, eigvals=eigvals)
+        os.rename(tmp_fname, fname)
+    except OSError:  # e.g. written by another job on Windows
+        os.remove(tmp_fname)
+
+
+def _compute_dpss(N, half_nbw, Kmax, interp_from=None, interp_kind='linear'):
+    """Compute DPSS windows (without low bias selection)"""
     W = float(half_nbw) / N
     nidx = np.arange(N, dtype='d')
 
@@ -211,6 +367,13 @@ def dpss_windows(N, half_nbw, Kmax, low_bias=True, interp_from=None,
             dpss[k] = tridi_inverse_iteration(diagonal, off_diag, w[k],
                                               x0=np.sin((k + 1) * t))
 
+    return _dpss_eigvals(dpss, W)
+
+
+def _dpss_eigvals(dpss, W):
+    """Fix the signs of DPSS windows and compute their eigenvalues"""
+    N = dpss.shape[1]
+    nidx = np.arange(N, dtype='d')
     # By convention (Percival and Walden, 1993 pg 379)
     # * symmetric tapers (k=0,2,4,...) should have a positive average.
     # * antisymmetric tapers should begin with a positive lobe
@@ -237,10 +400,6 @@ def dpss_windows(N, half_nbw, Kmax, low_bias=True, interp_from=None,
     r[0] = 2 * W
     eigvals = np.dot(dpss_rxx, r)
 
-    if low_bias:
-        idx = (eigvals > 0.9)
-        dpss, eigvals = dpss[idx], eigvals[idx]
-
     return dpss, eigvals
 
 
@@ -374,6 +533,8 @@ def _psd_from_mt(x_mt, weights):
         The computed PSD
     """
 
+    # use the precision of the spectra
+    weights = np.asarray(weights, dtype=np.finfo(x_mt.dtype).dtype)
     psd = np.sum(np.abs(weights * x_mt) ** 2, axis=-2)
     psd *= 2 / np.sum(np.abs(weights) ** 2, axis=-2)
 
@@ -400,6 +561,10 @@ def _csd_from_mt(x_mt, y_mt, weights_x, weights_y):
         The computed PSD
     """
 
+    # use the precision of the spectra
+    real_dtype = np.finfo(x_mt.dtype).dtype
+    weights_x = np.asarray(weights_x, dtype=real_dtype)
+    weights_y = np.asarray(weights_y, dtype=real_dtype)
     csd = np.sum(weights_x * x_mt * (weights_y * y_mt).conj(), axis=-2)
 
     denom = (np.sqrt(np.sum(np.abs(weights_x) ** 2, axis=-2))
@@ -410,7 +575,7 @@ def _csd_from_mt(x_mt, y_mt, weights_x, weights_y):
     return csd
 
 
-def _mt_spectra(x, dpss, sfreq, n_fft=None):
+def _mt_spectra(x, dpss, sfreq, n_fft=None, dtype=np.complex128):
     """ Compute tapered spectra
 
     Parameters
@@ -424,6 +589,9 @@ def _mt_spectra(x, dpss, sfreq, n_fft=None):
     n_fft : int | None
         Length of the FFT. If None, the number of samples in the input signal
         will be used.
+    dtype : np.complex128 | np.complex64
+        The dtype of the tapered spectra. With np.complex64 the tapering and
+        the FFTs are computed in single precision.
 
     Returns
     -------
@@ -436,6 +604,10 @@ def _mt_spectra(x, dpss, sfreq, n_fft=None):
     if n_fft is None:
         n_fft = x.shape[1]
 
+    dtype, real_dtype = _check_complex_dtype(dtype)
+    x = x.astype(dtype if np.iscomplexobj(x) else real_dtype, copy=False)
+    dpss = dpss.astype(real_dtype, copy=False)
+
     # remove mean (do not use in-place subtraction as it may modify input x)
     x = x - np.mean(x, axis=-1)[:, np.newaxis]
     x_mt = fftpack.fft(x[:, np.newaxis, :] * dpss, n=n_fft)
@@ -450,9 +622,29 @@ def _mt_spectra(x, dpss, sfreq, n_fft=None):
     return x_mt, freqs
 
 
+def _psd_from_mt_segments(x, dpss, eigvals, sfreq, freq_mask, adaptive):
+    """Sum the multitaper PSDs of consecutive segments of x
+
+    The segments have the length of the tapers and the tapered spectra
+    are only computed for one segment at a time.
+    """
+    n_per_seg = dpss.shape[1]
+    weights = np.sqrt(eigvals)[np.newaxis, :, np.newaxis]
+    psd = np.zeros((x.shape[0], np.sum(freq_mask)))
+    for start in range(0, x.shape[1] - n_per_seg + 1, n_per_seg):
+        x_mt, _ = _mt_spectra(x[:, start:start + n_per_seg], dpss, sfreq)
+        if adaptive:
+            psd += _psd_from_mt_adaptive(x_mt, eigvals, freq_mask)
+        else:
+            psd += _psd_from_mt(x_mt[:, :, freq_mask], weights)
+        del x_mt
+    return psd
+
+
 @verbose
 def multitaper_psd(x, sfreq=2 * np.pi, fmin=0, fmax=np.inf, bandwidth=None,
-                   adaptive=False, low_bias=True, n_jobs=1, verbose=None):
+                   adaptive=False, low_bias=True, n_jobs=1, n_per_seg=None,
+                   verbose=None):
     """Compute power spectrum density (PSD) using a multi-taper method
 
     Parameters
@@ -474,7 +666,17 @@ def multitaper_psd(x, sfreq=2 * np.pi, fmin=0, fmax=np.inf, bandwidth=None,
         Only use tapers with more than 90% spectral concentration within
         bandwidth.
     n_jobs : int
-        Number of parallel jobs to use (only used if adaptive=True).
+        Number of parallel jobs to use (only used if adaptive=True or
+        n_per_seg is not None).
+    n_per_seg : int | None
+        If not None, the PSD is the average of the multitaper PSDs of
+        consecutive non-overlapping segments of n_per_seg samples (samples
+        after the last complete segment are ignored). The tapers are
+        computed once for the segment length and only the tapered spectra
+        of one segment are held in memory at a time, which makes it
+        possible to process long recordings (e.g. a memory-mapped array).
+        The segments are processed in parallel if n_jobs > 1. If None,
+        the PSD is computed from the whole signal.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
@@ -491,6 +693,14 @@ def multitaper_psd(x, sfreq=2 * np.pi, fmin=0, fmax=np.inf, bandwidth=None,
     x_in = np.atleast_2d(x)
 
     n_times = x_in.shape[1]
+    if n_per_seg is not None:
+        n_per_seg = int(n_per_seg)
+        if not 0 < n_per_seg <= n_times:
+            raise ValueError('n_per_seg must be positive and not larger '
+                             'than the number of time points (%d), got %d'
+                             % (n_times, n_per_seg))
+        n_segments = n_times // n_per_seg
+        n_times = n_per_seg
 
     # compute standardized half-bandwidth
     if bandwidth is not None:
@@ -503,6 +713,31 @@ def multitaper_psd(x, sfreq=2 * np.pi, fmin=0, fmax=np.inf, bandwidth=None,
     dpss, eigvals = dpss_windows(n_times, half_nbw, n_tapers_max,
                                  low_bias=low_bias)
 
+    if adaptive and len(eigvals) < 3:
+        warn('Not adaptively combining the spectral estimators '
+             'due to a low number of tapers.')
+        adaptive = False
+
+    if n_per_seg is not None:
+        logger.info('Computing multitaper PSD of %d segments of %d samples'
+                    % (n_segments, n_per_seg))
+        freqs = fftpack.fftfreq(n_per_seg, 1. / sfreq)
+        freqs = freqs[freqs >= 0]
+        freq_mask = (freqs >= fmin) & (freqs <= fmax)
+        # each job gets a contiguous range of segments
+        parallel, my_psd_from_mt_segments, n_jobs = \
+            parallel_func(_psd_from_mt_segments, n_jobs)
+        seg_idx = [idx for idx in np.array_split(np.arange(n_segments),
+                                                 n_jobs) if len(idx) > 0]
+        out = parallel(my_psd_from_mt_segments(
+                       x_in[:, idx[0] * n_per_seg:(idx[-1] + 1) * n_per_seg],
+                       dpss, eigvals, sfreq, freq_mask, adaptive)
+                       for idx in seg_idx)
+        psd = sum(out) / n_segments
+        if x.ndim == 1:
+            psd = psd[0, :]
+        return psd, freqs[freq_mask]
+
     # compute the tapered spectra
     x_mt, freqs = _mt_spectra(x_in, dpss, sfreq)
 
@@ -510,11 +745,6 @@ def multitaper_psd(x, sfreq=2 * np.pi, fmin=0, fmax=np.inf, bandwidth=None,
     freq_mask = (freqs >= fmin) & (freqs <= fmax)
 
     # combine the tapered spectra
-    if adaptive and len(eigvals) < 3:
-        warn('Not adaptively combining the spectral estimators '
-             'due to a low number of tapers.')
-        adaptive = False
-
     if not adaptive:
         x_mt = x_mt[:, :, freq_mask]
         weights = np.sqrt(eigvals)[np.newaxis, :, np.newaxis]
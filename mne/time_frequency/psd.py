@@ -3,23 +3,133 @@
 # License : BSD 3-clause
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy import signal
 
 from ..parallel import parallel_func
 from ..fiff.proj import make_projector_info
 from ..fiff.pick import pick_types
 from ..utils import logger, verbose
+from ..externals.six import string_types
+
+
+def _check_psd_window(window, n_fft):
+    """Aux function to get the window values"""
+    if isinstance(window, string_types):
+        if window == 'hanning':
+            # symmetric window for backward compatibility with plt.psd
+            window = np.hanning(n_fft)
+        else:
+            window = signal.get_window(window, n_fft)
+    window = np.asarray(window, dtype=np.float)
+    if window.shape != (n_fft,):
+        raise ValueError('window must have n_fft (%d) values, got shape %s'
+                         % (n_fft, window.shape))
+    return window
+
+
+def _welch_periodograms(data, n_fft, n_overlap, window):
+    """Compute the periodograms of all Welch segments at once
+
+    The segments are strided views on the data. Returns an array of shape
+    (n_signals, n_segments, n_freqs) that is not yet scaled.
+    """
+    data = np.ascontiguousarray(data, dtype=np.float)
+    n_signals, n_times = data.shape
+    step = n_fft - n_overlap
+    n_segments = (n_times - n_fft) // step + 1
+    segments = as_strided(data, shape=(n_signals, n_segments, n_fft),
+                          strides=(data.strides[0], step * data.strides[1],
+                                   data.strides[1]))
+    x_fft = np.fft.rfft(segments * window, axis=-1)
+    psd = x_fft.real ** 2
+    psd += x_fft.imag ** 2
+    return psd
+
+
+def _psd_welch_raw(raw, picks, start, stop, proj, n_fft, n_overlap, window,
+                   average, n_jobs):
+    """Welch PSD streamed over blocks of whole segments of raw data"""
+    step = n_fft - n_overlap
+    n_channels = len(picks)
+    n_times = stop - start
+    if n_times < n_fft:  # zero pad like plt.psd
+        n_segments = 1
+    else:
+        n_segments = (n_times - n_fft) // step + 1
+    n_freqs = n_fft // 2 + 1
+
+    parallel, my_periodograms, n_jobs = parallel_func(_welch_periodograms,
+                                                      n_jobs)
+    # read ~ 2 ** 22 samples of all channels at once
+    n_seg_block = max(1, int(2 ** 22 // (n_channels * n_fft)))
+    if average == 'mean':
+        psd = np.zeros((n_channels, n_freqs))
+    else:
+        psd = np.empty((n_channels, n_segments, n_freqs))
+    for seg_start in range(0, n_segments, n_seg_block):
+        n_seg = min(n_seg_block, n_segments - seg_start)
+        block_start = start + seg_start * step
+        block_stop = min(block_start + (n_seg - 1) * step + n_fft, stop)
+        data, _ = raw[picks, block_start:block_stop]
+        if proj is not None:
+            data = np.dot(proj, data)
+        if data.shape[1] < n_fft:
+            data = np.concatenate([data, np.zeros((n_channels, n_fft -
+                                                   data.shape[1]))], axis=1)
+        if n_jobs == 1:
+            this_psd = _welch_periodograms(data, n_fft, n_overlap, window)
+        else:
+            this_psd = np.concatenate(parallel(
+                my_periodograms(d, n_fft, n_overlap, window)
+                for d in np.array_split(data, n_jobs) if len(d) > 0))
+        if average == 'mean':
+            psd += this_psd.sum(axis=1)
+        else:
+            psd[:, seg_start:seg_start + n_seg] = this_psd
+        del this_psd
+    if average == 'mean':
+        psd /= n_segments
+    else:
+        psd = np.median(psd, axis=1) / _median_bias(n_segments)
+    return psd
+
+
+def _median_bias(n):
+    """Ratio of the median to the mean of n chi-square(2) distributed values
+
+    The periodograms follow this distribution for Gaussian noise, and for
+    large n the ratio tends to ln(2).
+    """
+    ii_2 = 2 * np.arange(1., (n - 1) // 2 + 1)
+    return 1 + np.sum(1. / (ii_2 + 1) - 1. / ii_2)
+
+
+def _scale_psd(psd, n_fft, Fs, window):
+    """Scale periodograms to one-sided power spectral densities"""
+    psd[..., 1:n_fft - n_fft // 2] *= 2.  # keep DC and Nyquist
+    psd /= Fs * np.sum(window ** 2)
+    return psd
 
 
 @verbose
 def compute_raw_psd(raw, tmin=0, tmax=np.inf, picks=None,
                     fmin=0, fmax=np.inf, NFFT=2048, n_jobs=1,
-                    plot=False, proj=False, verbose=None):
-    """Compute power spectral density with multi-taper
+                    plot=False, proj=False, n_overlap=0, window='hanning',
+                    average='mean', verbose=None):
+    """Compute power spectral density with Welch's method
+
+    The data are read in blocks, so the raw data do not need to be
+    preloaded, and the periodograms of all channels are computed at once.
 
     Parameters
     ----------
     raw : instance of Raw
         The raw data.
+    tmin : float
+        Min time instant to consider
+    tmax : float
+        Max time instant to consider
     picks : array-like of int | None
         The selection of channels to include in the computation.
         If None, take all channels.
@@ -36,6 +146,17 @@ def compute_raw_psd(raw, tmin=0, tmax=np.inf, picks=None,
         Plot each PSD estimates
     proj : bool
         Apply SSP projection vectors
+    n_overlap : int
+        The number of points of overlap between segments. Must be smaller
+        than NFFT.
+    window : str | array
+        The window applied to each segment. Can be 'hanning' (default),
+        any window name understood by scipy.signal.get_window or an array
+        of NFFT values.
+    average : 'mean' | 'median'
+        How to average the periodograms of the segments. The median is
+        more robust to transient artifacts. It is corrected for its bias
+        with respect to the mean of the periodograms of Gaussian noise.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
@@ -46,48 +167,61 @@ def compute_raw_psd(raw, tmin=0, tmax=np.inf, picks=None,
     freqs: array of float
         The frequencies
     """
+    NFFT = int(NFFT)
+    n_overlap = int(n_overlap)
+    if not 0 <= n_overlap < NFFT:
+        raise ValueError('n_overlap must be non-negative and smaller than '
+                         'NFFT, got %d' % n_overlap)
+    if average not in ('mean', 'median'):
+        raise ValueError("average must be 'mean' or 'median', got %s"
+                         % average)
+    window = _check_psd_window(window, NFFT)
+    Fs = raw.info['sfreq']
+
     start, stop = raw.time_as_index([tmin, tmax])
-    if picks is not None:
-        data, times = raw[picks, start:(stop + 1)]
-    else:
-        data, times = raw[:, start:(stop + 1)]
+    if not np.isfinite(tmax) or stop >= raw.n_times:
+        stop = raw.n_times - 1
+    stop += 1  # tmax is included
+    if picks is None:
+        picks = np.arange(raw.info['nchan'])
+    picks = np.asarray(picks)
 
     if proj:
         proj, _ = make_projector_info(raw.info)
-        if picks is not None:
-            data = np.dot(proj[picks][:, picks], data)
-        else:
-            data = np.dot(proj, data)
-
-    NFFT = int(NFFT)
-    Fs = raw.info['sfreq']
+        proj = proj[picks][:, picks]
+    else:
+        proj = None
 
     logger.info("Effective window size : %0.3f (s)" % (NFFT / float(Fs)))
 
-    import matplotlib.pyplot as plt
-    parallel, my_psd, n_jobs = parallel_func(plt.psd, n_jobs)
-    fig = plt.figure()
-    out = parallel(my_psd(d, Fs=Fs, NFFT=NFFT) for d in data)
-    if not plot:
-        plt.close(fig)
-    freqs = out[0][1]
-    psd = np.array([o[0] for o in out])
+    psd = _psd_welch_raw(raw, picks, start, stop, proj, NFFT, n_overlap,
+                         window, average, n_jobs)
+    psd = _scale_psd(psd, NFFT, Fs, window)
+    freqs = np.arange(NFFT // 2 + 1) * (Fs / NFFT)
 
     mask = (freqs >= fmin) & (freqs <= fmax)
     freqs = freqs[mask]
     psd = psd[:, mask]
 
+    if plot:
+        import matplotlib.pyplot as plt
+        plt.figure()
+        plt.plot(freqs, 10 * np.log10(psd.T))
+        plt.xlabel('Frequency')
+        plt.ylabel('Power Spectral Density (dB/Hz)')
+        plt.grid(True)
+
     return psd, freqs
 
 
-def _compute_psd(data, fmin, fmax, Fs, n_fft, psd):
-    """Compute the PSD"""
-    out = [psd(d, Fs=Fs, NFFT=n_fft) for d in data]
-    psd = np.array([o[0] for o in out])
-    freqs = out[0][1]
-    mask = (freqs >= fmin) & (freqs <= fmax)
-    freqs = freqs[mask]
-    return psd[:, mask], freqs
+def _compute_psd(data, n_fft, Fs, window, mask):
+    """Compute the Welch PSD of one epoch"""
+    if data.shape[1] < n_fft:
+        data = np.concatenate([data, np.zeros((len(data), n_fft -
+                                               data.shape[1]))], axis=1)
+    psd = _welch_periodograms(data, n_fft, 0, window).mean(axis=1)
+    psd = _scale_psd(psd, n_fft, Fs, window)
+    return psd[:, mask]
 
 
 @verbose
@@ -133,13 +267,10 @@ def compute_epochs_psd(epochs, picks=None, fmin=0, fmax=np.inf, n_fft=256,
                            exclude='bads')
 
     logger.info("Effective window size : %0.3f (s)" % (n_fft / float(Fs)))
-    psds = []
-    import matplotlib.pyplot as plt
+    window = _check_psd_window('hanning', n_fft)
+    freqs = np.arange(n_fft // 2 + 1) * (Fs / n_fft)
+    mask = (freqs >= fmin) & (freqs <= fmax)
     parallel, my_psd, n_jobs = parallel_func(_compute_psd, n_jobs)
-    fig = plt.figure()  # threading will induce errors otherwise
-    out = parallel(my_psd(data[picks], fmin, fmax, Fs, n_fft, plt.psd)
-                   for data in epochs)
-    plt.close(fig)
-    psds = [o[0] for o in out]
-    freqs = [o[1] for o in out]
-    return np.array(psds), freqs[0]
+    psds = parallel(my_psd(data[picks], n_fft, Fs, window, mask)
+                    for data in epochs)
+    return np.array(psds), freqs[mask]
@@ -161,3 +161,56 @@ def test_compute_epochs_csd_on_artificial_data():
                     delta = 0.004
                 assert_true(abs(signal_power_per_sample - mt_power_per_sample)
                             < delta)
+
+
+def test_compute_epochs_csd_dtype():
+    """Test CSD computation in single precision"""
+    from mne.fiff.array import RawArray, create_info
+    rng = np.random.RandomState(0)
+    info = create_info(['EEG %03d' % ii for ii in range(4)], 100.,
+                       ['eeg'] * 4)
+    raw = RawArray(rng.randn(4, 2000), info)
+    events = np.c_[np.arange(100, 1900, 100), np.zeros(18, int),
+                   np.ones(18, int)]
+    epochs = mne.Epochs(raw, events, 1, 0., 0.5, baseline=(None, 0),
+                        preload=True)
+    for mode in ['multitaper', 'fourier']:
+        csd = compute_epochs_csd(epochs, mode=mode, fmin=8, fmax=12)
+        csd_32 = compute_epochs_csd(epochs, mode=mode, fmin=8, fmax=12,
+                                    dtype=np.complex64)
+        assert_equal(csd.data.dtype, np.complex128)
+        assert_equal(csd_32.data.dtype, np.complex64)
+        assert_true(np.allclose(csd_32.data, csd.data, rtol=1e-4,
+                                atol=1e-5 * np.abs(csd.data).max()))
+    assert_raises(ValueError, compute_epochs_csd, epochs, dtype=np.float64)
+
+
+def test_compute_csd_windows():
+    """Test CSDs of several time windows and frequency bins in one pass"""
+    from mne.fiff.array import RawArray, create_info
+    from mne.time_frequency.csd import _compute_csd_windows, _time_window_slice
+    rng = np.random.RandomState(0)
+    info = create_info(['EEG %03d' % ii for ii in range(4)], 100.,
+                       ['eeg'] * 4)
+    raw = RawArray(rng.randn(4, 2000), info)
+    events = np.c_[np.arange(100, 1900, 100), np.zeros(18, int),
+                   np.ones(18, int)]
+    epochs = mne.Epochs(raw, events, 1, -0.2, 0.5, baseline=(None, 0),
+                        preload=True)
+    windows = [(-0.2, 0.2), (0.1, 0.5)]
+    freq_bins = [(5, 20), (15, 30)]
+    tslices = [_time_window_slice(epochs.times, tmin, tmax)
+               for tmin, tmax in windows]
+    for mode in ['multitaper', 'fourier']:
+        csds, freqs, n_epochs = _compute_csd_windows(epochs, np.arange(4),
+                                                     tslices, freq_bins,
+                                                     mode=mode)
+        assert_equal(n_epochs, len(epochs))
+        for (tmin, tmax), csd_win, freqs_win in zip(windows, csds, freqs):
+            assert_equal(csd_win.shape, (2, 4, 4))
+            for (fmin, fmax), csd, this_freqs in zip(freq_bins, csd_win,
+                                                     freqs_win):
+                csd_ref = compute_epochs_csd(epochs, mode=mode, fmin=fmin,
+                                             fmax=fmax, tmin=tmin, tmax=tmax)
+                assert_true(np.allclose(csd, csd_ref.data))
+                assert_true(np.allclose(this_freqs, csd_ref.frequencies))
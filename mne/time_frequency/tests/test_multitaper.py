@@ -1,8 +1,14 @@
 import numpy as np
 from numpy.testing import assert_array_almost_equal
+from nose.tools import assert_raises, assert_true
+import os
+import os.path as op
 
 from mne.time_frequency import dpss_windows, multitaper_psd
-from mne.utils import requires_nitime
+from mne.time_frequency import multitaper
+from mne.utils import requires_nitime, _TempDir
+
+tempdir = _TempDir()
 
 
 @requires_nitime
@@ -27,6 +33,100 @@ def test_dpss_windows():
     assert_array_almost_equal(eigs, eigs_ni)
 
 
+def test_dpss_cache():
+    """ Test caching of DPSS windows """
+    multitaper._clear_dpss_cache()
+    N, half_nbw, Kmax = 500, 4, 8
+    dpss, eigs = dpss_windows(N, half_nbw, Kmax, low_bias=False)
+    key = (N, float(half_nbw), Kmax, False)
+    assert_true(key in multitaper._dpss_cache)
+    dpss_cached, eigs_cached = dpss_windows(N, half_nbw, Kmax, low_bias=False)
+    assert_array_almost_equal(dpss, dpss_cached)
+    assert_array_almost_equal(eigs, eigs_cached)
+    # returned arrays are copies
+    dpss_cached *= 0
+    assert_array_almost_equal(dpss, dpss_windows(N, half_nbw, Kmax,
+                                                 low_bias=False)[0])
+    # fewer windows are taken from the cached set
+    dpss_low, eigs_low = dpss_windows(N, half_nbw, 4)
+    assert_array_almost_equal(dpss_low, dpss[:4])
+    assert_true(len(multitaper._dpss_cache) == 1)
+    multitaper._clear_dpss_cache()
+    assert_array_almost_equal(dpss_low, dpss_windows(N, half_nbw, 4)[0])
+
+    # least recently used sets are dropped
+    max_bytes = multitaper._dpss_cache_max_bytes
+    multitaper._dpss_cache_max_bytes = 2 * dpss.nbytes
+    try:
+        for this_N in (N, N - 1, N - 2):
+            dpss_windows(this_N, half_nbw, Kmax)
+        assert_true(key not in multitaper._dpss_cache)
+        assert_true(len(multitaper._dpss_cache) == 2)
+    finally:
+        multitaper._dpss_cache_max_bytes = max_bytes
+
+    # long windows are interpolated from a cached longer set
+    multitaper._clear_dpss_cache()
+    interp_min_n = multitaper._dpss_interp_min_n
+    multitaper._dpss_interp_min_n = 1000
+    try:
+        dpss_windows(3000, half_nbw, Kmax)
+        dpss_interp, eigs_interp = dpss_windows(2000, half_nbw, Kmax)
+        # interpolated sets are not stored as exact ones or interpolated
+        # again
+        assert_true((2000, float(half_nbw), Kmax, True)
+                    in multitaper._dpss_cache)
+        assert_true((2000, float(half_nbw), Kmax, False)
+                    not in multitaper._dpss_cache)
+        dpss_windows(1500, half_nbw, Kmax)
+        assert_true(all(k[0] != 1500 or k[3]
+                        for k in multitaper._dpss_cache))
+        dpss_windows(1500, half_nbw, Kmax)
+        multitaper._clear_dpss_cache()
+        dpss, eigs = dpss_windows(2000, half_nbw, Kmax)
+        assert_array_almost_equal(dpss_interp, dpss, decimal=3)
+        assert_array_almost_equal(eigs_interp, eigs)
+    finally:
+        multitaper._dpss_interp_min_n = interp_min_n
+
+    # persistent cache
+    keys = ('MNE_CACHE_DIR', 'MNE_CACHE_DPSS')
+    old_env = [os.environ.get(k) for k in keys]
+    os.environ['MNE_CACHE_DIR'] = tempdir
+    os.environ['MNE_CACHE_DPSS'] = 'true'
+    try:
+        multitaper._clear_dpss_cache()
+        dpss, eigs = dpss_windows(N, half_nbw, Kmax)
+        fname = op.join(tempdir, 'dpss', 'dpss_%d_%r_%d.npz' % key[:3])
+        assert_true(op.isfile(fname))
+        # interpolated sets are not written to disk
+        multitaper._dpss_interp_min_n = 100
+        dpss_windows(N - 100, half_nbw, Kmax)
+        assert_true(not op.isfile(op.join(tempdir, 'dpss', 'dpss_%d_%r_%d.npz'
+                                          % (N - 100, key[1], Kmax))))
+        multitaper._clear_dpss_cache()
+        dpss_disk, eigs_disk = dpss_windows(N, half_nbw, Kmax)
+        assert_array_almost_equal(dpss, dpss_disk)
+        assert_array_almost_equal(eigs, eigs_disk)
+        # truncated files are computed again
+        with open(fname, 'r+b') as fid:
+            fid.truncate(100)
+        multitaper._clear_dpss_cache()
+        dpss_disk, eigs_disk = dpss_windows(N, half_nbw, Kmax)
+        assert_array_almost_equal(dpss, dpss_disk)
+        multitaper._clear_dpss_cache()
+        assert_array_almost_equal(dpss, dpss_windows(N, half_nbw, Kmax)[0])
+        assert_true(len(os.listdir(op.dirname(fname))) == 1)
+    finally:
+        for k, v in zip(keys, old_env):
+            if v is None:
+                os.environ.pop(k)
+            else:
+                os.environ[k] = v
+        multitaper._dpss_interp_min_n = interp_min_n
+        multitaper._clear_dpss_cache()
+
+
 @requires_nitime
 def test_multitaper_psd():
     """ Test multi-taper PSD computation """
@@ -45,3 +145,29 @@ def test_multitaper_psd():
         # causing the value at 0 to be different
         assert_array_almost_equal(psd[:, 1:], psd_ni[:, 1:-1], decimal=3)
         assert_array_almost_equal(freqs, freqs_ni[:-1])
+
+
+def test_multitaper_psd_segments():
+    """ Test segment-wise multi-taper PSD computation """
+    rng = np.random.RandomState(0)
+    x = rng.randn(3, 1050)
+    sfreq, n_per_seg = 250., 200
+
+    for adaptive in (False, True):
+        kwargs = dict(sfreq=sfreq, fmin=2, fmax=100, bandwidth=5.,
+                      adaptive=adaptive)
+        psd, freqs = multitaper_psd(x, n_per_seg=n_per_seg, **kwargs)
+        psds_seg = [multitaper_psd(x[:, start:start + n_per_seg], **kwargs)
+                    for start in range(0, 1000, n_per_seg)]
+        assert_array_almost_equal(freqs, psds_seg[0][1])
+        assert_array_almost_equal(psd, np.mean([p[0] for p in psds_seg], 0))
+        psd_par, _ = multitaper_psd(x, n_per_seg=n_per_seg, n_jobs=2,
+                                    **kwargs)
+        assert_array_almost_equal(psd, psd_par)
+
+    # a single segment is the full-length estimate, 1d input is kept
+    psd, freqs = multitaper_psd(x[0], sfreq, n_per_seg=x.shape[1])
+    psd_full, freqs_full = multitaper_psd(x[0], sfreq)
+    assert_array_almost_equal(psd, psd_full)
+    assert_array_almost_equal(freqs, freqs_full)
+    assert_raises(ValueError, multitaper_psd, x, sfreq, n_per_seg=2000)
@@ -1,17 +1,22 @@
 import numpy as np
 import os.path as op
-from numpy.testing import assert_array_almost_equal
-from nose.tools import assert_true
+from numpy.testing import assert_array_almost_equal, assert_allclose
+from nose.tools import assert_true, assert_raises
+from scipy import signal
 
 from mne import fiff
+from mne.fiff.array import RawArray, create_info
 from mne import Epochs
 from mne import read_events
 from mne.time_frequency import compute_raw_psd, compute_epochs_psd
+from mne.utils import _TempDir
 
 base_dir = op.join(op.dirname(__file__), '..', '..', 'fiff', 'tests', 'data')
 raw_fname = op.join(base_dir, 'test_raw.fif')
 event_fname = op.join(base_dir, 'test-eve.fif')
 
+tempdir = _TempDir()
+
 
 def test_psd():
     """Test PSD estimation
@@ -42,6 +47,57 @@ def test_psd():
     assert_true(np.sum(psds < 0) == 0)
 
 
+def test_psd_welch():
+    """Test Welch PSD against scipy on preloaded and streamed raw data
+    """
+    rng = np.random.RandomState(0)
+    sfreq, n_fft = 100., 128
+    data = rng.randn(3, 5003)
+    info = create_info(['EEG %03d' % ii for ii in range(3)], sfreq,
+                       ['eeg'] * 3)
+    raw = RawArray(data, info)
+    fname = op.join(tempdir, 'test_psd_raw.fif')
+    raw.save(fname, buffer_size_sec=1.)
+    raw_disk = fiff.Raw(fname, preload=False)
+    for n_overlap in [0, 64]:
+        freqs_sp, psds_sp = signal.welch(data, sfreq,
+                                         window=np.hanning(n_fft),
+                                         nperseg=n_fft, noverlap=n_overlap,
+                                         detrend=lambda x: x)
+        for this_raw, n_jobs in [(raw, 1), (raw_disk, 1), (raw, 2)]:
+            psds, freqs = compute_raw_psd(this_raw, NFFT=n_fft,
+                                          n_overlap=n_overlap, n_jobs=n_jobs)
+            assert_array_almost_equal(freqs, freqs_sp)
+            assert_array_almost_equal(psds / psds_sp, np.ones(psds.shape))
+
+    # median and mean give the same level on white noise
+    psds_mean, _ = compute_raw_psd(raw, NFFT=n_fft, fmin=1, fmax=40)
+    psds_median, freqs = compute_raw_psd(raw, NFFT=n_fft, average='median',
+                                         fmin=1, fmax=40)
+    assert_true(psds_median.shape == (3, len(freqs)))
+    level = psds_mean.mean(axis=1)
+    assert_allclose(psds_median.mean(axis=1), level, rtol=0.05)
+
+    # median is robust to a transient artifact
+    data[:, 1000:1100] += 1e3 * rng.randn(3, 100)
+    raw = RawArray(data, info)
+    psds_mean, _ = compute_raw_psd(raw, NFFT=n_fft, fmin=1, fmax=40)
+    psds_median, freqs = compute_raw_psd(raw, NFFT=n_fft, average='median',
+                                         window='hamming', fmin=1, fmax=40)
+    assert_allclose(psds_median.mean(axis=1), level, rtol=0.1)
+    assert_true(np.all(psds_mean.mean(axis=1) > 100 * level))
+
+    # short segments are zero padded
+    psds, freqs = compute_raw_psd(raw, tmin=0., tmax=0.5, NFFT=n_fft)
+    assert_true(psds.shape == (3, n_fft // 2 + 1))
+
+    assert_raises(ValueError, compute_raw_psd, raw, NFFT=n_fft,
+                  n_overlap=n_fft)
+    assert_raises(ValueError, compute_raw_psd, raw, average='foo')
+    assert_raises(ValueError, compute_raw_psd, raw, NFFT=n_fft,
+                  window=np.ones(10))
+
+
 def test_psd_epochs():
     """Test PSD estimation on epochs
     """
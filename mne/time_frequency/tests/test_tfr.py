@@ -1,11 +1,11 @@
 import numpy as np
 import os.path as op
 from numpy.testing import assert_array_almost_equal
-from nose.tools import assert_true
+from nose.tools import assert_true, assert_raises
 
 from mne import fiff, Epochs, read_events
 from mne.time_frequency import induced_power, single_trial_power
-from mne.time_frequency.tfr import cwt_morlet, morlet
+from mne.time_frequency.tfr import cwt_morlet, morlet, cwt, _cwt_fft
 
 raw_fname = op.join(op.dirname(__file__), '..', '..', 'fiff', 'tests', 'data',
                     'test_raw.fif')
@@ -22,6 +22,63 @@ def test_morlet():
     assert_true(np.abs(np.mean(np.real(W[0]))) > 1e-3)
 
 
+def test_cwt():
+    """Test decimated FFT-based CWT against temporal convolutions"""
+    rng = np.random.RandomState(0)
+    X = rng.randn(5, 201)
+    Ws = morlet(100., [5., 12., 30.], n_cycles=[2., 3., 5.])
+    Ws.append(rng.randn(10) + 1j * rng.randn(10))  # even length
+    for mode in ['same', 'valid']:
+        tfr = cwt(X, Ws, use_fft=False, mode=mode)
+        assert_true(tfr.shape == (5, 4, 201))
+        for decim in [1, 3, 4]:
+            tfr_fft = cwt(X, Ws, use_fft=True, mode=mode, decim=decim)
+            assert_array_almost_equal(tfr_fft, tfr[..., ::decim])
+            assert_array_almost_equal(cwt(X, Ws, use_fft=False, mode=mode,
+                                          decim=decim), tfr[..., ::decim])
+        # single precision output
+        tfr_fft = np.array(list(_cwt_fft(X.astype(np.float32), Ws, mode,
+                                         decim=2, dtype=np.complex64)))
+        assert_true(tfr_fft.dtype == np.complex64)
+        assert_array_almost_equal(tfr_fft, tfr[..., ::2], decimal=4)
+    # complex signals
+    Xc = X + 1j * rng.randn(*X.shape)
+    assert_array_almost_equal(cwt(Xc, Ws, use_fft=True, decim=2),
+                              cwt(Xc, Ws, use_fft=False, decim=2))
+    assert_raises(ValueError, cwt, X, Ws, mode='full')
+    assert_raises(ValueError, cwt, X[:, :5], Ws)
+
+    # power of single trials and induced power
+    data = rng.randn(4, 3, 200)
+    kwargs = dict(Fs=100., frequencies=[10., 20.], n_cycles=3, decim=3)
+    power = single_trial_power(data, **kwargs)
+    assert_true(power.shape == (4, 3, 2, 67))
+    assert_array_almost_equal(single_trial_power(data, n_jobs=2, **kwargs),
+                              power)
+    assert_array_almost_equal(single_trial_power(data, use_fft=False,
+                                                 **kwargs), power)
+    psd, plf = induced_power(data, **kwargs)
+    assert_array_almost_equal(psd, power.mean(axis=0))
+    assert_true(plf.shape == psd.shape)
+
+    # single precision
+    power_32 = single_trial_power(data, dtype=np.complex64, **kwargs)
+    assert_true(power_32.dtype == np.float32)
+    assert_array_almost_equal(power_32 / power.max(), power / power.max(),
+                              decimal=5)
+    for n_jobs in [1, 2]:
+        psd_32, plf_32 = induced_power(data, dtype=np.complex64,
+                                       n_jobs=n_jobs, **kwargs)
+        assert_true(psd_32.dtype == np.float32)
+        assert_true(plf_32.dtype == np.float32)
+        assert_array_almost_equal(psd_32 / psd.max(), psd / psd.max(),
+                                  decimal=5)
+        assert_array_almost_equal(plf_32, plf, decimal=4)
+    tfr_32 = cwt(X, Ws, use_fft=False, dtype=np.complex64)
+    assert_true(tfr_32.dtype == np.complex64)
+    assert_raises(ValueError, cwt, X, Ws, dtype=np.float32)
+
+
 def test_time_frequency():
     """Test time frequency transform (PSD and phase lock)
     """
@@ -10,7 +10,7 @@ inspired by Matlab code from Sheraz Khan & Brainstorm & SPM
 from math import sqrt
 import numpy as np
 from scipy import linalg
-from scipy.fftpack import fftn, ifftn
+from scipy.fftpack import fftn, ifft
 
 from ..baseline import rescale
 from ..parallel import parallel_func
@@ -74,62 +74,111 @@ def morlet(Fs, freqs, n_cycles=7, sigma=None, zero_mean=False):
     return Ws
 
 
-def _centered(arr, newsize):
-    # Return the center newsize portion of the array.
-    newsize = np.asarray(newsize)
-    currsize = np.array(arr.shape)
-    startind = (currsize - newsize) // 2
-    endind = startind + newsize
-    myslice = [slice(startind[k], endind[k]) for k in range(len(endind))]
-    return arr[tuple(myslice)]
+def _check_cwt_mode(mode):
+    """Aux function to check the convolution mode"""
+    if mode not in ('same', 'valid'):
+        raise ValueError("mode must be 'same' or 'valid', got %s" % mode)
 
 
-def _cwt_fft(X, Ws, mode="same"):
+def _check_complex_dtype(dtype):
+    """Check the dtype of spectra and get the corresponding real dtype"""
+    dtype = np.dtype(dtype)
+    if dtype == np.complex64:
+        return dtype, np.dtype(np.float32)
+    elif dtype == np.complex128:
+        return dtype, np.dtype(np.float64)
+    raise ValueError('dtype must be np.complex64 or np.complex128, got %s'
+                     % dtype)
+
+
+def _cwt_fft(X, Ws, mode="same", decim=1, dtype=np.complex128):
     """Compute cwt with fft based convolutions
     Return a generator over signals.
+
+    The signals are transformed in blocks: the real-input FFTs of a block
+    of signals are multiplied with the stacked FFTs of all wavelets at
+    once. Only the output samples kept after decimation are computed by
+    folding the spectra (the FFT length is a multiple of decim) before the
+    inverse FFTs.
     """
     X = np.asarray(X)
+    _check_cwt_mode(mode)
+    dtype, _ = _check_complex_dtype(dtype)
 
     # Precompute wavelets for given frequency range to save time
     n_signals, n_times = X.shape
     n_freqs = len(Ws)
+    n_times_out = len(range(0, n_times, decim))
 
     Ws_max_size = max(W.size for W in Ws)
     size = n_times + Ws_max_size - 1
-    # Always use 2**n-sized FFT
-    fsize = 2 ** int(np.ceil(np.log2(size)))
+    # Always use 2**n-sized FFT times the decimation factor
+    n_fold = 2 ** int(np.ceil(np.log2(max(float(size) / decim, 2.))))
+    fsize = decim * n_fold
 
-    # precompute FFTs of Ws
+    # precompute FFTs of Ws, shifted such that the first output sample
+    # corresponds to the first kept sample and scaled for the folding
+    k = np.arange(fsize)
     fft_Ws = np.empty((n_freqs, fsize), dtype=np.complex128)
+    valid = np.ones((n_freqs, n_times_out), dtype=np.bool)
     for i, W in enumerate(Ws):
         if len(W) > n_times:
             raise ValueError('Wavelet is too long for such a short signal. '
                              'Reduce the number of cycles.')
+        if mode == 'valid':
+            sz = abs(W.size - n_times) + 1
+            offset = (n_times - sz) // 2
+            shift = W.size - 1 - offset
+            times = np.arange(0, n_times, decim)
+            valid[i] = (times >= offset) & (times < offset + sz)
+        else:
+            shift = (W.size - 1) // 2
         fft_Ws[i] = fftn(W, [fsize])
-
-    for k, x in enumerate(X):
-        if mode == "full":
-            tfr = np.zeros((n_freqs, fsize), dtype=np.complex128)
-        elif mode == "same" or mode == "valid":
-            tfr = np.zeros((n_freqs, n_times), dtype=np.complex128)
-
-        fft_x = fftn(x, [fsize])
-        for i, W in enumerate(Ws):
-            ret = ifftn(fft_x * fft_Ws[i])[:n_times + W.size - 1]
-            if mode == "valid":
-                sz = abs(W.size - n_times) + 1
-                offset = (n_times - sz) / 2
-                tfr[i, offset:(offset + sz)] = _centered(ret, sz)
-            else:
-                tfr[i, :] = _centered(ret, n_times)
-        yield tfr
-
-
-def _cwt_convolve(X, Ws, mode='same'):
+        fft_Ws[i] *= np.exp(2j * np.pi * k * shift / fsize) / decim
+    fft_Ws = fft_Ws.reshape(n_freqs, decim, n_fold).astype(dtype)
+    all_valid = np.all(valid)
+
+    # process blocks of ~ 2 ** 20 complex values at once
+    block_size = max(1, int(2 ** 20 // (n_freqs * n_fold)))
+    real_input = not np.iscomplexobj(X)
+    for start in range(0, n_signals, block_size):
+        x = X[start:start + block_size]
+        if real_input:
+            fft_x_half = np.fft.rfft(x, fsize, axis=-1)
+            fft_x = np.empty((len(x), fsize), dtype=dtype)
+            n_half = fft_x_half.shape[1]
+            fft_x[:, :n_half] = fft_x_half
+            fft_x[:, n_half:] = np.conj(fft_x_half[:, 1:fsize - n_half + 1]
+                                        [:, ::-1])
+            del fft_x_half
+        else:
+            fft_x = fftn(x, [fsize], axes=[-1]).astype(dtype)
+        fft_x = fft_x.reshape(len(x), decim, n_fold)
+
+        # fold the products of the spectra to get the decimated samples
+        tfr = fft_x[:, np.newaxis, 0] * fft_Ws[np.newaxis, :, 0]
+        if decim > 1:
+            tmp = np.empty_like(tfr)
+            for q in range(1, decim):
+                np.multiply(fft_x[:, np.newaxis, q],
+                            fft_Ws[np.newaxis, :, q], tmp)
+                tfr += tmp
+            del tmp
+        del fft_x
+        tfr = ifft(tfr, axis=-1, overwrite_x=True)[..., :n_times_out]
+        if not all_valid:
+            tfr[:, np.logical_not(valid)] = 0.
+        for this_tfr in tfr:
+            yield this_tfr
+
+
+def _cwt_convolve(X, Ws, mode='same', decim=1, dtype=np.complex128):
     """Compute time freq decomposition with temporal convolutions
     Return a generator over signals.
     """
     X = np.asarray(X)
+    _check_cwt_mode(mode)
+    dtype, _ = _check_complex_dtype(dtype)
 
     n_signals, n_times = X.shape
     n_freqs = len(Ws)
@@ -144,14 +193,25 @@ def _cwt_convolve(X, Ws, mode='same'):
                                  'signal. Reduce the number of cycles.')
             if mode == "valid":
                 sz = abs(W.size - n_times) + 1
-                offset = (n_times - sz) / 2
+                offset = (n_times - sz) // 2
                 tfr[i, offset:(offset + sz)] = ret
             else:
                 tfr[i] = ret
-        yield tfr
+        yield tfr[:, ::decim].astype(dtype)
 
 
-def cwt_morlet(X, Fs, freqs, use_fft=True, n_cycles=7.0, zero_mean=False):
+def _cwt(X, Ws, use_fft=True, mode='same', decim=1, dtype=np.complex128):
+    """Aux function to pick the cwt implementation
+    Return a generator over signals.
+    """
+    if use_fft:
+        return _cwt_fft(X, Ws, mode, decim, dtype)
+    else:
+        return _cwt_convolve(X, Ws, mode, decim, dtype)
+
+
+def cwt_morlet(X, Fs, freqs, use_fft=True, n_cycles=7.0, zero_mean=False,
+               dtype=np.complex128):
     """Compute time freq decomposition with Morlet wavelets
 
     Parameters
@@ -168,6 +228,9 @@ def cwt_morlet(X, Fs, freqs, use_fft=True, n_cycles=7.0, zero_mean=False):
         Number of cycles. Fixed number or one per frequency.
     zero_mean : bool
         Make sure the wavelets are zero mean.
+    dtype : np.complex128 | np.complex64
+        The dtype of the decompositions. Use np.complex64 to halve the
+        memory used at the expense of precision.
 
     Returns
     -------
@@ -182,19 +245,16 @@ def cwt_morlet(X, Fs, freqs, use_fft=True, n_cycles=7.0, zero_mean=False):
     # Precompute wavelets for given frequency range to save time
     Ws = morlet(Fs, freqs, n_cycles=n_cycles, zero_mean=zero_mean)
 
-    if use_fft:
-        coefs = _cwt_fft(X, Ws, mode)
-    else:
-        coefs = _cwt_convolve(X, Ws, mode)
+    coefs = _cwt(X, Ws, use_fft, mode, dtype=dtype)
 
-    tfrs = np.empty((n_signals, n_frequencies, n_times), dtype=np.complex)
+    tfrs = np.empty((n_signals, n_frequencies, n_times), dtype=dtype)
     for k, tfr in enumerate(coefs):
         tfrs[k] = tfr
 
     return tfrs
 
 
-def cwt(X, Ws, use_fft=True, mode='same', decim=1):
+def cwt(X, Ws, use_fft=True, mode='same', decim=1, dtype=np.complex128):
     """Compute time freq decomposition with continuous wavelet transform
 
     Parameters
@@ -205,10 +265,14 @@ def cwt(X, Ws, use_fft=True, mode='same', decim=1):
         Wavelets time series
     use_fft : bool
         Use FFT for convolutions
-    mode : 'same' | 'valid' | 'full'
+    mode : 'same' | 'valid'
         Convention for convolution
     decim : int
-        Temporal decimation factor
+        Temporal decimation factor. Only the decimated time samples
+        are computed.
+    dtype : np.complex128 | np.complex64
+        The dtype of the decompositions. Use np.complex64 to halve the
+        memory used at the expense of precision.
 
     Returns
     -------
@@ -218,44 +282,56 @@ def cwt(X, Ws, use_fft=True, mode='same', decim=1):
     n_signals, n_times = X[:, ::decim].shape
     n_frequencies = len(Ws)
 
-    if use_fft:
-        coefs = _cwt_fft(X, Ws, mode)
-    else:
-        coefs = _cwt_convolve(X, Ws, mode)
+    coefs = _cwt(X, Ws, use_fft, mode, decim, dtype)
 
-    tfrs = np.empty((n_signals, n_frequencies, n_times), dtype=np.complex)
+    tfrs = np.empty((n_signals, n_frequencies, n_times), dtype=dtype)
     for k, tfr in enumerate(coefs):
-        tfrs[k] = tfr[..., ::decim]
+        tfrs[k] = tfr
 
     return tfrs
 
 
-def _time_frequency(X, Ws, use_fft):
+def _time_frequency(X, Ws, use_fft, decim=1, dtype=np.complex128):
     """Aux of time_frequency for parallel computing over channels
     """
-    n_epochs, n_times = X.shape
+    dtype, real_dtype = _check_complex_dtype(dtype)
+    n_epochs, n_times = X[:, ::decim].shape
     n_frequencies = len(Ws)
+    # sum over the epochs in double precision whatever the dtype
     psd = np.zeros((n_frequencies, n_times))  # PSD
-    plf = np.zeros((n_frequencies, n_times), dtype=np.complex)  # phase lock
+    plf = np.zeros((n_frequencies, n_times), dtype=np.complex128)  # phase lock
 
     mode = 'same'
-    if use_fft:
-        tfrs = _cwt_fft(X, Ws, mode)
-    else:
-        tfrs = _cwt_convolve(X, Ws, mode)
+    tfrs = _cwt(X, Ws, use_fft, mode, decim, dtype)
 
     for tfr in tfrs:
         tfr_abs = np.abs(tfr)
         psd += tfr_abs ** 2
         plf += tfr / tfr_abs
 
-    return psd, plf
+    return psd.astype(real_dtype), plf.astype(dtype)
+
+
+def _single_trial_power(data, Ws, use_fft, mode, decim, dtype=np.complex128):
+    """Aux of single_trial_power for parallel computing over epochs
+    """
+    dtype, real_dtype = _check_complex_dtype(dtype)
+    n_epochs, n_channels, n_times = data[:, :, ::decim].shape
+    power = np.empty((n_epochs * n_channels, len(Ws), n_times),
+                     dtype=real_dtype)
+    tfrs = _cwt(data.reshape(n_epochs * n_channels, -1), Ws, use_fft, mode,
+                decim, dtype)
+    for k, tfr in enumerate(tfrs):
+        power[k] = tfr.real ** 2
+        power[k] += tfr.imag ** 2
+    return power.reshape(n_epochs, n_channels, len(Ws), n_times)
 
 
 @verbose
 def single_trial_power(data, Fs, frequencies, use_fft=True, n_cycles=7,
                        baseline=None, baseline_mode='ratio', times=None,
-                       decim=1, n_jobs=1, zero_mean=False, verbose=None):
+                       decim=1, n_jobs=1, zero_mean=False,
+                       dtype=np.complex128, verbose=None):
     """Compute time-frequency power on single epochs
 
     Parameters
@@ -292,6 +368,10 @@ def single_trial_power(data, Fs, frequencies, use_fft=True, n_cycles=7,
         The number of epochs to process at the same time
     zero_mean : bool
         Make sure the wavelets are zero mean.
+    dtype : np.complex128 | np.complex64
+        The dtype of the time-frequency decompositions. With np.complex64
+        the power is computed and returned as np.float32, which halves the
+        memory used at the expense of precision.
     verbose : bool, str, int, or None
         If not None, override default verbose level (see mne.verbose).
 
@@ -301,30 +381,29 @@ def single_trial_power(data, Fs, frequencies, use_fft=True, n_cycles=7,
         Power estimate (Epochs x Channels x Frequencies x Timepoints).
     """
     mode = 'same'
+    dtype, real_dtype = _check_complex_dtype(dtype)
     n_frequencies = len(frequencies)
     n_epochs, n_channels, n_times = data[:, :, ::decim].shape
 
     # Precompute wavelets for given frequency range to save time
     Ws = morlet(Fs, frequencies, n_cycles=n_cycles, zero_mean=zero_mean)
 
-    parallel, my_cwt, _ = parallel_func(cwt, n_jobs)
+    parallel, my_power, _ = parallel_func(_single_trial_power, n_jobs)
 
     logger.info("Computing time-frequency power on single epochs...")
 
-    power = np.empty((n_epochs, n_channels, n_frequencies, n_times),
-                     dtype=np.float)
-
-    # Package arguments for `cwt` here to minimize omissions where only one of
-    # the two calls below is updated with new function arguments.
-    cwt_kw = dict(Ws=Ws, use_fft=use_fft, mode=mode, decim=decim)
     if n_jobs == 1:
-        for k, e in enumerate(data):
-            power[k] = np.abs(cwt(e, **cwt_kw)) ** 2
+        power = _single_trial_power(data, Ws, use_fft, mode, decim, dtype)
     else:
-        # Precompute tf decompositions in parallel
-        tfrs = parallel(my_cwt(e, **cwt_kw) for e in data)
-        for k, tfr in enumerate(tfrs):
-            power[k] = np.abs(tfr) ** 2
+        # Compute the power of groups of epochs in parallel
+        power = np.empty((n_epochs, n_channels, n_frequencies, n_times),
+                         dtype=real_dtype)
+        idx = [ii for ii in np.array_split(np.arange(n_epochs), n_jobs)
+               if len(ii) > 0]
+        out = parallel(my_power(data[ii], Ws, use_fft, mode, decim, dtype)
+                       for ii in idx)
+        for ii, this_power in zip(idx, out):
+            power[ii] = this_power
 
     # Run baseline correction.  Be sure to decimate the times array as well if
     # needed.
@@ -335,7 +414,7 @@ def single_trial_power(data, Fs, frequencies, use_fft=True, n_cycles=7,
 
 
 def induced_power(data, Fs, frequencies, use_fft=True, n_cycles=7,
-                  decim=1, n_jobs=1, zero_mean=False):
+                  decim=1, n_jobs=1, zero_mean=False, dtype=np.complex128):
     """Compute time induced power and inter-trial phase-locking factor
 
     The time frequency decomposition is done with Morlet wavelets
@@ -360,6 +439,9 @@ def induced_power(data, Fs, frequencies, use_fft=True, n_cycles=7,
         Requires joblib package.
     zero_mean : bool
         Make sure the wavelets are zero mean.
+    dtype : np.complex128 | np.complex64
+        The dtype of the time-frequency decompositions. With np.complex64
+        power and phase locking are returned as np.float32.
 
     Returns
     -------
@@ -375,25 +457,25 @@ def induced_power(data, Fs, frequencies, use_fft=True, n_cycles=7,
     # Precompute wavelets for given frequency range to save time
     Ws = morlet(Fs, frequencies, n_cycles=n_cycles, zero_mean=zero_mean)
 
+    dtype, real_dtype = _check_complex_dtype(dtype)
     if n_jobs == 1:
-        psd = np.empty((n_channels, n_frequencies, n_times))
-        plf = np.empty((n_channels, n_frequencies, n_times), dtype=np.complex)
+        psd = np.empty((n_channels, n_frequencies, n_times), dtype=real_dtype)
+        plf = np.empty((n_channels, n_frequencies, n_times), dtype=dtype)
 
         for c in range(n_channels):
             X = np.squeeze(data[:, c, :])
-            this_psd, this_plf = _time_frequency(X, Ws, use_fft)
-            psd[c], plf[c] = this_psd[:, ::decim], this_plf[:, ::decim]
+            psd[c], plf[c] = _time_frequency(X, Ws, use_fft, decim, dtype)
     else:
         parallel, my_time_frequency, _ = parallel_func(_time_frequency, n_jobs)
 
         psd_plf = parallel(my_time_frequency(np.squeeze(data[:, c, :]),
-                                             Ws, use_fft)
+                                             Ws, use_fft, decim, dtype)
                            for c in range(n_channels))
 
-        psd = np.zeros((n_channels, n_frequencies, n_times))
-        plf = np.zeros((n_channels, n_frequencies, n_times), dtype=np.complex)
+        psd = np.zeros((n_channels, n_frequencies, n_times), dtype=real_dtype)
+        plf = np.zeros((n_channels, n_frequencies, n_times), dtype=dtype)
         for c, (psd_c, plf_c) in enumerate(psd_plf):
-            psd[c, :, :], plf[c, :, :] = psd_c[:, ::decim], plf_c[:, ::decim]
+            psd[c, :, :], plf[c, :, :] = psd_c, plf_c
 
     psd /= n_epochs
     plf = np.abs(plf) / n_epochs
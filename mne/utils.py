@@ -871,6 +871,8 @@ known_config_types = [
     'MNE_USE_CUDA',
     'SUBJECTS_DIR',
     'MNE_CACHE_DIR',
+    'MNE_CACHE_DPSS',
+    'MNE_CACHE_BEM_SENSORS',
     'MNE_MEMMAP_MIN_SIZE',
     'MNE_SKIP_SAMPLE_DATASET_TESTS',
     'MNE_DATASETS_SPM_FACE_DATASETS_TESTS'